@@ -0,0 +1,242 @@
+"""
+Resumable chunked uploads for large patient documents
+
+Protocol:
+1. init      - declare name, type, total size and SHA-256; returns an upload_id
+2. put chunk - send bytes at an offset; the offset must equal received_bytes
+3. complete  - once every byte has arrived the staged file is hashed, streamed to
+               default_storage, recorded as a PatientHistoryDocs row and queued for OCR
+
+A dropped connection keeps whatever bytes were received, so the client asks for
+the session status and resumes from received_bytes instead of starting over.
+"""
+import os
+import hashlib
+import logging
+import tempfile
+from typing import Dict
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from .models import DocumentUploadSession, PatientHistoryDocs
+from .document_storage import save_patient_document
+from .tasks import enqueue_document_ocr
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+SPOOL_MEMORY_SIZE = 1024 * 1024  # larger chunks spill to a temp file in the staging dir
+
+
+class ChunkedUploadService:
+    """
+    Service for the init / put-chunk / complete upload protocol
+
+    Failed calls return {'success': False, 'error': ..., 'error_code': ...} where
+    error_code is one of 'not_found', 'conflict' or 'invalid'.
+    """
+
+    def __init__(self):
+        self.staging_dir = getattr(
+            settings, 'DOCUMENT_UPLOAD_STAGING_DIR',
+            os.path.join(tempfile.gettempdir(), 'hms_upload_staging')
+        )
+        self.max_chunk_size = getattr(settings, 'DOCUMENT_UPLOAD_MAX_CHUNK_SIZE', 16 * 1024 * 1024)
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+    def staging_path(self, session: DocumentUploadSession) -> str:
+        return os.path.join(self.staging_dir, f"{session.upload_id}.part")
+
+    def create_session(self, patient_id: int, document_name: str, document_type: str,
+                       total_size: int, sha256: str) -> DocumentUploadSession:
+        """
+        Start a new upload and create its empty staging file
+        """
+        session = DocumentUploadSession.objects.create(
+            patient_id=patient_id,
+            document_name=os.path.basename(document_name),
+            document_type=document_type,
+            total_size=total_size,
+            sha256=sha256,
+        )
+        open(self.staging_path(session), 'wb').close()
+        logger.info(f"Started chunked upload {session.upload_id} for patient {patient_id}")
+        return session
+
+    def append_chunk(self, upload_id, offset: int, stream, length: int) -> Dict:
+        """
+        Write ``length`` bytes read from ``stream`` at ``offset``
+
+        Args:
+            upload_id: DocumentUploadSession id
+            offset: Byte offset of the chunk; must equal the bytes received so far
+            stream: File-like object (the raw request body)
+            length: Chunk length from Content-Length
+
+        Returns:
+            Dict with the updated session
+        """
+        if length <= 0:
+            return self._error('Chunk is empty', 'invalid')
+        if length > self.max_chunk_size:
+            return self._error(f'Chunk exceeds the maximum size of {self.max_chunk_size} bytes', 'invalid')
+
+        # Reject a wrong offset before reading a body that would be thrown away
+        session = DocumentUploadSession.objects.filter(upload_id=upload_id).first()
+        if session is None:
+            return self._error('Upload not found', 'not_found')
+        error = self._check_chunk(session, offset, length)
+        if error:
+            return error
+
+        # The body arrives at the client's pace, so it is staged before any
+        # transaction starts; the row lock is held only for a local copy
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_SIZE, dir=self.staging_dir) as spool:
+            received = 0
+            try:
+                while received < length:
+                    data = stream.read(min(READ_SIZE, length - received))
+                    if not data:
+                        break
+                    spool.write(data)
+                    received += len(data)
+            except OSError as e:
+                # Client went away mid-chunk: keep what arrived so it can resume
+                logger.warning(f"Chunk for upload {upload_id} interrupted after {received} bytes: {str(e)}")
+            if not received:
+                return self._error('Chunk is empty', 'invalid', session)
+            spool.seek(0)
+
+            with transaction.atomic():
+                # Row lock serialises concurrent PUTs for the same upload
+                try:
+                    session = DocumentUploadSession.objects.select_for_update().get(upload_id=upload_id)
+                except DocumentUploadSession.DoesNotExist:
+                    return self._error('Upload not found', 'not_found')
+                # Another PUT may have landed while this body was arriving
+                error = self._check_chunk(session, offset, received)
+                if error:
+                    return error
+
+                with open(self.staging_path(session), 'r+b') as staged:
+                    staged.seek(offset)
+                    for block in iter(lambda: spool.read(READ_SIZE), b''):
+                        staged.write(block)
+
+                session.received_bytes = offset + received
+                session.save(update_fields=['received_bytes', 'updated_at'])
+
+        return {'success': True, 'session': session}
+
+    def _check_chunk(self, session: DocumentUploadSession, offset: int, length: int):
+        if session.status != 'uploading':
+            return self._error(f'Upload is {session.status}', 'conflict', session)
+        if offset != session.received_bytes:
+            return self._error(
+                f'Expected offset {session.received_bytes}, got {offset}', 'conflict', session
+            )
+        if offset + length > session.total_size:
+            return self._error('Chunk extends past the declared file size', 'invalid', session)
+        return None
+
+    def complete(self, upload_id) -> Dict:
+        """
+        Verify the staged file, move it to storage and queue it for OCR
+
+        Hashing and the copy to storage run outside any transaction (they take
+        as long as the file is large); the row is locked again only to record
+        the document. Completing an already completed upload returns the same
+        document.
+        """
+        session = DocumentUploadSession.objects.filter(upload_id=upload_id).first()
+        if session is None:
+            return self._error('Upload not found', 'not_found')
+        if session.status == 'completed':
+            return self._completed(session)
+        error = self._check_complete(session)
+        if error:
+            return error
+
+        staging_path = self.staging_path(session)
+        try:
+            digest = self._file_sha256(staging_path)
+        except FileNotFoundError:
+            # A concurrent complete finished (or failed) first
+            session.refresh_from_db()
+            if session.status == 'completed':
+                return self._completed(session)
+            return self._check_complete(session) or self._error('Upload is being completed', 'conflict', session)
+        if digest != session.sha256:
+            with transaction.atomic():
+                session = DocumentUploadSession.objects.select_for_update().get(upload_id=upload_id)
+                if session.status == 'uploading':
+                    session.status = 'failed'
+                    session.save(update_fields=['status', 'updated_at'])
+            self._remove_staged(staging_path)
+            logger.error(f"Checksum mismatch for upload {upload_id}")
+            return self._error('SHA-256 mismatch; the upload must be restarted', 'invalid', session)
+
+        with open(staging_path, 'rb') as staged:
+            file_path = save_patient_document(File(staged), session.patient_id, session.document_name)
+
+        try:
+            with transaction.atomic():
+                session = DocumentUploadSession.objects.select_for_update().get(upload_id=upload_id)
+                if session.status != 'uploading':
+                    # Another complete got there first; its document stands
+                    default_storage.delete(file_path)
+                    if session.status == 'completed':
+                        return self._completed(session)
+                    return self._check_complete(session)
+                doc = PatientHistoryDocs.objects.create(
+                    patient_id=session.patient_id,
+                    document_type=session.document_type,
+                    document_name=session.document_name,
+                    document_url=file_path,
+                    document_processed=False
+                )
+                session.status = 'completed'
+                session.document = doc
+                session.save(update_fields=['status', 'document', 'updated_at'])
+                enqueue_document_ocr(session.patient_id)
+        except Exception:
+            # Don't leave an object in storage that no row points to
+            default_storage.delete(file_path)
+            raise
+
+        self._remove_staged(staging_path)
+        logger.info(f"Completed chunked upload {upload_id} as document {doc.doc_id}")
+        return {'success': True, 'session': session, 'document': doc}
+
+    def _completed(self, session: DocumentUploadSession) -> Dict:
+        return {'success': True, 'session': session, 'document': session.document}
+
+    def _check_complete(self, session: DocumentUploadSession):
+        if session.status != 'uploading':
+            return self._error(f'Upload is {session.status}', 'conflict', session)
+        if session.received_bytes != session.total_size:
+            return self._error(
+                f'Upload incomplete: {session.received_bytes} of {session.total_size} bytes received',
+                'conflict', session
+            )
+        return None
+
+    def _remove_staged(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _file_sha256(self, path: str) -> str:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as staged:
+            for block in iter(lambda: staged.read(1024 * 1024), b''):
+                sha.update(block)
+        return sha.hexdigest()
+
+    def _error(self, message: str, error_code: str, session: DocumentUploadSession = None) -> Dict:
+        result = {'success': False, 'error': message, 'error_code': error_code}
+        if session is not None:
+            result['session'] = session
+        return result
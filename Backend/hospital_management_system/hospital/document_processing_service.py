@@ -1,13 +1,14 @@
 """
 Document Processing Service for handling patient document uploads and OCR processing
 """
-import os
 import logging
 from typing import List, Dict, Optional
-from django.core.files.storage import default_storage
-from django.conf import settings
+from django.db.models import Count, Q
 from .models import Patient, PatientHistory, PatientHistoryDocs
+from .pagination import keyset_page
+from .document_storage import local_document_path, save_patient_document
 from .ocr_service import GeminiOCRService
+from .search_index import ClinicalTextIndex
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +19,7 @@ class DocumentProcessingService:
     
     def __init__(self):
         self.ocr_service = GeminiOCRService()
+        self.search_index = ClinicalTextIndex()
     
     def upload_documents(self, patient_id: int, files: List, document_types: List[str] = None) -> Dict:
         """
@@ -185,11 +187,8 @@ class DocumentProcessingService:
             Dict with processing result
         """
         try:
-            # Get absolute file path
-            file_path = self._get_absolute_file_path(doc.document_url)
-            
-            if not os.path.exists(file_path):
-                raise FileNotFoundError(f"Document file not found: {file_path}")
+            # Local path for OCR; remote storage is streamed into the spill cache
+            file_path = local_document_path(doc.document_url)
             
             # Process with OCR
             ocr_result = self.ocr_service.process_document(
@@ -235,6 +234,12 @@ class DocumentProcessingService:
             patient_history.notes = updated_notes
             patient_history.save()
             
+            # Index the newly extracted text for full-text search
+            try:
+                self.search_index.index_ocr_result(doc, ocr_result)
+            except Exception as e:
+                logger.warning(f"Could not index extracted text for document {doc.doc_id}: {str(e)}")
+            
             # Mark document as processed
             doc.document_processed = True
             doc.document_remarks = f"Successfully processed. Confidence: {ocr_result.get('confidence', 'unknown')}"
@@ -255,49 +260,41 @@ class DocumentProcessingService:
                 'error': str(e)
             }
     
-    def get_patient_consolidated_history(self, patient_id: int) -> Dict:
+    def get_patient_consolidated_history(self, patient_id: int, include_history: bool = True,
+                                         cursor: Optional[str] = None, limit: int = 50) -> Dict:
         """
         Get consolidated medical history for a patient
         
         Args:
             patient_id: ID of the patient
+            include_history: Whether to return the history/allergies/notes JSON
+            cursor: Keyset cursor returned as next_cursor by the previous page
+            limit: Maximum number of documents to return
         
         Returns:
-            Dict with consolidated history and related documents
+            Dict with consolidated history and one page of related documents
         """
         try:
             patient = Patient.objects.get(patient_id=patient_id)
             
             # Get patient history
-            try:
-                patient_history = PatientHistory.objects.get(patient=patient)
+            histories = PatientHistory.objects.filter(patient=patient)
+            if not include_history:
+                histories = histories.only('history_id', 'updated_at')
+            patient_history = histories.first()
+            
+            if include_history:
                 history_data = {
-                    'history': patient_history.history,
-                    'allergies': patient_history.allergies,
-                    'notes': patient_history.notes,
-                    'last_updated': patient_history.updated_at.isoformat()
+                    'history': patient_history.history if patient_history else {},
+                    'allergies': patient_history.allergies if patient_history else [],
+                    'notes': patient_history.notes if patient_history else [],
                 }
-            except PatientHistory.DoesNotExist:
-                history_data = {
-                    'history': {},
-                    'allergies': [],
-                    'notes': [],
-                    'last_updated': None
-                }
-            
-            # Get all related documents
-            documents = PatientHistoryDocs.objects.filter(patient=patient).order_by('-created_at')
-            doc_data = []
+            else:
+                history_data = {}
+            history_data['last_updated'] = patient_history.updated_at.isoformat() if patient_history else None
             
-            for doc in documents:
-                doc_data.append({
-                    'doc_id': doc.doc_id,
-                    'document_type': doc.document_type,
-                    'document_name': doc.document_name,
-                    'document_processed': doc.document_processed,
-                    'created_at': doc.created_at.isoformat(),
-                    'document_remarks': doc.document_remarks
-                })
+            counts = self._document_counts(patient)
+            doc_data, next_cursor = self._document_page(patient, cursor, limit)
             
             return {
                 'success': True,
@@ -307,9 +304,21 @@ class DocumentProcessingService:
                     'patient_email': patient.patient_email
                 },
                 'medical_history': history_data,
-                'documents': doc_data,
-                'total_documents': len(doc_data),
-                'processed_documents': len([d for d in doc_data if d['document_processed']])
+                'documents': [
+                    {
+                        'doc_id': doc['doc_id'],
+                        'document_type': doc['document_type'],
+                        'document_name': doc['document_name'],
+                        'document_processed': doc['document_processed'],
+                        'created_at': doc['created_at'].isoformat(),
+                        'document_remarks': doc['document_remarks']
+                    }
+                    for doc in doc_data
+                ],
+                'total_documents': counts['total'],
+                'processed_documents': counts['processed'],
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None
             }
             
         except Patient.DoesNotExist:
@@ -317,6 +326,11 @@ class DocumentProcessingService:
                 'success': False,
                 'error': f'Patient with ID {patient_id} not found'
             }
+        except ValueError as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
         except Exception as e:
             logger.error(f"Error getting consolidated history for patient {patient_id}: {str(e)}")
             return {
@@ -324,64 +338,77 @@ class DocumentProcessingService:
                 'error': str(e)
             }
     
-    def _save_uploaded_file(self, file, patient_id: int) -> str:
+    def _document_counts(self, patient: Patient) -> Dict:
         """
-        Save uploaded file to storage and return the file path
+        Total and processed document counts in a single conditional-aggregate query
         """
-        # Create directory structure: patient_documents/patient_id/
-        upload_path = f"patient_documents/{patient_id}/"
-        
-        # Generate unique filename to avoid conflicts
-        from datetime import datetime
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{timestamp}_{file.name}"
-        
-        full_path = f"{upload_path}{filename}"
-        
-        # Save file
-        saved_path = default_storage.save(full_path, file)
-        
-        return saved_path
+        counts = PatientHistoryDocs.objects.filter(patient=patient).aggregate(
+            total=Count('doc_id'),
+            processed=Count('doc_id', filter=Q(document_processed=True))
+        )
+        return counts
     
-    def _get_absolute_file_path(self, relative_path: str) -> str:
+    def _document_page(self, patient: Patient, cursor: Optional[str], limit: int):
         """
-        Convert relative storage path to absolute file system path
+        One keyset page of a patient's documents, newest first
         """
-        media_root = getattr(settings, 'MEDIA_ROOT', '')
-        return os.path.join(media_root, relative_path)
+        documents = PatientHistoryDocs.objects.filter(patient=patient).values(
+            'doc_id', 'document_type', 'document_name', 'document_processed',
+            'created_at', 'document_remarks'
+        )
+        return keyset_page(documents, ['-created_at', '-doc_id'], cursor, limit)
     
-    def get_document_processing_status(self, patient_id: int) -> Dict:
+    def _save_uploaded_file(self, file, patient_id: int) -> str:
         """
-        Get processing status for all documents of a patient
+        Save uploaded file to storage and return the file path
+        """
+        return save_patient_document(file, patient_id, file.name)
+    
+    def get_document_processing_status(self, patient_id: int, include_documents: bool = True,
+                                       cursor: Optional[str] = None, limit: int = 50) -> Dict:
+        """
+        Get processing status for a patient's documents
+        
+        Args:
+            patient_id: ID of the patient
+            include_documents: Whether to return a page of per-document status rows
+            cursor: Keyset cursor returned as next_cursor by the previous page
+            limit: Maximum number of documents to return
         """
         try:
             patient = Patient.objects.get(patient_id=patient_id)
             
-            documents = PatientHistoryDocs.objects.filter(patient=patient)
-            total_docs = documents.count()
-            processed_docs = documents.filter(document_processed=True).count()
-            
-            status_data = []
-            for doc in documents.order_by('-created_at'):
-                status_data.append({
-                    'doc_id': doc.doc_id,
-                    'document_name': doc.document_name,
-                    'document_type': doc.document_type,
-                    'processed': doc.document_processed,
-                    'created_at': doc.created_at.isoformat(),
-                    'remarks': doc.document_remarks
-                })
+            counts = self._document_counts(patient)
+            total_docs = counts['total']
+            processed_docs = counts['processed']
             
-            return {
+            result = {
                 'success': True,
                 'patient_id': patient_id,
                 'total_documents': total_docs,
                 'processed_documents': processed_docs,
                 'pending_documents': total_docs - processed_docs,
-                'processing_complete': processed_docs == total_docs,
-                'documents': status_data
+                'processing_complete': processed_docs == total_docs
             }
             
+            if include_documents:
+                documents, next_cursor = self._document_page(patient, cursor, limit)
+                result['documents'] = [
+                    {
+                        'doc_id': doc['doc_id'],
+                        'document_name': doc['document_name'],
+                        'document_type': doc['document_type'],
+                        'processed': doc['document_processed'],
+                        'created_at': doc['created_at'].isoformat(),
+                        'remarks': doc['document_remarks']
+                    }
+                    for doc in documents
+                ]
+                result['next_cursor'] = next_cursor
+                result['has_more'] = next_cursor is not None
+            
+            return result
+            
         except Patient.DoesNotExist:
             return {
                 'success': False,
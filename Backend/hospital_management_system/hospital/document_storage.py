@@ -0,0 +1,166 @@
+"""
+Storage-agnostic access to uploaded patient documents
+
+Documents are always read through ``default_storage`` so the OCR pipeline works
+the same on the filesystem backend and on S3. OCR libraries (PIL, PyPDF2,
+pdf2image) need a local path, so remote files are streamed into a size-bounded
+on-disk spill cache first.
+"""
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+from datetime import datetime
+from typing import Iterator, Optional
+from django.conf import settings
+from django.core.files.storage import Storage, default_storage
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def storage_local_path(name: str, storage: Optional[Storage] = None) -> Optional[str]:
+    """
+    Return the storage's own local path for ``name``, or None for remote backends
+    """
+    storage = storage or default_storage
+    try:
+        return storage.path(name)
+    except NotImplementedError:
+        return None
+
+
+def save_patient_document(file, patient_id: int, file_name: str,
+                          storage: Optional[Storage] = None) -> str:
+    """
+    Save a document under patient_documents/<patient_id>/ and return its storage name
+
+    ``file`` is passed straight to ``storage.save`` which copies it in chunks, so
+    large files are never read into memory.
+    """
+    storage = storage or default_storage
+    # Timestamp prefix avoids collisions between uploads with the same name
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return storage.save(f"patient_documents/{patient_id}/{timestamp}_{file_name}", file)
+
+
+def iter_document_chunks(name: str, storage: Optional[Storage] = None,
+                         chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Stream a stored document without loading it into memory
+    """
+    storage = storage or default_storage
+    with storage.open(name, 'rb') as handle:
+        while True:
+            chunk = handle.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+class DocumentSpillCache:
+    """
+    LRU cache of remote documents on local disk, bounded by total size
+
+    Entries are keyed by storage name and keep the original extension, since
+    GeminiOCRService picks the image/PDF pipeline from it.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.directory = directory or getattr(
+            settings, 'DOCUMENT_SPILL_CACHE_DIR',
+            os.path.join(tempfile.gettempdir(), 'hms_document_cache')
+        )
+        self.max_bytes = max_bytes if max_bytes is not None else getattr(
+            settings, 'DOCUMENT_SPILL_CACHE_MAX_BYTES', 2 * 1024 ** 3
+        )
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _cache_path(self, name: str) -> str:
+        digest = hashlib.sha256(name.encode('utf-8')).hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(self.directory, f"{digest}{extension}")
+
+    def get_path(self, name: str, storage: Optional[Storage] = None) -> str:
+        """
+        Return a local path holding the contents of ``name``, downloading it on a miss
+        """
+        storage = storage or default_storage
+        path = self._cache_path(name)
+
+        if os.path.exists(path):
+            # Touch the mtime so eviction treats this entry as recently used
+            os.utime(path, None)
+            return path
+
+        fd, partial_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter_document_chunks(name, storage):
+                    out.write(chunk)
+            os.replace(partial_path, path)
+        except Exception:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep: Optional[str] = None):
+        """
+        Delete least recently used entries until the cache fits in max_bytes
+        """
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if not entry.is_file() or entry.name.endswith('.part'):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+
+
+_spill_cache = None
+
+
+def get_spill_cache() -> DocumentSpillCache:
+    global _spill_cache
+    if _spill_cache is None:
+        _spill_cache = DocumentSpillCache()
+    return _spill_cache
+
+
+def local_document_path(name: str, storage: Optional[Storage] = None) -> str:
+    """
+    Return a local file path for a stored document
+
+    Filesystem storage hands back its own path; anything else (S3, ...) is
+    streamed into the spill cache.
+
+    Raises:
+        FileNotFoundError: If the document is not in storage
+    """
+    storage = storage or default_storage
+    if not storage.exists(name):
+        raise FileNotFoundError(f"Document file not found: {name}")
+
+    path = storage_local_path(name, storage)
+    if path is None:
+        path = get_spill_cache().get_path(name, storage)
+    return path
@@ -13,11 +13,24 @@ from .models import (LabType, Staff, StaffDetails, DoctorDetails, LabTechnicianD
 from .permissions import IsAdminStaff
 import uuid
 import datetime
+from django.conf import settings
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import Prefetch
 from django.utils.dateparse import parse_datetime
-from transactions.models import Transaction, PaymentMethod, TransactionType, Unit, InvoiceType, Invoice
+from transactions.models import Transaction, PaymentMethod, TransactionType, Unit, InvoiceType, Invoice, InvoiceItem
+from transactions.invoice_lines import active_lab_test_charges
+from transactions.idempotency import idempotent
 import json
 import traceback
 from .serializers import LabTestSerializer, LabSerializer, RecommendedLabTestSerializer, AssignedPatientSerializer
+from machine_learning.no_show import score_appointments
+from machine_learning.early_warning import assess_day, assess_reading
+from .roster import RosterError, build_roster
+from .slots import (SlotTemplateError, apply_shift_template, apply_slot_template, listed_slot_id, parse_shift_template,
+                    parse_slot_template, resolve_slot, listed_slots)
+from .vitals import (DOWNSAMPLE_METHODS as VITALS_DOWNSAMPLE_METHODS, SERIES_FIELDS as VITALS_SERIES_FIELDS,
+                     ingest_readings, latest_vitals as get_latest_vitals, parse_ndjson, record_vitals, validate_readings,
+                     vitals_series)
 class DoctorListView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
@@ -68,19 +81,28 @@ class DoctorSlotsView(APIView):
             return Response({"error": "Invalid date format"}, status=400)
 
         # Find shifts assigned to doctor on that date
-        schedules = Schedule.objects.filter(staff__staff_id=staff_id, schedule_date=date)
+        schedules = (
+            Schedule.objects.filter(staff__staff_id=staff_id, schedule_date=date)
+            .select_related('shift')
+            .prefetch_related(Prefetch('shift__slots', queryset=Slot.objects.filter(is_active=True)))
+        )
+        # Booked slots, by the id they are listed under, in one query
+        booked = {
+            listed_slot_id(appointment.slot)
+            for appointment in Appointment.objects.filter(
+                staff__staff_id=staff_id, created_at__date=date
+            ).select_related('slot__shift')
+        }
         slots = []
         for schedule in schedules:
-            for slot in schedule.shift.slots.all():
-                # Check if slot is already booked
-                is_booked = Appointment.objects.filter(
-                    staff__staff_id=staff_id, slot=slot, created_at__date=date
-                ).exists()
+            for slot_id, start_time, duration, is_active in listed_slots(schedule.shift):
+                if not is_active:
+                    continue
                 slots.append({
-                    "slot_id": slot.slot_id,
-                    "slot_start_time": slot.slot_start_time,
-                    "slot_duration": slot.slot_duration,
-                    "is_booked": is_booked
+                    "slot_id": slot_id,
+                    "slot_start_time": start_time,
+                    "slot_duration": duration,
+                    "is_booked": slot_id in booked
                 })
         return Response(slots, status=200)
 
@@ -138,7 +160,7 @@ class BookAppointmentView(APIView):
             return Response({"error": "Missing required fields"}, status=400)
 
         try:
-            slot = Slot.objects.get(slot_id=slot_id)
+            slot = resolve_slot(slot_id)
             staff = Staff.objects.get(staff_id=staff_id)
         except (Slot.DoesNotExist, Staff.DoesNotExist):
             return Response({"error": "Invalid staff or slot"}, status=400)
@@ -245,6 +267,7 @@ class BookAppointmentWithPaymentView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
 
+    @idempotent('book_appointment_with_payment', fallback_field='transaction_reference')
     def post(self, request):
         patient = request.user
         data = request.data
@@ -264,7 +287,7 @@ class BookAppointmentWithPaymentView(APIView):
             return Response({"error": "Transaction reference is required"}, status=400)
 
         try:
-            slot = Slot.objects.get(slot_id=slot_id)
+            slot = resolve_slot(slot_id)
             staff = Staff.objects.get(staff_id=staff_id)
             payment_method = PaymentMethod.objects.get(payment_method_id=payment_method_id)
             transaction_type = TransactionType.objects.get(transaction_type_name="payment")
@@ -294,75 +317,84 @@ class BookAppointmentWithPaymentView(APIView):
         except AppointmentCharge.DoesNotExist:
             return Response({"error": "No appointment charge set for this doctor"}, status=400)
 
-        # Create transaction with the provided reference
-        transaction = Transaction.objects.create(
-            transaction_reference=transaction_reference,
-            transaction_type=transaction_type,
-            payment_method=payment_method,
-            transaction_amount=charge.charge_amount,
-            transaction_unit=charge.charge_unit,
-            transaction_status="completed",  # Assuming payment is successful
-            patient=patient,
-            transaction_details={
-                "appointment_date": date, 
-                "doctor": staff.staff_name,
-                "payment_gateway_response": data.get("payment_gateway_response", {})  # Optional additional payment details
-            }
-        )
+        invoice_type = InvoiceType.objects.filter(invoice_type_name='appointment').first()
 
-        # Create appointment
-        appointment = Appointment.objects.create(
-            patient=patient,
-            staff=staff,
-            slot=slot,
-            tran=transaction,
-            charge=charge,
-            reason=reason,
-            status='upcoming',
-            appointment_date=appointment_date  # Make sure to set the appointment date
-        )
-        
-        # Generate invoice for the appointment
+        # Payment, appointment and invoice are written together or not at all
         try:
-            invoice_type = InvoiceType.objects.get(invoice_type_name='appointment')
-            
-            # Calculate tax (assuming 5% tax)
-            tax_rate = decimal.Decimal('0.05')
-            subtotal = charge.charge_amount
-            tax = subtotal * tax_rate
-            total = subtotal + tax
-            
-            # Create invoice
-            invoice = Invoice.objects.create(
-                tran=transaction,
-                invoice_type=invoice_type,
-                patient=patient,
-                invoice_items=[appointment.appointment_id],
-                invoice_subtotal=subtotal,
-                invoice_tax=tax,
-                invoice_total=total,
-                invoice_unit=charge.charge_unit,
-                invoice_status='paid',
-                invoice_remark=f"Invoice for appointment on {appointment_date.isoformat()}"
-            )
-            
-            return Response({
-                "message": "Appointment booked and payment processed", 
-                "appointment_id": appointment.appointment_id,
-                "transaction_id": transaction.transaction_id,
-                "invoice_id": invoice.invoice_id,
-                "invoice_number": invoice.invoice_number
-            }, status=201)
-            
-        except Exception as e:
-            # If invoice creation fails, still return success for the appointment
+            with db_transaction.atomic():
+                # Create transaction with the provided reference
+                transaction = Transaction.objects.create(
+                    transaction_reference=transaction_reference,
+                    transaction_type=transaction_type,
+                    payment_method=payment_method,
+                    transaction_amount=charge.charge_amount,
+                    transaction_unit=charge.charge_unit,
+                    transaction_status="completed",  # Assuming payment is successful
+                    patient=patient,
+                    transaction_details={
+                        "appointment_date": date, 
+                        "doctor": staff.staff_name,
+                        "payment_gateway_response": data.get("payment_gateway_response", {})  # Optional additional payment details
+                    }
+                )
+
+                # Create appointment
+                appointment = Appointment.objects.create(
+                    patient=patient,
+                    staff=staff,
+                    slot=slot,
+                    tran=transaction,
+                    charge=charge,
+                    reason=reason,
+                    status='upcoming',
+                    appointment_date=appointment_date  # Make sure to set the appointment date
+                )
+
+                # Generate invoice for the appointment
+                invoice = None
+                if invoice_type is not None:
+                    # Calculate tax (assuming 5% tax)
+                    tax_rate = decimal.Decimal('0.05')
+                    subtotal = charge.charge_amount
+                    tax = subtotal * tax_rate
+                    total = subtotal + tax
+
+                    # Create invoice
+                    invoice = Invoice.objects.create(
+                        tran=transaction,
+                        invoice_type=invoice_type,
+                        patient=patient,
+                        invoice_items=[appointment.appointment_id],
+                        invoice_subtotal=subtotal,
+                        invoice_tax=tax,
+                        invoice_total=total,
+                        invoice_unit=charge.charge_unit,
+                        invoice_status='paid',
+                        invoice_remark=f"Invoice for appointment on {appointment_date.isoformat()}"
+                    )
+        except IntegrityError:
+            # A concurrent request used the same reference between the check and the insert
+            if Transaction.objects.filter(transaction_reference=transaction_reference).exists():
+                return Response({"error": "Transaction reference already used"}, status=400)
+            raise
+
+        if invoice is None:
+            # Without an invoice type the booking still goes through
             return Response({
                 "message": "Appointment booked and payment processed, but invoice generation failed", 
                 "appointment_id": appointment.appointment_id,
                 "transaction_id": transaction.transaction_id,
-                "error": str(e)
+                "error": "Invoice type 'appointment' is not configured"
             }, status=201)
 
+        return Response({
+            "message": "Appointment booked and payment processed", 
+            "appointment_id": appointment.appointment_id,
+            "transaction_id": transaction.transaction_id,
+            "invoice_id": invoice.invoice_id,
+            "invoice_number": invoice.invoice_number
+        }, status=201)
+
 class RescheduleAppointmentView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
@@ -401,7 +433,7 @@ class RescheduleAppointmentView(APIView):
             return Response({"error": "Missing required fields"}, status=400)
             
         try:
-            new_slot = Slot.objects.get(slot_id=new_slot_id)
+            new_slot = resolve_slot(new_slot_id)
             new_date = datetime.strptime(new_date, "%Y-%m-%d").date()
         except (Slot.DoesNotExist, ValueError):
             return Response({"error": "Invalid slot or date format"}, status=400)
@@ -840,8 +872,8 @@ class GetLatestPatientVitalsView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, patient_id):
-        # Get the latest vitals for the patient
-        latest_vitals = PatientVitals.objects.filter(patient_id=patient_id).order_by('-created_at').first()
+        # Get the latest vitals for the patient (a pointer lookup, see hospital/vitals.py)
+        latest_vitals = get_latest_vitals(patient_id)
         
         if not latest_vitals:
             return Response({"error": "No vitals found for this patient."}, status=status.HTTP_404_NOT_FOUND)
@@ -853,7 +885,7 @@ class GetLatestPatientVitalsView(APIView):
             "patient_spo2": latest_vitals.patient_spo2,
             "patient_temperature": latest_vitals.patient_temperature,
             "created_at": latest_vitals.created_at,
-            "appointment_id": latest_vitals.appointment_id.appointment_id
+            "appointment_id": latest_vitals.appointment_id_id
         }
         return Response(data, status=status.HTTP_200_OK)
 
@@ -863,17 +895,133 @@ class EnterPatientVitalsView(APIView):
 
     def post(self, request, appointment_id):
         appointment = get_object_or_404(Appointment, appointment_id=appointment_id)
-        data = request.data
-        PatientVitals.objects.create(
-            patient=appointment.patient,
-            appointment_id=appointment,
-            patient_height=data.get("height"),
-            patient_weight=data.get("weight"),
-            patient_heartrate=data.get("heartrate"),
-            patient_spo2=data.get("spo2"),
-            patient_temperature=data.get("temperature")
+        # Same checks as device batches: numbers in plausible ranges, at least one vital
+        reading = {name: request.data.get(name) for name in VITALS_SERIES_FIELDS}
+        valid, errors = validate_readings([
+            {**reading, "patient_id": appointment.patient_id, "appointment_id": appointment.appointment_id}
+        ])
+        if errors:
+            return Response({"error": "; ".join(errors[0]["errors"])}, status=400)
+        vitals = record_vitals(**valid[0])
+        return Response({"message": "Vitals saved", "early_warning": assess_reading(vitals)}, status=201)
+
+class PatientVitalsSeriesView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, patient_id):
+        """
+        Vitals for charting as columnar arrays, oldest first
+
+        Query params:
+        - start, end: ISO date or datetime bounds (end date is inclusive)
+        - fields: comma-separated subset of height, weight, heartrate, spo2, temperature
+        - max_points: downsample to about this many points
+        - method: lttb (default) or minmax
+        - downsample_by: series the downsampling follows (default heartrate)
+        """
+        bounds = {}
+        for name in ("start", "end"):
+            value = request.GET.get(name)
+            if not value:
+                continue
+            try:
+                parsed = datetime.strptime(value, "%Y-%m-%d")
+                if name == "end":
+                    parsed += timedelta(days=1)
+            except ValueError:
+                try:
+                    parsed = parse_datetime(value)
+                except ValueError:
+                    parsed = None
+                if parsed is None:
+                    return Response({"error": f"Invalid {name}. Use YYYY-MM-DD or an ISO datetime"}, status=400)
+            bounds[name] = timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+        fields = [field for field in request.GET.get("fields", "").split(",") if field] or None
+        downsample_by = request.GET.get("downsample_by", "heartrate")
+        method = request.GET.get("method", "lttb")
+        if any(field not in VITALS_SERIES_FIELDS for field in (fields or [])) or downsample_by not in VITALS_SERIES_FIELDS:
+            return Response({"error": f"Fields must be among {', '.join(VITALS_SERIES_FIELDS)}"}, status=400)
+        if method not in VITALS_DOWNSAMPLE_METHODS:
+            return Response({"error": "method must be lttb or minmax"}, status=400)
+        try:
+            max_points = int(request.GET["max_points"]) if request.GET.get("max_points") else None
+        except ValueError:
+            return Response({"error": "max_points must be an integer"}, status=400)
+        if max_points is not None and max_points < 3:
+            return Response({"error": "max_points must be at least 3"}, status=400)
+
+        series = vitals_series(
+            patient_id, bounds.get("start"), bounds.get("end"), fields=fields,
+            max_points=max_points, method=method, downsample_by=downsample_by
         )
-        return Response({"message": "Vitals saved"}, status=201)
+        return Response({"patient_id": patient_id, **series}, status=200)
+
+class VitalsIngestView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        """
+        Batch ingestion of bedside device readings
+
+        Body: a JSON array of readings, {"readings": [...]}, or an NDJSON stream
+        (Content-Type: application/x-ndjson) with one reading per line. Invalid
+        readings are skipped and reported by index; the rest are stored.
+        """
+        if not hasattr(request.user, 'staff_id'):
+            return Response({"error": "Only staff devices can push vitals"}, status=403)
+
+        if request.content_type in ('application/x-ndjson', 'application/jsonl'):
+            try:
+                readings = parse_ndjson(request.body)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=400)
+        else:
+            readings = request.data.get("readings") if isinstance(request.data, dict) else request.data
+            if not isinstance(readings, list):
+                return Response({"error": "Send a JSON array of readings or {\"readings\": [...]}"}, status=400)
+
+        max_readings = getattr(settings, 'VITALS_INGEST_MAX_READINGS', 10000)
+        if not readings:
+            return Response({"error": "No readings"}, status=400)
+        if len(readings) > max_readings:
+            return Response({"error": f"At most {max_readings} readings per request"}, status=400)
+
+        result = ingest_readings(readings)
+        if not result["accepted"]:
+            return Response({"error": "No valid readings", **result}, status=400)
+        return Response(result, status=201)
+
+class VitalsEarlyWarningView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        Ward dashboard: early-warning score and anomaly flags for every patient
+        with vitals recorded on a day, highest score first
+
+        Query params:
+        - date: YYYY-MM-DD (default today)
+        - min_score: only patients whose highest score that day is at least this
+        """
+        if not hasattr(request.user, 'staff_id'):
+            return Response({"error": "Only staff can view the ward dashboard"}, status=403)
+
+        date_str = request.GET.get('date')
+        try:
+            day = datetime.strptime(date_str, "%Y-%m-%d").date() if date_str else timezone.localdate()
+            min_score = int(request.GET.get('min_score', 0))
+        except ValueError:
+            return Response({"error": "date must be YYYY-MM-DD and min_score an integer"}, status=400)
+
+        patients = assess_day(day, min_score=min_score)
+        return Response({
+            "date": day.isoformat(),
+            "patients": patients
+        }, status=200)
 
 class MedicineListView(APIView):
     authentication_classes = [JWTAuthentication]
@@ -950,14 +1098,20 @@ class DoctorAllSlotsView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, staff_id):
-        schedules = Schedule.objects.filter(staff__staff_id=staff_id)
+        schedules = (
+            Schedule.objects.filter(staff__staff_id=staff_id)
+            .select_related('shift')
+            .prefetch_related(Prefetch('shift__slots', queryset=Slot.objects.filter(is_active=True)))
+        )
         slots = []
         for schedule in schedules:
-            for slot in schedule.shift.slots.all():
+            for slot_id, start_time, duration, is_active in listed_slots(schedule.shift):
+                if not is_active:
+                    continue
                 slots.append({
-                    "slot_id": slot.slot_id,
-                    "slot_start_time": slot.slot_start_time,
-                    "slot_duration": slot.slot_duration,
+                    "slot_id": slot_id,
+                    "slot_start_time": start_time,
+                    "slot_duration": duration,
                     "shift": schedule.shift.shift_name,
                     "date": schedule.schedule_date
                 })
@@ -1011,20 +1165,23 @@ class DoctorScheduleView(APIView):
             staff__staff_id=staff_id,
             schedule_date__gte=start_date,
             schedule_date__lte=end_date
-        ).order_by('schedule_date')
+        ).select_related('shift').prefetch_related('shift__slots').order_by('schedule_date')
         
         # Get all appointments for this doctor in the date range
         appointments = Appointment.objects.filter(
             staff__staff_id=staff_id,
             created_at__date__gte=start_date,
             created_at__date__lte=end_date
-        )
+        ).select_related('slot__shift', 'patient')
+        
+        # No-show risk for upcoming appointments is only shown to staff
+        risks = score_appointments(appointments) if hasattr(request.user, 'staff_id') else {}
         
         # Organize appointments by date and slot
         appointment_map = {}
         for appointment in appointments:
             date_key = appointment.created_at.date().isoformat()
-            slot_key = appointment.slot.slot_id
+            slot_key = listed_slot_id(appointment.slot)
             
             if date_key not in appointment_map:
                 appointment_map[date_key] = {}
@@ -1035,6 +1192,8 @@ class DoctorScheduleView(APIView):
                 "patient_name": appointment.patient.patient_name,
                 "status": appointment.status
             }
+            if appointment.appointment_id in risks:
+                appointment_map[date_key][slot_key]["no_show_risk"] = risks[appointment.appointment_id]
         
         # Build schedule data
         schedule_data = []
@@ -1042,18 +1201,21 @@ class DoctorScheduleView(APIView):
             date_key = schedule.schedule_date.isoformat()
             shift_slots = []
             
-            for slot in schedule.shift.slots.all():
+            for slot_id, start_time, duration, is_active in listed_slots(schedule.shift):
+                # Slots removed from the shift only show where they still carry a booking
+                if not is_active and slot_id not in appointment_map.get(date_key, {}):
+                    continue
                 slot_data = {
-                    "slot_id": slot.slot_id,
-                    "start_time": slot.slot_start_time.strftime('%H:%M:%S'),
-                    "duration": slot.slot_duration,
+                    "slot_id": slot_id,
+                    "start_time": start_time.strftime('%H:%M:%S'),
+                    "duration": duration,
                     "is_booked": False
                 }
                 
                 # Check if this slot has an appointment
-                if date_key in appointment_map and slot.slot_id in appointment_map[date_key]:
+                if date_key in appointment_map and slot_id in appointment_map[date_key]:
                     slot_data["is_booked"] = True
-                    slot_data["appointment"] = appointment_map[date_key][slot.slot_id]
+                    slot_data["appointment"] = appointment_map[date_key][slot_id]
                     
                 shift_slots.append(slot_data)
                 
@@ -1088,16 +1250,17 @@ class AllDoctorSchedulesView(APIView):
                 return Response({"error": "Invalid date format. Use YYYY-MM-DD"}, status=400)
                 
         # Get all schedules for this date
-        schedules = Schedule.objects.filter(schedule_date=date)
+        schedules = Schedule.objects.filter(schedule_date=date).select_related('staff', 'shift').prefetch_related('shift__slots')
         
         # Get all appointments for this date
-        appointments = Appointment.objects.filter(created_at__date=date)
+        appointments = Appointment.objects.filter(created_at__date=date).select_related('slot__shift', 'patient')
+        risks = score_appointments(appointments)
         
         # Organize appointments by doctor and slot
         appointment_map = {}
         for appointment in appointments:
-            doctor_key = appointment.staff.staff_id
-            slot_key = appointment.slot.slot_id
+            doctor_key = appointment.staff_id
+            slot_key = listed_slot_id(appointment.slot)
             
             if doctor_key not in appointment_map:
                 appointment_map[doctor_key] = {}
@@ -1108,6 +1271,8 @@ class AllDoctorSchedulesView(APIView):
                 "patient_name": appointment.patient.patient_name,
                 "status": appointment.status
             }
+            if appointment.appointment_id in risks:
+                appointment_map[doctor_key][slot_key]["no_show_risk"] = risks[appointment.appointment_id]
         
         # Build schedule data
         schedule_data = []
@@ -1115,18 +1280,21 @@ class AllDoctorSchedulesView(APIView):
             doctor_key = schedule.staff.staff_id
             shift_slots = []
             
-            for slot in schedule.shift.slots.all():
+            for slot_id, start_time, duration, is_active in listed_slots(schedule.shift):
+                # Slots removed from the shift only show where they still carry a booking
+                if not is_active and slot_id not in appointment_map.get(doctor_key, {}):
+                    continue
                 slot_data = {
-                    "slot_id": slot.slot_id,
-                    "start_time": slot.slot_start_time.strftime('%H:%M:%S'),
-                    "duration": slot.slot_duration,
+                    "slot_id": slot_id,
+                    "start_time": start_time.strftime('%H:%M:%S'),
+                    "duration": duration,
                     "is_booked": False
                 }
                 
                 # Check if this slot has an appointment
-                if doctor_key in appointment_map and slot.slot_id in appointment_map[doctor_key]:
+                if doctor_key in appointment_map and slot_id in appointment_map[doctor_key]:
                     slot_data["is_booked"] = True
-                    slot_data["appointment"] = appointment_map[doctor_key][slot.slot_id]
+                    slot_data["appointment"] = appointment_map[doctor_key][slot_id]
                     
                 shift_slots.append(slot_data)
                 
@@ -1172,13 +1340,17 @@ class SetStaffScheduleView(APIView):
         if Schedule.objects.filter(staff=staff, schedule_date=date).exists():
             return Response({"error": "Schedule already exists for this date"}, status=409)
             
-        # Create schedule
-        schedule = Schedule.objects.create(
-            staff=staff,
-            shift=shift,
-            schedule_date=date
-        )
-        
+        # Create schedule; the unique (staff, date) constraint catches a concurrent request
+        try:
+            with db_transaction.atomic():
+                schedule = Schedule.objects.create(
+                    staff=staff,
+                    shift=shift,
+                    schedule_date=date
+                )
+        except IntegrityError:
+            return Response({"error": "Schedule already exists for this date"}, status=409)
+
         return Response({
             "message": "Schedule set successfully",
             "schedule_id": schedule.schedule_id,
@@ -1189,13 +1361,55 @@ class SetStaffScheduleView(APIView):
             }
         }, status=201)
 
+class RosterView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAdminStaff]
+
+    def post(self, request):
+        """
+        Create schedules from weekly rules over a date range (see hospital/roster.py)
+
+        Body: start_date, end_date, optional exclude_dates, and rules, each with
+        staff_ids, shift_id, optional weekdays (0-6 or 'mon'..'sun'), every_weeks,
+        start_date, end_date and exclude_dates. Staff on leave are skipped.
+        dry_run reports without writing; on_conflict 'abort' writes nothing if
+        any schedule conflicts, 'skip' (default) writes the rest.
+        """
+        if not isinstance(request.data, dict):
+            return Response({"error": "Send a JSON object"}, status=400)
+        try:
+            report = build_roster(
+                request.data,
+                dry_run=bool(request.data.get("dry_run", False)),
+                on_conflict=request.data.get("on_conflict", "skip"),
+            )
+        except RosterError as e:
+            return Response({"error": str(e)}, status=400)
+        if report["aborted"]:
+            return Response({"error": "Roster has conflicts; nothing was created", **report}, status=409)
+        return Response(report, status=200 if report["dry_run"] else 201)
+
 class SetStaffSlotsView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAdminStaff]
 
     def post(self, request):
+        """
+        Replace a shift's slot template (see hospital/slots.py)
+
+        Slots are diffed, not recreated: unchanged slots keep their ids, dropped
+        ones are deactivated and new ones inserted. Dropping a slot with upcoming
+        bookings returns 409 unless migrate_bookings is true, which moves the
+        bookings to the new slot starting at, or covering, the same time.
+
+        Sending template ({"duration": 20, "breaks": [["12:00", "12:30"]]})
+        instead of slots makes the shift's slots computed; existing slots at
+        template positions keep their ids and the rest are dropped as above.
+        """
         shift_id = request.data.get("shift_id")
         slots_data = request.data.get("slots", [])
+        template_data = request.data.get("template")
+        migrate_bookings = bool(request.data.get("migrate_bookings", False))
         
         if not shift_id:
             return Response({"error": "Shift ID is required"}, status=400)
@@ -1204,44 +1418,46 @@ class SetStaffSlotsView(APIView):
             shift = Shift.objects.get(shift_id=shift_id)
         except Shift.DoesNotExist:
             return Response({"error": "Invalid shift"}, status=400)
-            
-        # Delete existing slots for this shift
-        Slot.objects.filter(shift=shift).delete()
-        
-        # Create new slots
-        created_slots = []
-        for slot_data in slots_data:
-            start_time_str = slot_data.get("start_time")
-            duration = slot_data.get("duration")
-            remark = slot_data.get("remark", "")
-            
-            if not all([start_time_str, duration]):
-                return Response({"error": "Each slot must have start_time and duration"}, status=400)
-                
-            try:
-                # Parse time in format HH:MM:SS
-                start_time = datetime.strptime(start_time_str, "%H:%M:%S").time()
-                
-                slot = Slot.objects.create(
-                    slot_start_time=start_time,
-                    slot_duration=duration,
-                    shift=shift,
-                    slot_remark=remark
-                )
-                
-                created_slots.append({
-                    "slot_id": slot.slot_id,
-                    "start_time": slot.slot_start_time.strftime('%H:%M:%S'),
-                    "duration": slot.slot_duration
-                })
-                
-            except ValueError:
-                return Response({"error": f"Invalid time format: {start_time_str}. Use HH:MM:SS"}, status=400)
-        
+
+        try:
+            if template_data is not None:
+                duration, breaks = parse_shift_template(shift, template_data)
+            else:
+                requested = parse_slot_template(slots_data)
+        except SlotTemplateError as e:
+            return Response({"error": str(e)}, status=400)
+
+        if template_data is not None:
+            result = apply_shift_template(shift, duration, breaks, migrate_bookings=migrate_bookings)
+        else:
+            result = apply_slot_template(shift, requested, migrate_bookings=migrate_bookings)
+        if result["blocked"]:
+            return Response({
+                "error": "Upcoming appointments are booked on slots this change removes"
+                         + ("; they could not be migrated" if migrate_bookings else "; send migrate_bookings to move them"),
+                "appointments": result["blocked"]
+            }, status=409)
+
+        active_slots = [slot for slot in listed_slots(shift) if slot[3]]
+        if not shift.slot_duration:
+            active_slots.sort(key=lambda slot: slot[1])
         return Response({
-            "message": f"Created {len(created_slots)} slots for shift {shift.shift_name}",
+            "message": f"Updated slots for shift {shift.shift_name}",
             "shift_id": shift.shift_id,
-            "slots": created_slots
+            "template": {"duration": shift.slot_duration, "breaks": shift.slot_breaks} if shift.slot_duration else None,
+            "slots": [
+                {
+                    "slot_id": slot_id,
+                    "start_time": start_time.strftime('%H:%M:%S'),
+                    "duration": duration
+                }
+                for slot_id, start_time, duration, _ in active_slots
+            ],
+            "created": result["created"],
+            "reactivated": result["reactivated"],
+            "deactivated": result["deactivated"],
+            "unchanged": result["unchanged"],
+            "migrated": result["migrated"]
         }, status=201)
 
 # class RecommendLabTestsView(APIView):
@@ -1655,6 +1871,7 @@ class PayForLabTestsView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
 
+    @idempotent('pay_for_lab_test', fallback_field='transaction_reference')
     def post(self, request, lab_test_id):
         # Check if user is a patient
         if not hasattr(request.user, 'patient_id'):
@@ -1701,74 +1918,215 @@ class PayForLabTestsView(APIView):
         except LabTestCharge.DoesNotExist:
             return Response({"error": "No charge found for this lab test"}, status=400)
             
-        # Create transaction with the provided reference
-        transaction = Transaction.objects.create(
-            transaction_reference=transaction_reference,
-            transaction_type=transaction_type,
-            payment_method=payment_method,
-            transaction_amount=charge.charge_amount,
-            transaction_unit=charge.charge_unit,
-            transaction_status="completed",  # Assuming payment is successful
-            patient=patient,
-            transaction_details={
-                "lab_test_id": lab_test.lab_test_id,
-                "test_type": lab_test.test_type.test_name,
-                "lab": lab_test.lab.lab_name,
-                "payment_gateway_response": request.data.get("payment_gateway_response", {})  # Optional additional payment details
-            }
-        )
-        
-        # Update lab test with transaction
-        lab_test.tran = transaction
-        lab_test.status = LabTest.Status.PAID  # Update status to paid
-        lab_test.save()
-        
-        # Generate invoice for the lab test and change status to paid
+        invoice_type = InvoiceType.objects.filter(invoice_type_name='lab_test').first()
+
+        # Payment, lab test update and invoice are written together or not at all
         try:
-            invoice_type = InvoiceType.objects.get(invoice_type_name='lab_test')
-            
-            # Calculate tax (assuming 5% tax)
-            tax_rate = decimal.Decimal('0.05')
-            subtotal = charge.charge_amount
-            tax = subtotal * tax_rate
-            total = subtotal + tax
-            print(lab_test.test_datetime)
-            # Create invoice
-
-            # Then use invoice_remark in your Invoice.objects.create()
-
-            invoice = Invoice.objects.create(
-                tran=transaction,
-                invoice_type=invoice_type,
-                patient=patient,
-                invoice_items=[lab_test.lab_test_id],
-                invoice_subtotal=subtotal,
-                invoice_tax=tax,
-                invoice_total=total,
-                invoice_unit=charge.charge_unit,
-                invoice_status='paid',
-                invoice_remark="Invoice for {lab_test.test_type.test_name} on {lab_test.test_datetime.strftime('%Y-%m-%d') if lab_test.test_datetime else 'Unknown Date'}"
-            )
-            
-            return Response({
-                "message": "Payment for lab test processed successfully",
-                "transaction_id": transaction.transaction_id,
-                "amount": f"{transaction.transaction_amount} {transaction.transaction_unit.unit_symbol}",
-                "invoice_id": invoice.invoice_id,
-                "invoice_number": invoice.invoice_number
-            }, status=201)
-            
-        except Exception as e:
-            # If invoice creation fails, still return success for the payment
-            print(e)
-            print(traceback.format_exc())
+            with db_transaction.atomic():
+                # Lock the test so two different references can't both pay for it
+                lab_test = LabTest.objects.select_for_update().select_related('test_type', 'lab').get(
+                    lab_test_id=lab_test.lab_test_id
+                )
+                if lab_test.tran_id:
+                    return Response({"error": "This lab test is already paid for"}, status=400)
+
+                # Create transaction with the provided reference
+                transaction = Transaction.objects.create(
+                    transaction_reference=transaction_reference,
+                    transaction_type=transaction_type,
+                    payment_method=payment_method,
+                    transaction_amount=charge.charge_amount,
+                    transaction_unit=charge.charge_unit,
+                    transaction_status="completed",  # Assuming payment is successful
+                    patient=patient,
+                    transaction_details={
+                        "lab_test_id": lab_test.lab_test_id,
+                        "test_type": lab_test.test_type.test_name,
+                        "lab": lab_test.lab.lab_name,
+                        "payment_gateway_response": request.data.get("payment_gateway_response", {})  # Optional additional payment details
+                    }
+                )
+
+                # Update lab test with transaction
+                lab_test.tran = transaction
+                lab_test.status = LabTest.Status.PAID  # Update status to paid
+                lab_test.save()
+
+                # Generate invoice for the lab test
+                invoice = None
+                if invoice_type is not None:
+                    # Calculate tax (assuming 5% tax)
+                    tax_rate = decimal.Decimal('0.05')
+                    subtotal = charge.charge_amount
+                    tax = subtotal * tax_rate
+                    total = subtotal + tax
+
+                    invoice = Invoice.objects.create(
+                        tran=transaction,
+                        invoice_type=invoice_type,
+                        patient=patient,
+                        invoice_items=[lab_test.lab_test_id],
+                        invoice_subtotal=subtotal,
+                        invoice_tax=tax,
+                        invoice_total=total,
+                        invoice_unit=charge.charge_unit,
+                        invoice_status='paid',
+                        invoice_remark="Invoice for {lab_test.test_type.test_name} on {lab_test.test_datetime.strftime('%Y-%m-%d') if lab_test.test_datetime else 'Unknown Date'}"
+                    )
+        except IntegrityError:
+            # A concurrent request used the same reference between the check and the insert
+            if Transaction.objects.filter(transaction_reference=transaction_reference).exists():
+                return Response({"error": "Transaction reference already used"}, status=400)
+            raise
+
+        if invoice is None:
+            # Without an invoice type the payment still goes through
             return Response({
                 "message": "Payment for lab test processed successfully, but invoice generation failed",
                 "transaction_id": transaction.transaction_id,
                 "amount": f"{transaction.transaction_amount} {transaction.transaction_unit.unit_symbol}",
-                "error": str(e)
+                "error": "Invoice type 'lab_test' is not configured"
             }, status=201)
 
+        return Response({
+            "message": "Payment for lab test processed successfully",
+            "transaction_id": transaction.transaction_id,
+            "amount": f"{transaction.transaction_amount} {transaction.transaction_unit.unit_symbol}",
+            "invoice_id": invoice.invoice_id,
+            "invoice_number": invoice.invoice_number
+        }, status=201)
+
+class PayForLabTestsCartView(APIView):
+    """
+    Pay for several lab tests at once: one transaction and one invoice for the whole cart
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @idempotent('pay_for_lab_tests_cart', fallback_field='transaction_reference')
+    def post(self, request):
+        if not hasattr(request.user, 'patient_id'):
+            return Response({"error": "Only patients can pay for lab tests"}, status=403)
+
+        patient = request.user
+        lab_test_ids = request.data.get("lab_test_ids")
+        payment_method_id = request.data.get("payment_method_id")
+        transaction_reference = request.data.get("transaction_reference")
+
+        if not lab_test_ids or not isinstance(lab_test_ids, list):
+            return Response({"error": "lab_test_ids must be a non-empty list"}, status=400)
+        try:
+            lab_test_ids = list(dict.fromkeys(int(test_id) for test_id in lab_test_ids))
+        except (TypeError, ValueError):
+            return Response({"error": "Lab test IDs must be integers"}, status=400)
+        if not payment_method_id:
+            return Response({"error": "Payment method is required"}, status=400)
+        if not transaction_reference:
+            return Response({"error": "Transaction reference is required"}, status=400)
+        if Transaction.objects.filter(transaction_reference=transaction_reference).exists():
+            return Response({"error": "Transaction reference already used"}, status=400)
+
+        try:
+            payment_method = PaymentMethod.objects.get(payment_method_id=payment_method_id)
+            transaction_type = TransactionType.objects.get(transaction_type_name="Payment")
+        except (PaymentMethod.DoesNotExist, TransactionType.DoesNotExist):
+            return Response({"error": "Invalid payment method or transaction type"}, status=400)
+
+        invoice_type = InvoiceType.objects.filter(invoice_type_name='lab_test').first()
+
+        try:
+            with db_transaction.atomic():
+                # Lock the whole cart so no test can be paid for twice
+                found = (
+                    LabTest.objects.select_for_update()
+                    .select_related('test_type', 'lab', 'appointment')
+                    .in_bulk(lab_test_ids)
+                )
+                missing = [test_id for test_id in lab_test_ids if test_id not in found]
+                if missing:
+                    return Response({"error": f"Lab tests not found: {missing}"}, status=404)
+                lab_tests = [found[test_id] for test_id in lab_test_ids]
+                if any(test.appointment.patient_id != patient.patient_id for test in lab_tests):
+                    return Response({"error": "You are not authorized to pay for these tests"}, status=403)
+                paid = [test.lab_test_id for test in lab_tests if test.tran_id]
+                if paid:
+                    return Response({"error": f"Lab tests already paid for: {paid}"}, status=400)
+                invoiced = list(InvoiceItem.objects.filter(
+                    item_type='lab_test', item_id__in=lab_test_ids
+                ).values_list('item_id', flat=True))
+                if invoiced:
+                    return Response({"error": f"Lab tests already invoiced: {sorted(invoiced)}"}, status=400)
+
+                charges = active_lab_test_charges(test.test_type_id for test in lab_tests)
+                uncharged = [test.lab_test_id for test in lab_tests if test.test_type_id not in charges]
+                if uncharged:
+                    return Response({"error": f"No charge found for lab tests: {uncharged}"}, status=400)
+                lines = [(test, charges[test.test_type_id]) for test in lab_tests]
+                if len({charge.charge_unit_id for _, charge in lines}) > 1:
+                    return Response({"error": "Cannot pay for lab tests charged in different currency units"}, status=400)
+                unit = lines[0][1].charge_unit
+                subtotal = sum((charge.charge_amount for _, charge in lines), decimal.Decimal('0.00'))
+
+                transaction = Transaction.objects.create(
+                    transaction_reference=transaction_reference,
+                    transaction_type=transaction_type,
+                    payment_method=payment_method,
+                    transaction_amount=subtotal,
+                    transaction_unit=unit,
+                    transaction_status="completed",  # Assuming payment is successful
+                    patient=patient,
+                    transaction_details={
+                        "lab_tests": [
+                            {
+                                "lab_test_id": test.lab_test_id,
+                                "test_type": test.test_type.test_name,
+                                "lab": test.lab.lab_name,
+                                "amount": str(charge.charge_amount),
+                            }
+                            for test, charge in lines
+                        ],
+                        "payment_gateway_response": request.data.get("payment_gateway_response", {})
+                    }
+                )
+                LabTest.objects.filter(lab_test_id__in=lab_test_ids).update(tran=transaction, status=LabTest.Status.PAID)
+
+                invoice = None
+                if invoice_type is not None:
+                    # Calculate tax (assuming 5% tax)
+                    tax = subtotal * decimal.Decimal('0.05')
+                    invoice = Invoice.objects.create(
+                        tran=transaction,
+                        invoice_type=invoice_type,
+                        patient=patient,
+                        invoice_items=lab_test_ids,
+                        invoice_subtotal=subtotal,
+                        invoice_tax=tax,
+                        invoice_total=subtotal + tax,
+                        invoice_unit=unit,
+                        invoice_status='paid',
+                        invoice_remark=f"Invoice for {len(lab_tests)} lab tests"
+                    )
+        except IntegrityError:
+            # A concurrent request used the same reference between the check and the insert
+            if Transaction.objects.filter(transaction_reference=transaction_reference).exists():
+                return Response({"error": "Transaction reference already used"}, status=400)
+            raise
+
+        response = {
+            "message": "Payment for lab tests processed successfully",
+            "transaction_id": transaction.transaction_id,
+            "lab_test_ids": lab_test_ids,
+            "amount": f"{transaction.transaction_amount} {unit.unit_symbol}",
+        }
+        if invoice is None:
+            # Without an invoice type the payment still goes through
+            response["message"] = "Payment for lab tests processed successfully, but invoice generation failed"
+            response["error"] = "Invoice type 'lab_test' is not configured"
+        else:
+            response["invoice_id"] = invoice.invoice_id
+            response["invoice_number"] = invoice.invoice_number
+        return Response(response, status=201)
+
 class AddLabTestResultsView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
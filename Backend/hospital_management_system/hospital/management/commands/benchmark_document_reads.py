@@ -0,0 +1,50 @@
+import time
+import tempfile
+from django.core.management.base import BaseCommand
+from hospital.models import PatientHistoryDocs
+from hospital.document_storage import DocumentSpillCache, iter_document_chunks, storage_local_path
+
+
+class Command(BaseCommand):
+    help = 'Measure document read throughput through the configured storage backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20, help='Number of documents to read')
+        parser.add_argument('--patient-id', type=int, help='Only read this patient\'s documents')
+
+    def handle(self, *args, **options):
+        docs = PatientHistoryDocs.objects.order_by('-created_at')
+        if options.get('patient_id'):
+            docs = docs.filter(patient_id=options['patient_id'])
+        names = list(docs.values_list('document_url', flat=True)[:options['limit']])
+        if not names:
+            self.stdout.write('No documents to read')
+            return
+
+        self._report('stream', names, lambda name: sum(len(c) for c in iter_document_chunks(name)))
+
+        if storage_local_path(names[0]) is not None:
+            self.stdout.write('Storage has local paths; the spill cache is not used')
+            return
+
+        # A throwaway cache so existing entries don't turn cold reads into hits
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DocumentSpillCache(directory=directory)
+
+            def read_cached(name):
+                with open(cache.get_path(name), 'rb') as handle:
+                    return len(handle.read())
+
+            self._report('spill cache (cold)', names, read_cached)
+            self._report('spill cache (warm)', names, read_cached)
+
+    def _report(self, label, names, read):
+        total_bytes = 0
+        started = time.perf_counter()
+        for name in names:
+            total_bytes += read(name)
+        elapsed = time.perf_counter() - started
+        rate = total_bytes / (1024 * 1024) / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"{label}: {len(names)} documents, {total_bytes} bytes in {elapsed:.2f}s ({rate:.1f} MB/s)"
+        ))
@@ -0,0 +1,61 @@
+import time
+import uuid
+import random
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from hospital.models import Patient, PatientVitals
+from hospital.vitals import ingest_readings, rebuild_latest_vitals
+
+
+class Command(BaseCommand):
+    help = 'Measure bulk vitals ingestion throughput with synthetic device readings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readings', type=int, default=20000, help='Total readings to ingest (default 20000)')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Readings per ingest call, like one request (default 2000)')
+        parser.add_argument('--chunk-size', type=int, help='Readings per transaction (default settings.VITALS_INGEST_CHUNK_SIZE)')
+        parser.add_argument('--patients', type=int, default=10, help='Spread readings over this many patients (default 10)')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic readings instead of deleting them')
+
+    def handle(self, *args, **options):
+        patient_ids = list(Patient.objects.values_list('patient_id', flat=True)[:options['patients']])
+        if not patient_ids:
+            raise CommandError('Need at least one patient')
+
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                self.stdout.write(f"SQLite journal mode: {cursor.fetchone()[0]}")
+
+        device_id = f"benchmark-{uuid.uuid4().hex[:8]}"
+        start = timezone.now() - timedelta(seconds=options['readings'])
+        readings = [
+            {
+                'patient_id': patient_ids[i % len(patient_ids)],
+                'device_id': device_id,
+                'recorded_at': (start + timedelta(seconds=i)).isoformat(),
+                'heartrate': random.randint(55, 110),
+                'spo2': round(random.uniform(92, 100), 1),
+                'temperature': round(random.uniform(36.0, 38.5), 1),
+            }
+            for i in range(options['readings'])
+        ]
+
+        accepted = 0
+        started = time.perf_counter()
+        for offset in range(0, len(readings), options['batch_size']):
+            result = ingest_readings(readings[offset:offset + options['batch_size']], chunk_size=options.get('chunk_size'))
+            accepted += result['accepted']
+        elapsed = time.perf_counter() - started
+
+        rate = accepted / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Ingested {accepted} readings in {elapsed:.2f}s ({rate:,.0f} readings/s)"
+        ))
+
+        if not options['keep']:
+            PatientVitals.objects.filter(device_id=device_id).delete()
+            rebuild_latest_vitals(patient_ids)
+            self.stdout.write(f"Deleted the synthetic readings ({device_id})")
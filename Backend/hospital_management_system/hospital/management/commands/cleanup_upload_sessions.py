@@ -0,0 +1,33 @@
+import os
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from hospital.models import DocumentUploadSession
+from hospital.chunked_upload_service import ChunkedUploadService
+
+
+class Command(BaseCommand):
+    help = 'Delete abandoned chunked uploads and their staging files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=int,
+            default=getattr(settings, 'DOCUMENT_UPLOAD_SESSION_TTL_HOURS', 48),
+            help='Remove unfinished uploads idle for longer than this'
+        )
+
+    def handle(self, *args, **options):
+        service = ChunkedUploadService()
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        stale = DocumentUploadSession.objects.filter(updated_at__lt=cutoff).exclude(status='completed')
+
+        removed = 0
+        for session in stale.iterator():
+            staging_path = service.staging_path(session)
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+            session.delete()
+            removed += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} abandoned uploads"))
@@ -1,19 +1,38 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from hospital.models import Shift, Slot  # replace 'yourapp' with your app name
+from hospital.slots import SlotTemplateError, apply_shift_template, parse_shift_template
 from datetime import datetime, timedelta
 
 class Command(BaseCommand):
-    help = 'Create 20-minute slots for each shift'
+    help = (
+        'Create 20-minute slots for each shift, or with --template switch shifts to computed '
+        'slots, keeping the ids of existing slots at template positions'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--template', action='store_true',
+                            help='Set an arithmetic slot template instead of creating slot rows')
+        parser.add_argument('--duration', type=int, default=20, help='Slot length in minutes (default 20)')
+        parser.add_argument('--shift', type=int, help='Only this shift ID')
+        parser.add_argument('--migrate-bookings', action='store_true',
+                            help='Move upcoming bookings off slots the template drops instead of skipping the shift')
 
     def handle(self, *args, **options):
         shifts = Shift.objects.all()
-        slot_duration_minutes = 20
+        if options['shift'] is not None:
+            shifts = shifts.filter(shift_id=options['shift'])
+            if not shifts.exists():
+                raise CommandError(f"Shift {options['shift']} not found")
+        if options['template']:
+            return self.set_templates(shifts, options)
+
+        slot_duration_minutes = options['duration']
         total_slots_created = 0
 
         for shift in shifts:
             shift_start = datetime.combine(datetime.today(), shift.start_time)
             shift_end = datetime.combine(datetime.today(), shift.end_time)
-            
+
             # Handle shifts that cross midnight
             if shift_end <= shift_start:
                 shift_end += timedelta(days=1)
@@ -31,3 +50,28 @@ class Command(BaseCommand):
                 total_slots_created += 1
 
         self.stdout.write(self.style.SUCCESS(f"Successfully created {total_slots_created} slots!"))
+
+    def set_templates(self, shifts, options):
+        converted = 0
+        for shift in shifts:
+            try:
+                duration, breaks = parse_shift_template(
+                    shift, {'duration': options['duration'], 'breaks': shift.slot_breaks}
+                )
+            except SlotTemplateError as e:
+                self.stderr.write(f"{shift.shift_name}: {e}")
+                continue
+            result = apply_shift_template(shift, duration, breaks, migrate_bookings=options['migrate_bookings'])
+            if result['blocked']:
+                self.stderr.write(
+                    f"{shift.shift_name}: skipped, {len(result['blocked'])} upcoming appointments are booked "
+                    f"on slots the template drops"
+                    + ("" if options['migrate_bookings'] else " (use --migrate-bookings to move them)")
+                )
+                continue
+            converted += 1
+            self.stdout.write(
+                f"{shift.shift_name}: {result['unchanged']} slots kept, {len(result['deactivated'])} deactivated, "
+                f"{len(result['migrated'])} appointments migrated"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Set a {options['duration']}-minute template on {converted} shifts"))
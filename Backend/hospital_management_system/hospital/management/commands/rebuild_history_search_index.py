@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from hospital.models import PatientHistory, PatientHistoryEntry
+from hospital.search_index import ClinicalTextIndex
+
+
+class Command(BaseCommand):
+    help = 'Backfill the full-text search index from consolidated patient histories'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patient-id', type=int, help='Only index this patient')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Rebuild patients that already have indexed entries (drops their document links)'
+        )
+
+    def handle(self, *args, **options):
+        index = ClinicalTextIndex()
+        histories = PatientHistory.objects.all()
+        if options.get('patient_id'):
+            histories = histories.filter(patient_id=options['patient_id'])
+        if not options.get('force'):
+            indexed_patients = PatientHistoryEntry.objects.values('patient_id')
+            histories = histories.exclude(patient_id__in=indexed_patients)
+
+        total_patients = 0
+        total_entries = 0
+        for history in histories.iterator(chunk_size=500):
+            total_entries += index.rebuild_from_history(history)
+            total_patients += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {total_entries} entries for {total_patients} patients"
+        ))
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital', '0015_patienthistorydocs_patienthistory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientHistoryEntry',
+            fields=[
+                ('entry_id', models.AutoField(primary_key=True, serialize=False)),
+                ('entry_kind', models.CharField(choices=[('note', 'Note'), ('history', 'History'), ('allergy', 'Allergy')], max_length=20)),
+                ('entry_category', models.CharField(blank=True, default='', help_text='History category (diseases, medications, ...) or source document type', max_length=50)),
+                ('content', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('document', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='history_entries', to='hospital.patienthistorydocs')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='history_entries', to='hospital.patient')),
+            ],
+            options={
+                'verbose_name': 'Patient History Entry',
+                'verbose_name_plural': 'Patient History Entries',
+            },
+        ),
+    ]
@@ -0,0 +1,99 @@
+"""
+Full-text index over PatientHistoryEntry.content.
+
+SQLite gets an external-content FTS5 table kept in sync by triggers; PostgreSQL
+gets a generated tsvector column with a GIN index. Other backends are left
+alone and search falls back to a plain LIKE scan.
+"""
+from django.db import migrations
+
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS hospital_patienthistoryentry_fts USING fts5(
+        content,
+        content='hospital_patienthistoryentry',
+        content_rowid='entry_id',
+        tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS hospital_patienthistoryentry_fts_ai
+    AFTER INSERT ON hospital_patienthistoryentry BEGIN
+        INSERT INTO hospital_patienthistoryentry_fts(rowid, content) VALUES (new.entry_id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS hospital_patienthistoryentry_fts_ad
+    AFTER DELETE ON hospital_patienthistoryentry BEGIN
+        INSERT INTO hospital_patienthistoryentry_fts(hospital_patienthistoryentry_fts, rowid, content)
+        VALUES ('delete', old.entry_id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS hospital_patienthistoryentry_fts_au
+    AFTER UPDATE OF content ON hospital_patienthistoryentry BEGIN
+        INSERT INTO hospital_patienthistoryentry_fts(hospital_patienthistoryentry_fts, rowid, content)
+        VALUES ('delete', old.entry_id, old.content);
+        INSERT INTO hospital_patienthistoryentry_fts(rowid, content) VALUES (new.entry_id, new.content);
+    END
+    """,
+    "INSERT INTO hospital_patienthistoryentry_fts(hospital_patienthistoryentry_fts) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS hospital_patienthistoryentry_fts_au",
+    "DROP TRIGGER IF EXISTS hospital_patienthistoryentry_fts_ad",
+    "DROP TRIGGER IF EXISTS hospital_patienthistoryentry_fts_ai",
+    "DROP TABLE IF EXISTS hospital_patienthistoryentry_fts",
+]
+
+POSTGRES_FORWARD = [
+    """
+    ALTER TABLE hospital_patienthistoryentry
+    ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS hospital_patienthistoryentry_search_idx
+    ON hospital_patienthistoryentry USING GIN (search_vector)
+    """,
+]
+
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS hospital_patienthistoryentry_search_idx",
+    "ALTER TABLE hospital_patienthistoryentry DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def _run(schema_editor, statements):
+    with schema_editor.connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        _run(schema_editor, SQLITE_FORWARD)
+    elif vendor == 'postgresql':
+        _run(schema_editor, POSTGRES_FORWARD)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        _run(schema_editor, SQLITE_REVERSE)
+    elif vendor == 'postgresql':
+        _run(schema_editor, POSTGRES_REVERSE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("hospital", "0016_patienthistoryentry"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
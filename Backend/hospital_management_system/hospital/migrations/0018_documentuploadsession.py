@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:55
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital', '0017_patienthistoryentry_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentUploadSession',
+            fields=[
+                ('upload_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('document_type', models.CharField(choices=[('lab_report', 'Lab Report'), ('prescription', 'Prescription'), ('discharge_summary', 'Discharge Summary'), ('other', 'Other')], default='other', max_length=20)),
+                ('document_name', models.CharField(help_text='Original file name', max_length=255)),
+                ('total_size', models.BigIntegerField(help_text='Declared size of the complete file in bytes')),
+                ('sha256', models.CharField(help_text='Expected hex SHA-256 of the complete file', max_length=64)),
+                ('received_bytes', models.BigIntegerField(default=0)),
+                ('status', models.CharField(choices=[('uploading', 'Uploading'), ('completed', 'Completed'), ('failed', 'Failed')], default='uploading', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('document', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='upload_sessions', to='hospital.patienthistorydocs')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to='hospital.patient')),
+            ],
+            options={
+                'verbose_name': 'Document Upload Session',
+                'verbose_name_plural': 'Document Upload Sessions',
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_latest_vitals(apps, schema_editor):
+    PatientVitals = apps.get_model('hospital', 'PatientVitals')
+    PatientLatestVitals = apps.get_model('hospital', 'PatientLatestVitals')
+    newest = PatientVitals.objects.filter(patient_id=OuterRef('patient_id')).order_by('-created_at', '-id')
+    latest = PatientVitals.objects.filter(id=Subquery(newest.values('id')[:1])).values_list('patient_id', 'id', 'created_at')
+    PatientLatestVitals.objects.bulk_create(
+        (PatientLatestVitals(patient_id=patient_id, vitals_id=vitals_id, recorded_at=created_at)
+         for patient_id, vitals_id, created_at in latest.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital', '0018_documentuploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientLatestVitals',
+            fields=[
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='latest_vitals', serialize=False, to='hospital.patient')),
+                ('recorded_at', models.DateTimeField(help_text='created_at of the pointed-to reading')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='patientvitals',
+            index=models.Index(fields=['patient', 'created_at'], name='vitals_patient_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='patientlatestvitals',
+            name='vitals',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='hospital.patientvitals'),
+        ),
+        migrations.RunPython(backfill_latest_vitals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:13
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital', '0019_patient_latest_vitals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patientvitals',
+            name='device_id',
+            field=models.CharField(blank=True, help_text='Bedside device that sent the reading', max_length=100, null=True),
+        ),
+        migrations.AlterField(
+            model_name='patientvitals',
+            name='appointment_id',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='vitals', to='hospital.appointment'),
+        ),
+        migrations.AlterField(
+            model_name='patientvitals',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='When the reading was taken'),
+        ),
+        migrations.AlterField(
+            model_name='patientvitals',
+            name='patient_heartrate',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='patientvitals',
+            name='patient_height',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='patientvitals',
+            name='patient_spo2',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='patientvitals',
+            name='patient_temperature',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='patientvitals',
+            name='patient_weight',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital', '0020_device_vitals_readings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='slot',
+            name='is_active',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='slot',
+            field=models.ForeignKey(blank=True, on_delete=django.db.models.deletion.PROTECT, related_name='appointments', to='hospital.slot'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital', '0021_slot_is_active'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shift',
+            name='slot_breaks',
+            field=models.JSONField(blank=True, default=list, help_text='[["HH:MM", "HH:MM"], ...]'),
+        ),
+        migrations.AddField(
+            model_name='shift',
+            name='slot_duration',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Duration in minutes', null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:02
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_schedules(apps, schema_editor):
+    # Keep the first schedule of each staff member per date, as
+    # SetStaffScheduleView would have refused the later ones
+    Schedule = apps.get_model('hospital', 'Schedule')
+    duplicated = (
+        Schedule.objects.values('staff_id', 'schedule_date')
+        .annotate(rows=Count('schedule_id'), first=Min('schedule_id'))
+        .filter(rows__gt=1)
+    )
+    for group in duplicated.iterator():
+        Schedule.objects.filter(
+            staff_id=group['staff_id'], schedule_date=group['schedule_date']
+        ).exclude(schedule_id=group['first']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital', '0022_shift_slot_template'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_schedules, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='schedule',
+            constraint=models.UniqueConstraint(fields=('staff', 'schedule_date'), name='schedule_staff_date_uniq'),
+        ),
+    ]
@@ -1,4 +1,6 @@
+import uuid
 from django.db import models
+from django.utils import timezone
 from transactions.models import Transaction, Unit
 from django.contrib.auth.hashers import make_password, check_password
 
@@ -112,6 +114,10 @@ class Shift(models.Model):
     shift_name = models.CharField(max_length=100)
     start_time = models.TimeField()
     end_time = models.TimeField()
+    # With slot_duration set the shift's slots are computed from start/end,
+    # duration and breaks instead of stored one row each (see slots.py)
+    slot_duration = models.PositiveSmallIntegerField(null=True, blank=True, help_text="Duration in minutes")
+    slot_breaks = models.JSONField(default=list, blank=True, help_text='[["HH:MM", "HH:MM"], ...]')
 
     def __str__(self):
         return f"{self.shift_name} ({self.start_time} - {self.end_time})"
@@ -122,6 +128,8 @@ class Slot(models.Model):
     slot_duration = models.IntegerField(help_text="Duration in minutes")
     shift = models.ForeignKey(Shift, on_delete=models.CASCADE, related_name='slots')
     slot_remark = models.TextField(blank=True, null=True)
+    # Slots dropped from a shift's template are deactivated, not deleted (see slots.py)
+    is_active = models.BooleanField(default=True)
 
     def __str__(self):
         return f"Slot {self.slot_id} ({self.slot_start_time}, {self.slot_duration} min)"
@@ -130,7 +138,7 @@ class Slot(models.Model):
 #     appointment_id = models.AutoField(primary_key=True)
 #     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='appointments')
 #     staff = models.ForeignKey(Staff, on_delete=models.CASCADE, related_name='appointments')
-#     slot = models.ForeignKey(Slot, on_delete=models.CASCADE, null=False, blank=True, related_name='appointments')
+#     slot = models.ForeignKey(Slot, on_delete=models.PROTECT, null=False, blank=True, related_name='appointments')
 #     tran = models.ForeignKey(Transaction, on_delete=models.SET_NULL, null=True, blank=True, related_name='appointments')
 #     created_at = models.DateTimeField(auto_now_add=True)
 #     status = models.CharField(max_length=100)
@@ -160,7 +168,7 @@ class Appointment(models.Model):
     appointment_id = models.AutoField(primary_key=True)
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='appointments')
     staff = models.ForeignKey(Staff, on_delete=models.CASCADE, related_name='appointments')
-    slot = models.ForeignKey(Slot, on_delete=models.CASCADE, null=False, blank=True, related_name='appointments')
+    slot = models.ForeignKey(Slot, on_delete=models.PROTECT, null=False, blank=True, related_name='appointments')
     tran = models.ForeignKey(Transaction, on_delete=models.SET_NULL, null=True, blank=True, related_name='appointments')
     created_at = models.DateTimeField(auto_now_add=True)
     charge = models.ForeignKey(AppointmentCharge, on_delete=models.SET_NULL, null=True, blank=True, related_name='appointments')
@@ -176,19 +184,47 @@ class Appointment(models.Model):
         if not self.pk and not self.status:
             self.status = 'upcoming'
         super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The stored date, so the analytics rollups can refresh the day a reschedule moves away from
+        if 'appointment_date' in field_names:
+            instance._loaded_appointment_date = instance.appointment_date
+        return instance
         
 class PatientVitals(models.Model):
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='vitals')
-    appointment_id = models.ForeignKey(Appointment, on_delete=models.CASCADE, related_name='vitals')
-    patient_height = models.FloatField()
-    patient_weight = models.FloatField()
-    patient_heartrate = models.IntegerField()
-    patient_spo2 = models.FloatField()
-    patient_temperature = models.FloatField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Null for readings pushed by bedside devices outside an appointment
+    appointment_id = models.ForeignKey(Appointment, on_delete=models.CASCADE, null=True, blank=True, related_name='vitals')
+    patient_height = models.FloatField(null=True, blank=True)
+    patient_weight = models.FloatField(null=True, blank=True)
+    patient_heartrate = models.IntegerField(null=True, blank=True)
+    patient_spo2 = models.FloatField(null=True, blank=True)
+    patient_temperature = models.FloatField(null=True, blank=True)
+    device_id = models.CharField(max_length=100, null=True, blank=True, help_text="Bedside device that sent the reading")
+    created_at = models.DateTimeField(default=timezone.now, help_text="When the reading was taken")
 
     def __str__(self):
         return f"Vitals for {self.patient.patient_name} at {self.created_at}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['patient', 'created_at'], name='vitals_patient_created_idx'),
+        ]
+
+
+class PatientLatestVitals(models.Model):
+    """
+    Pointer to each patient's most recent PatientVitals row, moved forward in
+    the same transaction as every insert (see hospital/vitals.py)
+    """
+    patient = models.OneToOneField(Patient, on_delete=models.CASCADE, primary_key=True, related_name='latest_vitals')
+    vitals = models.ForeignKey(PatientVitals, on_delete=models.CASCADE, related_name='+')
+    recorded_at = models.DateTimeField(help_text="created_at of the pointed-to reading")
+
+    def __str__(self):
+        return f"Latest vitals for patient {self.patient_id} at {self.recorded_at}"
     
 ########################New Models#########################
 
@@ -347,6 +383,11 @@ class Schedule(models.Model):
     staff = models.ForeignKey(Staff, on_delete=models.CASCADE, related_name='schedules')
     shift = models.ForeignKey(Shift, on_delete=models.CASCADE, related_name='schedules')
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['staff', 'schedule_date'], name='schedule_staff_date_uniq'),
+        ]
+
     def __str__(self):
         return f"{self.staff.staff_name} - {self.shift.shift_name} on {self.schedule_date}"
 
@@ -441,4 +482,60 @@ class PatientHistoryDocs(models.Model):
     class Meta:
         verbose_name = "Patient History Document"
         verbose_name_plural = "Patient History Documents"
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+
+class PatientHistoryEntry(models.Model):
+    """
+    One searchable piece of OCR-extracted clinical text. Rows are mirrored into a
+    full-text index (FTS5 on SQLite, tsvector on PostgreSQL) by migration 0017.
+    """
+    ENTRY_KIND_CHOICES = [
+        ('note', 'Note'),
+        ('history', 'History'),
+        ('allergy', 'Allergy'),
+    ]
+
+    entry_id = models.AutoField(primary_key=True)
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='history_entries')
+    document = models.ForeignKey(PatientHistoryDocs, on_delete=models.SET_NULL, null=True, blank=True, related_name='history_entries')
+    entry_kind = models.CharField(max_length=20, choices=ENTRY_KIND_CHOICES)
+    entry_category = models.CharField(max_length=50, blank=True, default='', help_text="History category (diseases, medications, ...) or source document type")
+    content = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.entry_kind} for patient {self.patient_id}: {self.content[:50]}"
+
+    class Meta:
+        verbose_name = "Patient History Entry"
+        verbose_name_plural = "Patient History Entries"
+
+class DocumentUploadSession(models.Model):
+    """
+    A resumable chunked upload. Chunks are appended to a local staging file and
+    the assembled file is streamed to default_storage on completion.
+    """
+    STATUS_CHOICES = [
+        ('uploading', 'Uploading'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    upload_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='upload_sessions')
+    document_type = models.CharField(max_length=20, choices=PatientHistoryDocs.DOCUMENT_TYPE_CHOICES, default='other')
+    document_name = models.CharField(max_length=255, help_text="Original file name")
+    total_size = models.BigIntegerField(help_text="Declared size of the complete file in bytes")
+    sha256 = models.CharField(max_length=64, help_text="Expected hex SHA-256 of the complete file")
+    received_bytes = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
+    document = models.ForeignKey(PatientHistoryDocs, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload_sessions')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Upload {self.upload_id} ({self.document_name}) for patient {self.patient_id}: {self.status}"
+
+    class Meta:
+        verbose_name = "Document Upload Session"
+        verbose_name_plural = "Document Upload Sessions"
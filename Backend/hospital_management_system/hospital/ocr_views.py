@@ -8,20 +8,32 @@ from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
 from django.http import Http404
+from django.db.models import Count, Q
 import logging
 
 from accounts.authentication import JWTAuthentication
-from .models import Patient, PatientHistory, PatientHistoryDocs
+from .models import Patient, PatientHistory, PatientHistoryDocs, DocumentUploadSession
 from .serializers import (
-    DocumentUploadSerializer, PatientHistorySerializer, 
+    DocumentUploadSerializer, PatientHistorySerializer, PatientHistorySummarySerializer,
     PatientHistoryDocsSerializer, ConsolidatedHistorySerializer,
-    DocumentProcessingStatusSerializer
+    DocumentProcessingStatusSerializer, ChunkedUploadInitSerializer,
+    DocumentUploadSessionSerializer
 )
 from .document_processing_service import DocumentProcessingService
+from .chunked_upload_service import ChunkedUploadService
+from .search_index import ClinicalTextIndex
+from .pagination import keyset_page, parse_page_size
 from .permissions import IsAdminStaff
 
 logger = logging.getLogger(__name__)
 
+def _query_flag(request, name, default=True):
+    """Read a true/false query param such as ?include_history=false"""
+    value = request.query_params.get(name)
+    if value is None:
+        return default
+    return value.lower() not in ('false', '0', 'no')
+
 class DocumentUploadView(APIView):
     """
     API endpoint for uploading patient documents
@@ -130,6 +142,10 @@ class PatientHistoryView(APIView):
     def get(self, request, patient_id):
         """
         Get consolidated medical history for a patient
+        
+        Query params:
+        - include_history: set to false to skip the history/allergies/notes JSON
+        - cursor, limit: keyset pagination over the document list
         """
         try:
             # Validate patient exists
@@ -141,9 +157,22 @@ class PatientHistoryView(APIView):
                     'error': f'Patient with ID {patient_id} not found'
                 }, status=status.HTTP_404_NOT_FOUND)
             
+            try:
+                limit = parse_page_size(request.query_params.get('limit'))
+            except ValueError:
+                return Response({
+                    'success': False,
+                    'error': 'limit must be an integer'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
             # Get consolidated history
             processing_service = DocumentProcessingService()
-            result = processing_service.get_patient_consolidated_history(patient_id)
+            result = processing_service.get_patient_consolidated_history(
+                patient_id,
+                include_history=_query_flag(request, 'include_history'),
+                cursor=request.query_params.get('cursor'),
+                limit=limit
+            )
             
             if result['success']:
                 # Return the result data directly instead of wrapping it in 'data'
@@ -175,7 +204,11 @@ class DocumentStatusView(APIView):
     
     def get(self, request, patient_id):
         """
-        Get processing status for all documents of a patient
+        Get processing status for a patient's documents
+        
+        Query params:
+        - include_documents: set to false to return only the counts
+        - cursor, limit: keyset pagination over the document list
         """
         try:
             # Validate patient exists
@@ -187,9 +220,22 @@ class DocumentStatusView(APIView):
                     'error': f'Patient with ID {patient_id} not found'
                 }, status=status.HTTP_404_NOT_FOUND)
             
+            try:
+                limit = parse_page_size(request.query_params.get('limit'))
+            except ValueError:
+                return Response({
+                    'success': False,
+                    'error': 'limit must be an integer'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
             # Get status
             processing_service = DocumentProcessingService()
-            result = processing_service.get_document_processing_status(patient_id)
+            result = processing_service.get_document_processing_status(
+                patient_id,
+                include_documents=_query_flag(request, 'include_documents'),
+                cursor=request.query_params.get('cursor'),
+                limit=limit
+            )
             
             if result['success']:
                 # Return result directly since it already has the correct structure
@@ -217,17 +263,46 @@ class PatientHistoryListView(APIView):
     def get(self, request):
         """
         Get list of all patients with their history status
+        
+        Query params:
+        - include_history: set to false to skip the history/allergies/notes JSON
+        - cursor, limit: keyset pagination, most recently updated first
         """
         try:
-            histories = PatientHistory.objects.select_related('patient').all()
-            serializer = PatientHistorySerializer(histories, many=True)
+            try:
+                limit = parse_page_size(request.query_params.get('limit'))
+            except ValueError:
+                return Response({
+                    'success': False,
+                    'error': 'limit must be an integer'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            histories = PatientHistory.objects.select_related('patient')
+            if _query_flag(request, 'include_history'):
+                serializer_class = PatientHistorySerializer
+            else:
+                histories = histories.defer('history', 'allergies', 'notes')
+                serializer_class = PatientHistorySummarySerializer
+            
+            page, next_cursor = keyset_page(
+                histories, ['-updated_at', '-history_id'],
+                request.query_params.get('cursor'), limit
+            )
+            serializer = serializer_class(page, many=True)
             
             return Response({
                 'success': True,
                 'data': serializer.data,
-                'total_records': histories.count()
+                'total_records': PatientHistory.objects.count(),
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None
             }, status=status.HTTP_200_OK)
             
+        except ValueError as e:
+            return Response({
+                'success': False,
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             logger.error(f"Error listing patient histories: {str(e)}")
             return Response({
@@ -245,6 +320,9 @@ class PatientDocumentsListView(APIView):
     def get(self, request, patient_id):
         """
         Get list of all documents for a patient
+        
+        Query params:
+        - cursor, limit: keyset pagination, newest first
         """
         try:
             # Validate patient exists
@@ -256,20 +334,41 @@ class PatientDocumentsListView(APIView):
                     'error': f'Patient with ID {patient_id} not found'
                 }, status=status.HTTP_404_NOT_FOUND)
             
+            try:
+                limit = parse_page_size(request.query_params.get('limit'))
+            except ValueError:
+                return Response({
+                    'success': False,
+                    'error': 'limit must be an integer'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
             # Get documents
-            documents = PatientHistoryDocs.objects.filter(
-                patient=patient
-            ).order_by('-created_at')
+            documents = PatientHistoryDocs.objects.filter(patient=patient).select_related('patient')
+            page, next_cursor = keyset_page(
+                documents, ['-created_at', '-doc_id'],
+                request.query_params.get('cursor'), limit
+            )
+            counts = documents.aggregate(
+                total=Count('doc_id'),
+                processed=Count('doc_id', filter=Q(document_processed=True))
+            )
             
-            serializer = PatientHistoryDocsSerializer(documents, many=True)
+            serializer = PatientHistoryDocsSerializer(page, many=True)
             
             return Response({
                 'success': True,
                 'data': serializer.data,
-                'total_documents': documents.count(),
-                'processed_documents': documents.filter(document_processed=True).count()
+                'total_documents': counts['total'],
+                'processed_documents': counts['processed'],
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None
             }, status=status.HTTP_200_OK)
             
+        except ValueError as e:
+            return Response({
+                'success': False,
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             logger.error(f"Error listing documents for patient {patient_id}: {str(e)}")
             return Response({
@@ -346,3 +445,208 @@ class SupportedFormatsView(APIView):
                 'success': False,
                 'error': 'Internal server error while retrieving supported formats'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class ClinicalTextSearchView(APIView):
+    """
+    API endpoint for full-text search over OCR-extracted patient history
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        """
+        Search extracted notes, history items and allergies
+        
+        Query params:
+        - q: search text
+        - patient_id: optional patient filter (patients only ever see their own records)
+        - limit: optional maximum number of hits (default 20, max 100)
+        """
+        try:
+            query = request.query_params.get('q', '').strip()
+            if not query:
+                return Response({
+                    'success': False,
+                    'error': 'Search query (q) is required'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            try:
+                limit = min(int(request.query_params.get('limit', 20)), 100)
+                patient_id = request.query_params.get('patient_id')
+                patient_id = int(patient_id) if patient_id else None
+            except ValueError:
+                return Response({
+                    'success': False,
+                    'error': 'limit and patient_id must be integers'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            if hasattr(request.user, 'patient_id'):
+                patient_id = request.user.patient_id
+            
+            hits = ClinicalTextIndex().search(query, patient_id=patient_id, limit=max(limit, 1))
+            
+            return Response({
+                'success': True,
+                'query': query,
+                'results': hits,
+                'total_results': len(hits)
+            }, status=status.HTTP_200_OK)
+            
+        except Exception as e:
+            logger.error(f"Error searching patient history: {str(e)}")
+            return Response({
+                'success': False,
+                'error': 'Internal server error while searching patient history'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+UPLOAD_ERROR_STATUS = {
+    'not_found': status.HTTP_404_NOT_FOUND,
+    'conflict': status.HTTP_409_CONFLICT,
+    'invalid': status.HTTP_400_BAD_REQUEST,
+}
+
+def _upload_error_response(result):
+    body = {
+        'success': False,
+        'error': result['error']
+    }
+    if 'session' in result:
+        body['upload'] = DocumentUploadSessionSerializer(result['session']).data
+    return Response(body, status=UPLOAD_ERROR_STATUS[result['error_code']])
+
+class ChunkedUploadInitView(APIView):
+    """
+    API endpoint for starting a resumable chunked document upload
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request):
+        """
+        Start a chunked upload
+        
+        Expected payload:
+        - patient_id: integer
+        - document_name: original file name
+        - document_type: optional document type (default "other")
+        - total_size: file size in bytes
+        - sha256: hex SHA-256 of the complete file
+        """
+        try:
+            serializer = ChunkedUploadInitSerializer(data=request.data)
+            
+            if not serializer.is_valid():
+                return Response({
+                    'success': False,
+                    'errors': serializer.errors
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            session = ChunkedUploadService().create_session(**serializer.validated_data)
+            
+            return Response({
+                'success': True,
+                'upload': DocumentUploadSessionSerializer(session).data
+            }, status=status.HTTP_201_CREATED)
+            
+        except Exception as e:
+            logger.error(f"Error starting chunked upload: {str(e)}")
+            return Response({
+                'success': False,
+                'error': 'Internal server error while starting upload'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class ChunkedUploadView(APIView):
+    """
+    API endpoint for chunked upload status and chunk data
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, upload_id):
+        """
+        Get upload progress; clients resume from received_bytes
+        """
+        try:
+            session = DocumentUploadSession.objects.get(upload_id=upload_id)
+        except DocumentUploadSession.DoesNotExist:
+            return Response({
+                'success': False,
+                'error': 'Upload not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        return Response({
+            'success': True,
+            'upload': DocumentUploadSessionSerializer(session).data
+        }, status=status.HTTP_200_OK)
+    
+    def put(self, request, upload_id):
+        """
+        Append one chunk. The raw request body is the chunk data.
+        
+        Query params:
+        - offset: byte offset of the chunk, must equal the upload's received_bytes
+        """
+        try:
+            try:
+                offset = int(request.query_params.get('offset', ''))
+                length = int(request.META.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                return Response({
+                    'success': False,
+                    'error': 'offset query param and Content-Length header are required'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            # Read the body as a stream; touching request.data would buffer it
+            result = ChunkedUploadService().append_chunk(upload_id, offset, request.stream, length)
+            
+            if not result['success']:
+                return _upload_error_response(result)
+            
+            return Response({
+                'success': True,
+                'upload': DocumentUploadSessionSerializer(result['session']).data
+            }, status=status.HTTP_200_OK)
+            
+        except Exception as e:
+            logger.error(f"Error receiving chunk for upload {upload_id}: {str(e)}")
+            return Response({
+                'success': False,
+                'error': 'Internal server error while receiving chunk'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class ChunkedUploadCompleteView(APIView):
+    """
+    API endpoint for finishing a chunked upload
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request, upload_id):
+        """
+        Verify the SHA-256, store the document and queue it for OCR processing
+        """
+        try:
+            result = ChunkedUploadService().complete(upload_id)
+            
+            if not result['success']:
+                return _upload_error_response(result)
+            
+            doc = result['document']
+            return Response({
+                'success': True,
+                'message': 'Upload complete, document queued for processing',
+                'upload': DocumentUploadSessionSerializer(result['session']).data,
+                'document': {
+                    'doc_id': doc.doc_id,
+                    'document_name': doc.document_name,
+                    'document_type': doc.document_type,
+                    'file_path': doc.document_url
+                }
+            }, status=status.HTTP_200_OK)
+            
+        except Exception as e:
+            logger.error(f"Error completing upload {upload_id}: {str(e)}")
+            return Response({
+                'success': False,
+                'error': 'Internal server error while completing upload'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
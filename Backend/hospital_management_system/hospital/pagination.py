@@ -0,0 +1,104 @@
+"""
+Keyset (cursor) pagination helpers for list endpoints
+"""
+import base64
+import datetime
+import json
+from typing import List, Optional, Sequence, Tuple
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, QuerySet
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def parse_page_size(value, default: int = DEFAULT_PAGE_SIZE, maximum: int = MAX_PAGE_SIZE) -> int:
+    """
+    Parse a ``limit`` query param, clamping it to [1, maximum]
+
+    Raises:
+        ValueError: If the value is not an integer
+    """
+    if value in (None, ''):
+        return default
+    return max(1, min(int(value), maximum))
+
+
+class _CursorEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder truncates datetimes to milliseconds, which would make
+    # "created_at < cursor" skip rows that share the same millisecond
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values: Sequence) -> str:
+    payload = json.dumps(list(values), cls=_CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> List:
+    """
+    Raises:
+        ValueError: If the cursor is not one produced by encode_cursor
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def _keyset_filter(queryset: QuerySet, ordering: Sequence[str], cursor_values: List) -> Q:
+    """
+    Build "(a, b, ...) comes after cursor" for a mixed ascending/descending ordering:
+    a > x OR (a = x AND b > y) OR ...
+    """
+    if len(cursor_values) != len(ordering):
+        raise ValueError('Invalid cursor')
+
+    condition = Q()
+    equal_prefix = Q()
+    for name, raw_value in zip(ordering, cursor_values):
+        field_name = name.lstrip('-')
+        lookup = 'lt' if name.startswith('-') else 'gt'
+        value = queryset.model._meta.get_field(field_name).to_python(raw_value)
+        condition |= equal_prefix & Q(**{f'{field_name}__{lookup}': value})
+        equal_prefix &= Q(**{field_name: value})
+    return condition
+
+
+def keyset_page(queryset: QuerySet, ordering: Sequence[str], cursor: Optional[str],
+                limit: int) -> Tuple[List, Optional[str]]:
+    """
+    Fetch one page of ``queryset`` ordered by ``ordering``, starting after ``cursor``
+
+    The last ordering field must be unique (normally the primary key) so the
+    ordering is total. Works with model querysets and ``.values()`` querysets.
+
+    Returns:
+        (items, next_cursor) where next_cursor is None on the last page
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        queryset = queryset.filter(_keyset_filter(queryset, ordering, decode_cursor(cursor)))
+
+    items = list(queryset[:limit + 1])
+    if len(items) <= limit:
+        return items, None
+
+    items = items[:limit]
+    last = items[-1]
+    field_names = [name.lstrip('-') for name in ordering]
+    if isinstance(last, dict):
+        values = [last[name] for name in field_names]
+    else:
+        values = [getattr(last, name) for name in field_names]
+    return items, encode_cursor(values)
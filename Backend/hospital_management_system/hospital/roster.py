@@ -0,0 +1,228 @@
+"""
+Recurring roster generation
+
+A roster request describes schedules as weekly rules (staff, shift, weekdays,
+every N weeks) over a date range with excluded dates. The rules are expanded
+in memory, staff leave and existing schedules are each read in one query, and
+the remaining schedules are written with one bulk_create in one transaction.
+A staff member has at most one schedule per date (a unique constraint on
+Schedule); anything that would break that is returned in a conflict report
+instead of being written. The read and the write share a write_transaction(),
+and a schedule another request inserts in between on databases that don't
+serialize writers fails the insert, after which the roster is re-checked once.
+"""
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Set, Tuple
+from django.db import IntegrityError, transaction
+from hospital_management_system.db import write_transaction
+from machine_learning.cache import bump_data_version
+from .models import Leave, Schedule, Shift, Staff
+
+WEEKDAYS = {'mon': 0, 'tue': 1, 'wed': 2, 'thu': 3, 'fri': 4, 'sat': 5, 'sun': 6}
+MAX_ROSTER_DAYS = 366
+CONFLICT_MODES = ('skip', 'abort')
+
+
+class RosterError(ValueError):
+    """A roster request that can't be expanded"""
+
+
+def _parse_date(value, name: str) -> date:
+    try:
+        return datetime.strptime(str(value), '%Y-%m-%d').date()
+    except ValueError:
+        raise RosterError(f"{name} must be YYYY-MM-DD")
+
+
+def _parse_weekdays(values, rule_number: int) -> Set[int]:
+    if not values:
+        return set(range(7))
+    weekdays = set()
+    for value in values:
+        if isinstance(value, int) and 0 <= value <= 6:
+            weekdays.add(value)
+        elif isinstance(value, str) and value[:3].lower() in WEEKDAYS:
+            weekdays.add(WEEKDAYS[value[:3].lower()])
+        else:
+            raise RosterError(f"Rule {rule_number}: weekdays are 0-6 (Monday first) or names like 'mon'")
+    return weekdays
+
+
+def parse_roster(data: Dict) -> Tuple[List[Dict], date, date]:
+    """
+    Validate a roster request body
+
+    Returns:
+        (rules, first date, last date); each rule has staff_ids, shift_id,
+        weekdays, start, end, every_weeks and exclude (a set of dates)
+
+    Raises:
+        RosterError: On a malformed request
+    """
+    start = _parse_date(data.get('start_date'), 'start_date')
+    end = _parse_date(data.get('end_date'), 'end_date')
+    if end < start:
+        raise RosterError('end_date must not be before start_date')
+    if (end - start).days >= MAX_ROSTER_DAYS:
+        raise RosterError(f"A roster covers at most {MAX_ROSTER_DAYS} days")
+    exclude = {_parse_date(value, 'exclude_dates') for value in data.get('exclude_dates') or []}
+
+    raw_rules = data.get('rules')
+    if not raw_rules or not isinstance(raw_rules, list):
+        raise RosterError('rules must be a non-empty list')
+    rules = []
+    for number, raw in enumerate(raw_rules):
+        if not isinstance(raw, dict):
+            raise RosterError(f"Rule {number} must be an object")
+        staff_ids = raw.get('staff_ids')
+        if not staff_ids or not isinstance(staff_ids, list):
+            raise RosterError(f"Rule {number}: staff_ids must be a non-empty list")
+        try:
+            shift_id = int(raw.get('shift_id'))
+            every_weeks = int(raw.get('every_weeks', 1))
+        except (TypeError, ValueError):
+            raise RosterError(f"Rule {number}: shift_id and every_weeks must be integers")
+        if every_weeks < 1:
+            raise RosterError(f"Rule {number}: every_weeks must be at least 1")
+        rule_start = _parse_date(raw['start_date'], 'start_date') if raw.get('start_date') else start
+        rule_end = _parse_date(raw['end_date'], 'end_date') if raw.get('end_date') else end
+        rules.append({
+            'staff_ids': [str(staff_id) for staff_id in staff_ids],
+            'shift_id': shift_id,
+            'weekdays': _parse_weekdays(raw.get('weekdays'), number),
+            'start': max(rule_start, start),
+            'end': min(rule_end, end),
+            'every_weeks': every_weeks,
+            'exclude': exclude | {_parse_date(value, 'exclude_dates') for value in raw.get('exclude_dates') or []},
+        })
+    return rules, start, end
+
+
+def expand_rule(rule: Dict) -> Iterable[date]:
+    """
+    Dates a rule covers; every_weeks counts from the week of the rule's start
+    """
+    first_monday = rule['start'] - timedelta(days=rule['start'].weekday())
+    day = rule['start']
+    while day <= rule['end']:
+        week = (day - first_monday).days // 7
+        if day.weekday() in rule['weekdays'] and week % rule['every_weeks'] == 0 and day not in rule['exclude']:
+            yield day
+        day += timedelta(days=1)
+
+
+def _leave_days(staff_ids: Set[str], start: date, end: date) -> Dict[str, Set[date]]:
+    days = defaultdict(set)
+    leaves = Leave.objects.filter(staff_id__in=staff_ids, leave_start__lte=end, leave_end__gte=start)
+    for staff_id, leave_start, leave_end in leaves.values_list('staff_id', 'leave_start', 'leave_end'):
+        day = max(leave_start, start)
+        while day <= min(leave_end, end):
+            days[staff_id].add(day)
+            day += timedelta(days=1)
+    return days
+
+
+def _existing_schedules(staff_ids: Set[str], start: date, end: date) -> Dict[Tuple[str, date], int]:
+    schedules = Schedule.objects.filter(staff_id__in=staff_ids, schedule_date__range=(start, end))
+    return {
+        (staff_id, day): shift_id
+        for staff_id, day, shift_id in schedules.values_list('staff_id', 'schedule_date', 'shift_id')
+    }
+
+
+def build_roster(data: Dict, dry_run: bool = False, on_conflict: str = 'skip') -> Dict:
+    """
+    Expand a roster request and write the schedules that don't conflict
+
+    Args:
+        data: Request body, see parse_roster
+        dry_run: Report what would happen without writing anything
+        on_conflict: 'skip' writes everything that doesn't conflict; 'abort'
+            writes nothing when there is any conflict
+
+    Returns:
+        Report with created/skipped counts, conflicts and leave skips
+
+    Raises:
+        RosterError: On a malformed request, unknown staff/shifts, or when
+            concurrent schedule writes collide with the roster twice
+    """
+    if on_conflict not in CONFLICT_MODES:
+        raise RosterError(f"on_conflict must be one of {', '.join(CONFLICT_MODES)}")
+    rules, start, end = parse_roster(data)
+
+    staff_ids = {staff_id for rule in rules for staff_id in rule['staff_ids']}
+    shift_ids = {rule['shift_id'] for rule in rules}
+    known_staff = set(Staff.objects.filter(staff_id__in=staff_ids).values_list('staff_id', flat=True))
+    known_shifts = set(Shift.objects.filter(shift_id__in=shift_ids).values_list('shift_id', flat=True))
+    if staff_ids - known_staff:
+        raise RosterError(f"Unknown staff: {sorted(staff_ids - known_staff)}")
+    if shift_ids - known_shifts:
+        raise RosterError(f"Unknown shifts: {sorted(shift_ids - known_shifts)}")
+
+    # (staff_id, date) -> shift_id requested; a second rule for the same day conflicts
+    requested: Dict[Tuple[str, date], int] = {}
+    conflicts = []
+    for rule in rules:
+        for day in expand_rule(rule):
+            for staff_id in rule['staff_ids']:
+                key = (staff_id, day)
+                earlier = requested.get(key)
+                if earlier is None:
+                    requested[key] = rule['shift_id']
+                elif earlier != rule['shift_id']:
+                    conflicts.append({
+                        'staff_id': staff_id, 'date': day.isoformat(), 'shift_id': rule['shift_id'],
+                        'conflicting_shift_id': earlier, 'reason': 'overlapping_rules',
+                    })
+
+    for attempt in range(2):
+        try:
+            report = _write_roster(requested, list(conflicts), staff_ids, start, end, dry_run, on_conflict)
+        except IntegrityError:
+            if attempt:
+                raise RosterError('Schedules changed while the roster was being written; try again')
+            continue
+        return {'dry_run': dry_run, **report}
+
+
+def _write_roster(requested: Dict[Tuple[str, date], int], conflicts: List[Dict], staff_ids: Set[str],
+                  start: date, end: date, dry_run: bool, on_conflict: str) -> Dict:
+    # Conflicts are checked and the schedules written in the same transaction
+    with write_transaction():
+        leave = _leave_days(staff_ids, start, end)
+        existing = _existing_schedules(staff_ids, start, end)
+
+        to_create = []
+        on_leave = []
+        already_scheduled = 0
+        for (staff_id, day), shift_id in sorted(requested.items()):
+            if day in leave.get(staff_id, ()):
+                on_leave.append({'staff_id': staff_id, 'date': day.isoformat()})
+                continue
+            current = existing.get((staff_id, day))
+            if current == shift_id:
+                already_scheduled += 1
+            elif current is not None:
+                conflicts.append({
+                    'staff_id': staff_id, 'date': day.isoformat(), 'shift_id': shift_id,
+                    'conflicting_shift_id': current, 'reason': 'already_scheduled',
+                })
+            else:
+                to_create.append(Schedule(staff_id=staff_id, schedule_date=day, shift_id=shift_id))
+
+        aborted = on_conflict == 'abort' and bool(conflicts)
+        if not dry_run and not aborted and to_create:
+            Schedule.objects.bulk_create(to_create, batch_size=2000)
+            # bulk_create skips the post_save signal that invalidates dashboards
+            transaction.on_commit(bump_data_version)
+
+    return {
+        'aborted': aborted,
+        'created': 0 if dry_run or aborted else len(to_create),
+        'to_create': len(to_create),
+        'already_scheduled': already_scheduled,
+        'on_leave': on_leave,
+        'conflicts': conflicts,
+    }
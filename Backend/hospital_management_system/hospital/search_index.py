@@ -0,0 +1,211 @@
+"""
+Full-text search over OCR-extracted patient history (notes, history items, allergies)
+"""
+import re
+import logging
+from typing import Dict, List, Optional
+from django.db import connection
+from .models import Patient, PatientHistory, PatientHistoryDocs, PatientHistoryEntry
+
+logger = logging.getLogger(__name__)
+
+HISTORY_CATEGORIES = ['diseases', 'surgeries', 'medications', 'chronic_conditions', 'family_history']
+
+FTS_TABLE = 'hospital_patienthistoryentry_fts'
+ENTRY_TABLE = PatientHistoryEntry._meta.db_table
+
+SNIPPET_START = '['
+SNIPPET_END = ']'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class ClinicalTextIndex:
+    """
+    Maintains PatientHistoryEntry rows and queries the full-text index built over them
+    """
+
+    def index_ocr_result(self, doc: PatientHistoryDocs, ocr_result: Dict) -> int:
+        """
+        Add the text extracted from a single document to the index
+
+        Args:
+            doc: PatientHistoryDocs the OCR result came from
+            ocr_result: Parsed OCR response (see GeminiOCRService.create_ocr_prompt)
+
+        Returns:
+            Number of entries indexed
+        """
+        extracted = ocr_result.get('extracted_data', {}) or {}
+        document_type = ocr_result.get('document_type', doc.document_type)
+        entries = self._build_entries(
+            patient_id=doc.patient_id,
+            document=doc,
+            history=extracted.get('history', {}),
+            allergies=extracted.get('allergies', []),
+            notes=[{'note': note, 'document_type': document_type} for note in extracted.get('notes', [])],
+        )
+        PatientHistoryEntry.objects.bulk_create(entries)
+        return len(entries)
+
+    def rebuild_from_history(self, patient_history: PatientHistory) -> int:
+        """
+        Re-index a patient's consolidated history JSON. Used to backfill records
+        that were merged before the index existed; the consolidated JSON does not
+        say which document an item came from, so rebuilt entries have no document.
+        """
+        PatientHistoryEntry.objects.filter(patient_id=patient_history.patient_id).delete()
+        entries = self._build_entries(
+            patient_id=patient_history.patient_id,
+            document=None,
+            history=patient_history.history,
+            allergies=patient_history.allergies,
+            notes=patient_history.notes,
+        )
+        PatientHistoryEntry.objects.bulk_create(entries, batch_size=1000)
+        return len(entries)
+
+    def _build_entries(self, patient_id: int, document: Optional[PatientHistoryDocs],
+                       history: Dict, allergies: List, notes: List) -> List[PatientHistoryEntry]:
+        entries = []
+
+        for category in HISTORY_CATEGORIES:
+            for item in (history or {}).get(category, []) or []:
+                if isinstance(item, str) and item.strip():
+                    entries.append(PatientHistoryEntry(
+                        patient_id=patient_id, document=document,
+                        entry_kind='history', entry_category=category, content=item.strip()
+                    ))
+
+        for allergy in allergies or []:
+            if isinstance(allergy, str) and allergy.strip():
+                entries.append(PatientHistoryEntry(
+                    patient_id=patient_id, document=document,
+                    entry_kind='allergy', entry_category='allergies', content=allergy.strip()
+                ))
+
+        for note in notes or []:
+            # Notes are stored either as plain strings or as {"note", "document_type", ...} dicts
+            if isinstance(note, dict):
+                text = note.get('note') or ''
+                category = note.get('document_type') or ''
+            else:
+                text, category = note, ''
+            if isinstance(text, str) and text.strip():
+                entries.append(PatientHistoryEntry(
+                    patient_id=patient_id, document=document,
+                    entry_kind='note', entry_category=category[:50], content=text.strip()
+                ))
+
+        return entries
+
+    def search(self, query: str, patient_id: Optional[int] = None, limit: int = 20) -> List[Dict]:
+        """
+        Return ranked hits for a free-text query, best match first
+
+        Args:
+            query: Free text entered by the user
+            patient_id: Optional patient to restrict the search to
+            limit: Maximum number of hits
+
+        Returns:
+            List of hit dicts with patient, document, snippet and rank
+        """
+        terms = TOKEN_RE.findall(query or '')
+        if not terms:
+            return []
+
+        vendor = connection.vendor
+        if vendor == 'sqlite' and self._sqlite_index_available():
+            rows = self._search_sqlite(terms, patient_id, limit)
+        elif vendor == 'postgresql':
+            rows = self._search_postgres(' '.join(terms), patient_id, limit)
+        else:
+            rows = self._search_fallback(terms, patient_id, limit)
+
+        patient_names = dict(
+            Patient.objects.filter(patient_id__in={row['patient_id'] for row in rows})
+            .values_list('patient_id', 'patient_name')
+        )
+        for row in rows:
+            row['patient_name'] = patient_names.get(row['patient_id'])
+        return rows
+
+    def _sqlite_index_available(self) -> bool:
+        return FTS_TABLE in connection.introspection.table_names()
+
+    def _search_sqlite(self, terms: List[str], patient_id: Optional[int], limit: int) -> List[Dict]:
+        # Quote every term so user input can't inject FTS5 operators; the last
+        # term is a prefix match so partially typed words still hit.
+        quoted = ['"%s"' % term.replace('"', '""') for term in terms]
+        quoted[-1] += '*'
+        match = ' '.join(quoted)
+
+        sql = f"""
+            SELECT e.entry_id, e.patient_id, e.document_id, e.entry_kind, e.entry_category,
+                   snippet({FTS_TABLE}, 0, %s, %s, '...', 16), {FTS_TABLE}.rank
+            FROM {FTS_TABLE}
+            JOIN {ENTRY_TABLE} e ON e.entry_id = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH %s
+        """
+        params = [SNIPPET_START, SNIPPET_END, match]
+        if patient_id is not None:
+            sql += " AND e.patient_id = %s"
+            params.append(patient_id)
+        sql += " ORDER BY rank LIMIT %s"
+        params.append(limit)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            # bm25() is "lower is better"; flip the sign so every backend ranks descending
+            return [self._row_to_hit(row[:6], -row[6]) for row in cursor.fetchall()]
+
+    def _search_postgres(self, query: str, patient_id: Optional[int], limit: int) -> List[Dict]:
+        # Rank on the GIN index first, then build headlines for the top hits only
+        patient_clause = "AND patient_id = %s" if patient_id is not None else ""
+        sql = f"""
+            SELECT e.entry_id, e.patient_id, e.document_id, e.entry_kind, e.entry_category,
+                   ts_headline('english', e.content, top.query, %s), top.rank
+            FROM (
+                SELECT entry_id, query, ts_rank(search_vector, query) AS rank
+                FROM {ENTRY_TABLE}, websearch_to_tsquery('english', %s) query
+                WHERE search_vector @@ query {patient_clause}
+                ORDER BY rank DESC
+                LIMIT %s
+            ) top
+            JOIN {ENTRY_TABLE} e ON e.entry_id = top.entry_id
+            ORDER BY top.rank DESC
+        """
+        headline_options = f'StartSel={SNIPPET_START}, StopSel={SNIPPET_END}, MaxWords=24, MinWords=8'
+        params = [headline_options, query]
+        if patient_id is not None:
+            params.append(patient_id)
+        params.append(limit)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [self._row_to_hit(row[:6], row[6]) for row in cursor.fetchall()]
+
+    def _search_fallback(self, terms: List[str], patient_id: Optional[int], limit: int) -> List[Dict]:
+        entries = PatientHistoryEntry.objects.all()
+        if patient_id is not None:
+            entries = entries.filter(patient_id=patient_id)
+        for term in terms:
+            entries = entries.filter(content__icontains=term)
+
+        rows = entries.order_by('-created_at').values_list(
+            'entry_id', 'patient_id', 'document_id', 'entry_kind', 'entry_category', 'content'
+        )[:limit]
+        return [self._row_to_hit(row, 0.0) for row in rows]
+
+    def _row_to_hit(self, row, rank) -> Dict:
+        entry_id, patient_id, document_id, entry_kind, entry_category, snippet = row
+        return {
+            'entry_id': entry_id,
+            'patient_id': patient_id,
+            'doc_id': document_id,
+            'entry_kind': entry_kind,
+            'entry_category': entry_category,
+            'snippet': snippet,
+            'rank': rank,
+        }
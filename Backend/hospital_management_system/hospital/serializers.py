@@ -3,7 +3,7 @@ from rest_framework import serializers
 from .models import (Lab, LabType, LabTestType, LabTestCategory, 
                      TargetOrgan, AppointmentRating, AppointmentCharge, 
                      LabTest, LabTestCharge, Appointment, PatientHistory, 
-                     PatientHistoryDocs)
+                     PatientHistoryDocs, DocumentUploadSession)
 
 class LabTypeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -161,6 +161,17 @@ class PatientHistorySerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['history_id', 'created_at', 'updated_at']
 
+class PatientHistorySummarySerializer(serializers.ModelSerializer):
+    """
+    PatientHistory without the history/allergies/notes JSON, for list views
+    """
+    patient_name = serializers.CharField(source='patient.patient_name', read_only=True)
+    
+    class Meta:
+        model = PatientHistory
+        fields = ['history_id', 'patient', 'patient_name', 'created_at', 'updated_at']
+        read_only_fields = ['history_id', 'created_at', 'updated_at']
+
 class PatientHistoryDocsSerializer(serializers.ModelSerializer):
     patient_name = serializers.CharField(source='patient.patient_name', read_only=True)
     
@@ -209,6 +220,45 @@ class DocumentUploadSerializer(serializers.Serializer):
         
         return data
 
+class ChunkedUploadInitSerializer(serializers.Serializer):
+    """
+    Serializer for starting a resumable chunked document upload
+    """
+    patient_id = serializers.IntegerField()
+    document_name = serializers.CharField(max_length=255)
+    document_type = serializers.ChoiceField(choices=PatientHistoryDocs.DOCUMENT_TYPE_CHOICES, default='other')
+    total_size = serializers.IntegerField(min_value=1)
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$')
+    
+    def validate_patient_id(self, value):
+        """Validate that patient exists"""
+        from .models import Patient
+        if not Patient.objects.filter(patient_id=value).exists():
+            raise serializers.ValidationError(f"Patient with ID {value} does not exist")
+        return value
+    
+    def validate_total_size(self, value):
+        from django.conf import settings
+        max_size = getattr(settings, 'DOCUMENT_UPLOAD_MAX_SIZE', 1024 ** 3)
+        if value > max_size:
+            raise serializers.ValidationError(f"File exceeds the maximum upload size of {max_size} bytes")
+        return value
+    
+    def validate_sha256(self, value):
+        return value.lower()
+
+class DocumentUploadSessionSerializer(serializers.ModelSerializer):
+    """
+    Serializer for chunked upload session state
+    """
+    class Meta:
+        model = DocumentUploadSession
+        fields = [
+            'upload_id', 'patient', 'document_name', 'document_type', 'total_size',
+            'sha256', 'received_bytes', 'status', 'document', 'created_at', 'updated_at'
+        ]
+        read_only_fields = fields
+
 class ConsolidatedHistorySerializer(serializers.Serializer):
     """
     Serializer for consolidated patient history response
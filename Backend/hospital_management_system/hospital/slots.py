@@ -0,0 +1,460 @@
+"""
+Shift slot templates
+
+A shift's slots are edited as a whole set. The requested (start time,
+duration) pairs are diffed against the shift's existing slots: new pairs are
+inserted, pairs no longer requested are deactivated rather than deleted
+(appointments reference their slot), and previously deactivated pairs are
+reactivated, each in one bulk statement. Deactivating a slot that still has
+upcoming bookings is refused unless the caller asks for the bookings to be
+migrated to the requested slot starting at, or covering, the same time.
+
+A shift can instead carry an arithmetic template (Shift.slot_duration and
+slot_breaks): its slots are the duration-sized steps from start to end that
+don't overlap a break. They are computed, not stored, and listed under virtual
+ids encoding (shift, position); the per-shift vector is LRU-cached keyed on the
+template itself, so editing the template needs no invalidation. Appointments
+still reference a Slot row, so a position gets one the first time it is
+booked. Converting a shift keeps existing rows at template positions, and so
+their ids, and treats the rest like slots dropped from a template.
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import datetime, time
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from hospital_management_system.db import write_transaction
+from machine_learning.cache import bump_data_version
+from .models import Appointment, Shift, Slot
+
+# (start time, duration in minutes, remark)
+SlotSpec = Tuple[time, int, str]
+
+# (slot id, start time, duration in minutes, is active) as availability views list a slot
+ListedSlot = Tuple[int, time, int, bool]
+
+# Virtual slot id = VIRTUAL_SLOT_BASE + shift_id * MAX_TEMPLATE_SLOTS + position
+VIRTUAL_SLOT_BASE = 1_000_000_000
+MAX_TEMPLATE_SLOTS = 1000
+MIN_TEMPLATE_DURATION = 5
+DAY_MINUTES = 24 * 60
+
+
+class SlotTemplateError(ValueError):
+    """A slot template that can't be applied as requested"""
+
+
+def parse_slot_template(slots_data) -> List[SlotSpec]:
+    """
+    Validate the requested slots
+
+    Raises:
+        SlotTemplateError: On a missing field, bad time or duration, or a repeated slot
+    """
+    if not isinstance(slots_data, list):
+        raise SlotTemplateError("slots must be a list")
+    specs = []
+    seen = set()
+    for slot_data in slots_data:
+        start_time_str = slot_data.get("start_time") if isinstance(slot_data, dict) else None
+        duration = slot_data.get("duration") if isinstance(slot_data, dict) else None
+        if not all([start_time_str, duration]):
+            raise SlotTemplateError("Each slot must have start_time and duration")
+        try:
+            start_time = datetime.strptime(start_time_str, "%H:%M:%S").time()
+        except (TypeError, ValueError):
+            raise SlotTemplateError(f"Invalid time format: {start_time_str}. Use HH:MM:SS")
+        try:
+            duration = int(duration)
+        except (TypeError, ValueError):
+            duration = 0
+        if duration <= 0:
+            raise SlotTemplateError(f"Invalid duration for slot at {start_time_str}")
+        if (start_time, duration) in seen:
+            raise SlotTemplateError(f"Slot at {start_time_str} for {duration} minutes is listed twice")
+        seen.add((start_time, duration))
+        specs.append((start_time, duration, slot_data.get("remark") or ""))
+    return specs
+
+
+def _minutes(value: time) -> int:
+    return value.hour * 60 + value.minute
+
+
+def _clock(minutes: int) -> time:
+    minutes %= DAY_MINUTES
+    return time(minutes // 60, minutes % 60)
+
+
+def _parse_clock(value) -> int:
+    for fmt in ("%H:%M", "%H:%M:%S"):
+        try:
+            return _minutes(datetime.strptime(str(value), fmt).time())
+        except ValueError:
+            continue
+    raise SlotTemplateError(f"Invalid time format: {value}. Use HH:MM")
+
+
+@lru_cache(maxsize=1024)
+def slot_starts(start: int, end: int, duration: int, breaks: Tuple[Tuple[int, int], ...]) -> Tuple[int, ...]:
+    """
+    Start minute of every slot of a template, counted from the shift's midnight;
+    a shift crossing midnight has starts past 24 * 60
+    """
+    if end <= start:
+        end += DAY_MINUTES
+    # Breaks before the shift's start belong to the next day of a night shift
+    breaks = sorted((b_start + DAY_MINUTES, b_end + DAY_MINUTES) if b_start < start else (b_start, b_end)
+                    for b_start, b_end in breaks)
+    starts = []
+    minute = start
+    while minute + duration <= end:
+        overlapping = [b_end for b_start, b_end in breaks if b_start < minute + duration and minute < b_end]
+        if overlapping:
+            minute = max(overlapping)
+            continue
+        starts.append(minute)
+        minute += duration
+    return tuple(starts)
+
+
+@lru_cache(maxsize=1024)
+def _break_minutes(breaks: Tuple[Tuple[str, str], ...]) -> Tuple[Tuple[int, int], ...]:
+    return tuple((_parse_clock(b_start), _parse_clock(b_end)) for b_start, b_end in breaks)
+
+
+def _template_key(start_time: time, end_time: time, duration: int, breaks) -> Tuple:
+    return (
+        _minutes(start_time), _minutes(end_time), duration,
+        _break_minutes(tuple(tuple(pair) for pair in breaks or ())),
+    )
+
+
+@lru_cache(maxsize=1024)
+def _shift_slot_vector(shift_id: int, start: int, end: int, duration: int,
+                       breaks: Tuple[Tuple[int, int], ...]) -> Tuple[ListedSlot, ...]:
+    base = VIRTUAL_SLOT_BASE + shift_id * MAX_TEMPLATE_SLOTS
+    return tuple(
+        (base + position, _clock(minute), duration, True)
+        for position, minute in enumerate(slot_starts(start, end, duration, breaks))
+    )
+
+
+def template_slots(shift: Shift) -> Sequence[ListedSlot]:
+    """
+    A template shift's computed slots, from the cached vector
+    """
+    return _shift_slot_vector(shift.shift_id, *_template_key(
+        shift.start_time, shift.end_time, shift.slot_duration, shift.slot_breaks))
+
+
+def listed_slots(shift: Shift) -> Sequence[ListedSlot]:
+    """
+    The shift's slots as availability views list them (through a prefetch of
+    shift.slots when there is one): a template shift's computed slots plus any
+    rows off the template, which were dropped when the shift was converted but
+    may still carry bookings; else its Slot rows
+    """
+    rows = [
+        (slot.slot_id, slot.slot_start_time, slot.slot_duration, slot.is_active)
+        for slot in shift.slots.all()
+        if not (shift.slot_duration and _position(shift, slot) is not None)
+    ]
+    if shift.slot_duration:
+        return list(template_slots(shift)) + rows
+    return rows
+
+
+def _position(shift: Shift, slot: Slot) -> Optional[int]:
+    # The template position a slot row stands for, if any
+    if slot.slot_duration != shift.slot_duration or slot.slot_start_time.second:
+        return None
+    starts = slot_starts(*_template_key(shift.start_time, shift.end_time, shift.slot_duration, shift.slot_breaks))
+    start = _minutes(slot.slot_start_time)
+    for minute in (start, start + DAY_MINUTES):
+        position = bisect_left(starts, minute)
+        if position < len(starts) and starts[position] == minute:
+            return position
+    return None
+
+
+def listed_slot_id(slot: Slot) -> int:
+    """
+    The id a booked slot is listed under: its template position's virtual id,
+    or its own id. Select slot__shift with the appointments.
+    """
+    shift = slot.shift
+    if shift.slot_duration:
+        position = _position(shift, slot)
+        if position is not None:
+            return VIRTUAL_SLOT_BASE + shift.shift_id * MAX_TEMPLATE_SLOTS + position
+    return slot.slot_id
+
+
+def _template_remark(shift: Shift, start: time) -> str:
+    return f"{shift.shift_name} Slot starting at {start}"
+
+
+def resolve_slot(slot_id) -> Slot:
+    """
+    The bookable Slot row for a listed slot id; a template position gets its
+    row the first time it is booked
+
+    Raises:
+        Slot.DoesNotExist: For an unknown or inactive slot or template position
+    """
+    try:
+        slot_id = int(slot_id)
+    except (TypeError, ValueError):
+        raise Slot.DoesNotExist(f"Invalid slot id {slot_id}")
+    if slot_id < VIRTUAL_SLOT_BASE:
+        return Slot.objects.get(slot_id=slot_id, is_active=True)
+
+    shift_id, position = divmod(slot_id - VIRTUAL_SLOT_BASE, MAX_TEMPLATE_SLOTS)
+    shift = Shift.objects.filter(shift_id=shift_id, slot_duration__isnull=False).first()
+    vector = template_slots(shift) if shift is not None else ()
+    if position >= len(vector):
+        raise Slot.DoesNotExist(f"Slot {slot_id} is not in its shift's template")
+    _, start, duration, _ = vector[position]
+
+    matching = Slot.objects.filter(shift=shift, slot_start_time=start, slot_duration=duration)
+    slot = matching.filter(is_active=True).order_by('slot_id').first()
+    if slot is not None:
+        return slot
+    with write_transaction():
+        # Two first bookings of a position must not create two rows
+        Shift.objects.select_for_update().get(shift_id=shift_id)
+        slot = matching.order_by('-is_active', 'slot_id').first()
+        if slot is None:
+            slot = Slot.objects.create(
+                slot_start_time=start, slot_duration=duration, shift=shift,
+                slot_remark=_template_remark(shift, start)
+            )
+        elif not slot.is_active:
+            slot.is_active = True
+            slot.save(update_fields=['is_active'])
+    return slot
+
+
+def template_slot_count(start_time: time, end_time: time, duration: int, breaks) -> int:
+    """
+    Slots a template yields, from the shift's columns alone
+    """
+    return len(slot_starts(*_template_key(start_time, end_time, duration, breaks)))
+
+
+def active_slot_counts() -> Dict[int, int]:
+    """
+    Bookable slots per shift id, for capacity figures
+    """
+    counts = {}
+    shifts = Shift.objects.annotate(active_slots=Count('slots', filter=Q(slots__is_active=True)))
+    for shift in shifts:
+        counts[shift.shift_id] = len(template_slots(shift)) if shift.slot_duration else shift.active_slots
+    return counts
+
+
+def parse_shift_template(shift: Shift, data) -> Tuple[int, List[List[str]]]:
+    """
+    Validate a requested template: {"duration": minutes, "breaks": [["HH:MM", "HH:MM"], ...]}
+
+    Returns:
+        (duration, breaks as stored on the shift)
+
+    Raises:
+        SlotTemplateError: On a bad duration or break, or a template without slots
+    """
+    if not isinstance(data, dict):
+        raise SlotTemplateError("template must be an object with duration and breaks")
+    try:
+        duration = int(data.get("duration"))
+    except (TypeError, ValueError):
+        raise SlotTemplateError("template duration must be an integer number of minutes")
+    if not MIN_TEMPLATE_DURATION <= duration <= DAY_MINUTES:
+        raise SlotTemplateError(f"template duration must be between {MIN_TEMPLATE_DURATION} and {DAY_MINUTES} minutes")
+    breaks = []
+    for pair in data.get("breaks") or []:
+        if not isinstance(pair, (list, tuple)) or len(pair) != 2:
+            raise SlotTemplateError("Each break must be a [start, end] pair")
+        b_start, b_end = _parse_clock(pair[0]), _parse_clock(pair[1])
+        if b_end <= b_start:
+            raise SlotTemplateError(f"Break {pair[0]}-{pair[1]} must end after it starts")
+        breaks.append([_clock(b_start).strftime('%H:%M'), _clock(b_end).strftime('%H:%M')])
+    count = len(slot_starts(*_template_key(shift.start_time, shift.end_time, duration, breaks)))
+    if not count:
+        raise SlotTemplateError("The template leaves the shift without slots")
+    if count > MAX_TEMPLATE_SLOTS:
+        raise SlotTemplateError(f"A template has at most {MAX_TEMPLATE_SLOTS} slots")
+    return duration, breaks
+
+
+def _migration_target(start: time, requested: List[SlotSpec]) -> Optional[Tuple[time, int]]:
+    # Same start time first, else the requested slot the old start falls in
+    for spec_start, duration, _ in requested:
+        if spec_start == start:
+            return spec_start, duration
+    for spec_start, duration, _ in requested:
+        if _minutes(spec_start) <= _minutes(start) < _minutes(spec_start) + duration:
+            return spec_start, duration
+    return None
+
+
+def apply_slot_template(shift: Shift, requested: List[SlotSpec], migrate_bookings: bool = False) -> Dict:
+    """
+    Make the shift's active slots exactly ``requested``; a template shift
+    goes back to stored slots
+
+    Returns:
+        Report of created, reactivated, deactivated and unchanged slots and
+        migrated appointments; if upcoming bookings stand in the way,
+        ``blocked`` lists them and nothing is written
+    """
+    return _apply(shift, requested, migrate_bookings)
+
+
+def apply_shift_template(shift: Shift, duration: int, breaks: List[List[str]], migrate_bookings: bool = False) -> Dict:
+    """
+    Switch the shift to computed slots (see parse_shift_template)
+
+    Rows at template positions stay, keeping their ids; other active rows are
+    deactivated, with their upcoming bookings blocking the switch or migrated
+    as in apply_slot_template. No rows are created except migration targets.
+
+    Returns:
+        Report as apply_slot_template's
+    """
+    positions = [
+        (_clock(minute), duration, '')
+        for minute in slot_starts(*_template_key(shift.start_time, shift.end_time, duration, breaks))
+    ]
+    return _apply(shift, positions, migrate_bookings, template=(duration, breaks))
+
+
+def _apply(shift: Shift, requested: List[SlotSpec], migrate_bookings: bool, template: Optional[Tuple] = None) -> Dict:
+    today = timezone.localdate()
+    # The diff is read and written in one transaction, so SQLite takes its write lock up front
+    with write_transaction():
+        # Serialise edits of the same shift
+        locked = Shift.objects.select_for_update().get(shift_id=shift.shift_id)
+        existing = list(Slot.objects.filter(shift=shift).order_by('-is_active', 'slot_id'))
+
+        # Active slots first, so a key that is both active and inactive keeps the active row
+        by_key: Dict[Tuple[time, int], Slot] = {}
+        for slot in existing:
+            by_key.setdefault((slot.slot_start_time, slot.slot_duration), slot)
+
+        keep, reactivate, create, remarks = [], [], [], []
+        for start, duration, remark in requested:
+            slot = by_key.get((start, duration))
+            if slot is None:
+                # Template positions get their row when first booked
+                if template is None:
+                    create.append(Slot(slot_start_time=start, slot_duration=duration, shift=shift, slot_remark=remark))
+                continue
+            if slot.is_active:
+                keep.append(slot)
+            elif template is None:
+                reactivate.append(slot)
+            if remark and remark != slot.slot_remark:
+                slot.slot_remark = remark
+                remarks.append(slot)
+        wanted = {slot.slot_id for slot in keep + reactivate}
+        deactivate = [slot for slot in existing if slot.is_active and slot.slot_id not in wanted]
+        deactivate_ids = [slot.slot_id for slot in deactivate]
+
+        booked = list(
+            Appointment.objects.filter(
+                slot_id__in=deactivate_ids, status='upcoming', appointment_date__gte=today
+            ).values('appointment_id', 'slot_id', 'staff_id', 'appointment_date', 'slot__slot_start_time')
+        )
+        moves = []  # (appointment, target key)
+        blocked = []
+        if booked and not migrate_bookings:
+            blocked = [dict(appointment, reason='booked') for appointment in booked]
+        elif booked:
+            for appointment in booked:
+                target = _migration_target(appointment['slot__slot_start_time'], requested)
+                if target is None:
+                    blocked.append(dict(appointment, reason='no_matching_slot'))
+                else:
+                    moves.append((appointment, target))
+
+            # A target slot may already be taken for that doctor and day
+            target_ids = {by_key[key].slot_id for _, key in moves if key in by_key}
+            taken = set()
+            if target_ids:
+                taken = set(
+                    Appointment.objects.filter(
+                        slot_id__in=target_ids,
+                        staff_id__in={appointment['staff_id'] for appointment, _ in moves},
+                        appointment_date__in={appointment['appointment_date'] for appointment, _ in moves},
+                    ).values_list('staff_id', 'slot_id', 'appointment_date')
+                )
+            claimed = set()
+            for appointment, key in moves:
+                slot_id = by_key[key].slot_id if key in by_key else None
+                claim = (appointment['staff_id'], key, appointment['appointment_date'])
+                if (appointment['staff_id'], slot_id, appointment['appointment_date']) in taken or claim in claimed:
+                    blocked.append(dict(appointment, reason='target_slot_booked'))
+                claimed.add(claim)
+
+        if blocked:
+            for appointment in blocked:
+                appointment['start_time'] = appointment.pop('slot__slot_start_time').strftime('%H:%M:%S')
+                appointment['appointment_date'] = appointment['appointment_date'].isoformat()
+            return {'blocked': blocked}
+
+        if template is not None:
+            for _, key in moves:
+                slot = by_key.get(key)
+                if slot is None:
+                    slot = Slot(slot_start_time=key[0], slot_duration=key[1], shift=shift,
+                                slot_remark=_template_remark(shift, key[0]))
+                    by_key[key] = slot
+                    create.append(slot)
+                elif not slot.is_active and slot not in reactivate:
+                    reactivate.append(slot)
+
+        Slot.objects.bulk_create(create)
+        if reactivate:
+            Slot.objects.filter(slot_id__in=[slot.slot_id for slot in reactivate]).update(is_active=True)
+        if remarks:
+            Slot.objects.bulk_update(remarks, ['slot_remark'])
+        if deactivate_ids:
+            Slot.objects.filter(slot_id__in=deactivate_ids).update(is_active=False)
+
+        duration, breaks = template if template is not None else (None, [])
+        template_changed = (locked.slot_duration, locked.slot_breaks or []) != (duration, breaks)
+        if template_changed:
+            Shift.objects.filter(shift_id=shift.shift_id).update(slot_duration=duration, slot_breaks=breaks)
+        shift.slot_duration, shift.slot_breaks = duration, breaks
+
+        slot_ids = {key: slot.slot_id for key, slot in by_key.items()}
+        slot_ids.update({(slot.slot_start_time, slot.slot_duration): slot.slot_id for slot in create})
+        by_target = defaultdict(list)
+        migrated = []
+        for appointment, key in moves:
+            by_target[slot_ids[key]].append(appointment['appointment_id'])
+            migrated.append({
+                'appointment_id': appointment['appointment_id'],
+                'from_slot_id': appointment['slot_id'],
+                'to_slot_id': slot_ids[key],
+            })
+        for slot_id, appointment_ids in by_target.items():
+            Appointment.objects.filter(appointment_id__in=appointment_ids).update(slot_id=slot_id)
+
+        if create or reactivate or deactivate_ids or migrated or template_changed:
+            # Bulk updates skip the post_save signals that invalidate dashboards
+            transaction.on_commit(bump_data_version)
+
+    return {
+        'blocked': [],
+        'created': [slot.slot_id for slot in create],
+        'reactivated': [slot.slot_id for slot in reactivate],
+        'deactivated': deactivate_ids,
+        'unchanged': len(keep),
+        'migrated': migrated,
+    }
@@ -0,0 +1,93 @@
+"""
+In-process background tasks
+
+Work is run on a small thread pool inside the web process. Nothing is persisted,
+so a task lost to a restart has to be retried by its caller; OCR in particular
+leaves documents with document_processed=False, which ProcessDocumentsView (or
+the next completed upload for the patient) picks up again.
+"""
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from .document_processing_service import DocumentProcessingService
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Patients with an OCR run in flight, and those that got new documents meanwhile
+_ocr_lock = threading.Lock()
+_ocr_running = set()
+_ocr_rerun = set()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'BACKGROUND_TASK_WORKERS', 2),
+                thread_name_prefix='hms-task'
+            )
+        return _executor
+
+
+def _run_task(func, *args, **kwargs):
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        logger.exception(f"Background task {func.__name__} failed")
+        raise
+    finally:
+        # Worker threads get their own DB connections; don't leak them
+        close_old_connections()
+
+
+def submit(func, *args, **kwargs) -> Future:
+    """
+    Run ``func(*args, **kwargs)`` on the background pool
+    """
+    return _get_executor().submit(_run_task, func, *args, **kwargs)
+
+
+def submit_on_commit(func, *args, **kwargs):
+    """
+    Submit ``func`` once the current transaction commits, so the worker sees its rows
+    """
+    transaction.on_commit(lambda: submit(func, *args, **kwargs))
+
+
+def enqueue_document_ocr(patient_id: int):
+    """
+    Process a patient's unprocessed documents in the background after commit
+    """
+    submit_on_commit(_process_patient_documents, patient_id)
+
+
+def _process_patient_documents(patient_id: int):
+    # One run per patient at a time: documents are merged into a single
+    # PatientHistory row, so concurrent runs would overwrite each other.
+    with _ocr_lock:
+        if patient_id in _ocr_running:
+            _ocr_rerun.add(patient_id)
+            return
+        _ocr_running.add(patient_id)
+
+    try:
+        while True:
+            result = DocumentProcessingService().process_patient_documents(patient_id)
+            if not result['success']:
+                logger.error(f"Background OCR failed for patient {patient_id}: {result['error']}")
+            with _ocr_lock:
+                if patient_id not in _ocr_rerun:
+                    _ocr_running.discard(patient_id)
+                    return
+                _ocr_rerun.discard(patient_id)
+    except Exception:
+        with _ocr_lock:
+            _ocr_running.discard(patient_id)
+            _ocr_rerun.discard(patient_id)
+        raise
@@ -1,3 +1,558 @@
-from django.test import TestCase
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time as clock
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, time, timedelta
+from unittest import mock
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import IntegrityError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from hospital_management_system.db import write_transaction
+from .chunked_upload_service import ChunkedUploadService
+from .document_storage import DocumentSpillCache
+from .functional_views import (DoctorScheduleView, DoctorSlotsView, EnterPatientVitalsView, GetLatestPatientVitalsView,
+                               RosterView)
+from .models import (Appointment, DocumentUploadSession, Leave, Patient, PatientHistoryDocs, PatientVitals, Role,
+                     Schedule, Shift, Slot, Staff)
+from .roster import RosterError, build_roster
+from .slots import (MAX_TEMPLATE_SLOTS, VIRTUAL_SLOT_BASE, apply_shift_template, apply_slot_template, listed_slot_id,
+                    listed_slots, parse_shift_template, resolve_slot, template_slots)
 
-# Create your tests here.
+
+class InterruptedStream(io.BytesIO):
+    """
+    A request body whose connection drops after ``limit`` bytes
+    """
+
+    def __init__(self, data: bytes, limit: int):
+        super().__init__(data)
+        self.limit = limit
+
+    def read(self, size=-1):
+        if self.tell() >= self.limit:
+            raise OSError('connection reset')
+        return super().read(min(size, self.limit - self.tell()))
+
+
+class ChunkedUploadTests(TestCase):
+    """
+    The init / put-chunk / complete protocol, against local staging and storage directories
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        staging = os.path.join(self.directory, 'staging')
+        settings = override_settings(DOCUMENT_UPLOAD_STAGING_DIR=staging, MEDIA_ROOT=os.path.join(self.directory, 'media'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        enqueue = mock.patch('hospital.chunked_upload_service.enqueue_document_ocr')
+        self.enqueue_ocr = enqueue.start()
+        self.addCleanup(enqueue.stop)
+
+        self.service = ChunkedUploadService()
+        self.patient = Patient.objects.create(patient_name='Patient', patient_email='p@example.com', patient_mobile='1')
+        self.data = os.urandom(300 * 1024)
+
+    def start(self, data=None, sha256=None):
+        data = self.data if data is None else data
+        return self.service.create_session(
+            self.patient.patient_id, 'scan.pdf', 'other', len(data), sha256 or hashlib.sha256(data).hexdigest()
+        )
+
+    def put(self, session, offset, data, stream=None):
+        return self.service.append_chunk(session.upload_id, offset, stream or io.BytesIO(data), len(data))
+
+    def stored_files(self):
+        root = os.path.join(self.directory, 'media')
+        return [os.path.join(path, name) for path, _, names in os.walk(root) for name in names]
+
+    def test_upload_resumes_after_an_interrupted_chunk(self):
+        session = self.start()
+        half = len(self.data) // 2
+        self.assertTrue(self.put(session, 0, self.data[:half])['success'])
+
+        # The connection drops 1000 bytes into the second chunk; those bytes are kept
+        rest = self.data[half:]
+        result = self.put(session, half, rest, stream=InterruptedStream(rest, 1000))
+        self.assertTrue(result['success'])
+        self.assertEqual(result['session'].received_bytes, half + 1000)
+
+        self.assertTrue(self.put(session, half + 1000, self.data[half + 1000:])['success'])
+        result = self.service.complete(session.upload_id)
+        self.assertTrue(result['success'])
+        with default_storage.open(result['document'].document_url, 'rb') as stored:
+            self.assertEqual(stored.read(), self.data)
+        self.assertFalse(os.path.exists(self.service.staging_path(session)))
+        self.enqueue_ocr.assert_called_once_with(self.patient.patient_id)
+
+    def test_out_of_order_chunk_is_rejected(self):
+        session = self.start()
+        self.assertTrue(self.put(session, 0, self.data[:1000])['success'])
+
+        result = self.put(session, 5000, self.data[5000:6000])
+        self.assertFalse(result['success'])
+        self.assertEqual(result['error_code'], 'conflict')
+        result = self.put(session, 0, self.data[:1000])  # a replayed chunk
+        self.assertEqual(result['error_code'], 'conflict')
+        session.refresh_from_db()
+        self.assertEqual(session.received_bytes, 1000)
+        self.assertEqual(os.path.getsize(self.service.staging_path(session)), 1000)
+
+    def test_chunk_past_the_declared_size_is_rejected(self):
+        session = self.start(self.data[:100])
+        result = self.put(session, 0, self.data[:200])
+        self.assertEqual(result['error_code'], 'invalid')
+
+    def test_incomplete_upload_cannot_be_completed(self):
+        session = self.start()
+        self.put(session, 0, self.data[:1000])
+        result = self.service.complete(session.upload_id)
+        self.assertEqual(result['error_code'], 'conflict')
+        self.assertFalse(PatientHistoryDocs.objects.exists())
+
+    def test_checksum_mismatch_fails_the_upload(self):
+        session = self.start(sha256='0' * 64)
+        self.put(session, 0, self.data)
+
+        result = self.service.complete(session.upload_id)
+        self.assertFalse(result['success'])
+        self.assertEqual(result['error_code'], 'invalid')
+        session.refresh_from_db()
+        self.assertEqual(session.status, 'failed')
+        self.assertFalse(os.path.exists(self.service.staging_path(session)))
+        self.assertFalse(PatientHistoryDocs.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_completing_twice_returns_the_same_document(self):
+        session = self.start()
+        self.put(session, 0, self.data)
+        first = self.service.complete(session.upload_id)
+        second = self.service.complete(session.upload_id)
+        self.assertTrue(second['success'])
+        self.assertEqual(second['document'].doc_id, first['document'].doc_id)
+        self.assertEqual(PatientHistoryDocs.objects.count(), 1)
+        self.assertEqual(len(self.stored_files()), 1)
+
+    def test_stored_file_is_removed_when_recording_it_fails(self):
+        session = self.start()
+        self.put(session, 0, self.data)
+        with mock.patch.object(PatientHistoryDocs.objects, 'create', side_effect=RuntimeError('db down')):
+            with self.assertRaises(RuntimeError):
+                self.service.complete(session.upload_id)
+        self.assertEqual(self.stored_files(), [])
+        session.refresh_from_db()
+        self.assertEqual(session.status, 'uploading')
+
+        # The staged file is still there, so completing again works
+        self.assertTrue(self.service.complete(session.upload_id)['success'])
+        self.assertEqual(DocumentUploadSession.objects.get().status, 'completed')
+
+
+class DocumentSpillCacheTests(TestCase):
+    """
+    Remote documents are spilled to a size-bounded local LRU cache
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.storage = FileSystemStorage(location=os.path.join(self.directory, 'remote'))
+        self.cache = DocumentSpillCache(os.path.join(self.directory, 'cache'), max_bytes=1000)
+        for name in ('a.pdf', 'b.pdf', 'c.pdf'):
+            self.storage.save(name, ContentFile(name.encode() * 100))  # 500 bytes each
+
+    def fetch(self, name):
+        path = self.cache.get_path(name, self.storage)
+        # Distinct mtimes, so the LRU order doesn't depend on timer resolution
+        clock.sleep(0.01)
+        return path
+
+    def test_spilled_copy_matches_the_stored_file(self):
+        path = self.fetch('a.pdf')
+        self.assertTrue(path.endswith('.pdf'))
+        with open(path, 'rb') as cached:
+            self.assertEqual(cached.read(), b'a.pdf' * 100)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        a, b = self.fetch('a.pdf'), self.fetch('b.pdf')
+        self.fetch('a.pdf')  # a hit makes a the most recently used
+        c = self.fetch('c.pdf')
+        self.assertTrue(os.path.exists(a))
+        self.assertFalse(os.path.exists(b))
+        self.assertTrue(os.path.exists(c))
+
+    def test_entry_larger_than_the_cache_is_kept_until_the_next_fetch(self):
+        self.cache.max_bytes = 100
+        a = self.fetch('a.pdf')
+        self.assertTrue(os.path.exists(a))
+        self.fetch('b.pdf')
+        self.assertFalse(os.path.exists(a))
+
+
+class EnterPatientVitalsTests(TestCase):
+    """
+    A single reading entered for an appointment is validated like a device reading
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.localdate()
+        role = Role.objects.create(role_name='doctor', role_permissions={'is_doctor': True})
+        cls.doctor = Staff.objects.create(
+            staff_id='DOC1', staff_name='Doctor', role=role, created_at=today,
+            staff_email='doc@example.com', staff_mobile='1'
+        )
+        cls.patient = Patient.objects.create(patient_name='Patient', patient_email='p@example.com', patient_mobile='1')
+        shift = Shift.objects.create(shift_name='Morning', start_time=time(9), end_time=time(13))
+        slot = Slot.objects.create(slot_start_time=time(9), slot_duration=30, shift=shift)
+        cls.appointment = Appointment.objects.create(
+            patient=cls.patient, staff=cls.doctor, slot=slot, appointment_date=today
+        )
+
+    def post(self, data):
+        request = APIRequestFactory().post('/', data, format='json')
+        force_authenticate(request, user=self.doctor)
+        return EnterPatientVitalsView.as_view()(request, appointment_id=self.appointment.appointment_id)
+
+    def latest(self):
+        request = APIRequestFactory().get('/')
+        force_authenticate(request, user=self.doctor)
+        return GetLatestPatientVitalsView.as_view()(request, patient_id=self.patient.patient_id)
+
+    def test_empty_reading_is_rejected(self):
+        response = self.post({})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('At least one of', response.data['error'])
+        self.assertFalse(PatientVitals.objects.exists())
+        self.assertEqual(self.latest().status_code, 404)
+
+    def test_out_of_range_and_malformed_values_are_rejected(self):
+        response = self.post({'heartrate': 900, 'spo2': 'high'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('heartrate must be between 10 and 350', response.data['error'])
+        self.assertIn('spo2 must be a number', response.data['error'])
+        self.assertFalse(PatientVitals.objects.exists())
+
+    def test_partial_reading_is_stored_and_becomes_the_latest(self):
+        response = self.post({'heartrate': '88', 'temperature': 98.6})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['early_warning']['news_score'], 0)
+
+        vitals = PatientVitals.objects.get()
+        self.assertEqual(vitals.appointment_id_id, self.appointment.appointment_id)
+        latest = self.latest().data
+        self.assertEqual(latest['patient_heartrate'], 88)
+        self.assertEqual(latest['patient_temperature'], 98.6)
+        self.assertIsNone(latest['patient_spo2'])
+
+
+class RosterTests(TestCase):
+    """
+    Weekly rules expanded into schedules, with a conflict report for what can't be written
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.localdate()
+        role = Role.objects.create(role_name='nurse', role_permissions={})
+        cls.admin_role = Role.objects.create(role_name='admin', role_permissions={'is_admin': True})
+        Staff.objects.bulk_create(
+            Staff(staff_id=f'S{number}', staff_name=f'Staff {number}', role=role, created_at=today,
+                  staff_email=f's{number}@example.com', staff_mobile='1')
+            for number in range(100)
+        )
+        cls.morning = Shift.objects.create(shift_name='Morning', start_time=time(9), end_time=time(13))
+        cls.evening = Shift.objects.create(shift_name='Evening', start_time=time(14), end_time=time(18))
+        cls.monday = date(2026, 1, 5)
+
+    def week(self, rules, **data):
+        return {'start_date': '2026-01-05', 'end_date': '2026-01-11', 'rules': rules, **data}
+
+    def test_conflicts_and_leave_are_reported_and_the_rest_written(self):
+        Schedule.objects.create(staff_id='S0', schedule_date=self.monday, shift=self.evening)
+        Schedule.objects.create(staff_id='S1', schedule_date=self.monday, shift=self.morning)
+        Leave.objects.create(staff_id='S2', leave_reason='Training', leave_start=self.monday, leave_end=self.monday)
+        report = build_roster(self.week([
+            {'staff_ids': ['S0', 'S1', 'S2'], 'shift_id': self.morning.shift_id, 'weekdays': ['mon', 'tue']},
+            {'staff_ids': ['S1'], 'shift_id': self.evening.shift_id, 'weekdays': [1]},
+        ]))
+
+        self.assertEqual(report['conflicts'], [
+            {'staff_id': 'S1', 'date': '2026-01-06', 'shift_id': self.evening.shift_id,
+             'conflicting_shift_id': self.morning.shift_id, 'reason': 'overlapping_rules'},
+            {'staff_id': 'S0', 'date': '2026-01-05', 'shift_id': self.morning.shift_id,
+             'conflicting_shift_id': self.evening.shift_id, 'reason': 'already_scheduled'},
+        ])
+        self.assertEqual(report['on_leave'], [{'staff_id': 'S2', 'date': '2026-01-05'}])
+        self.assertEqual(report['already_scheduled'], 1)
+        # S0, S1 (the first rule wins) and S2 on Tuesday
+        self.assertEqual(report['created'], 3)
+        self.assertEqual(Schedule.objects.count(), 5)
+        self.assertEqual(Schedule.objects.get(staff_id='S0', schedule_date=self.monday).shift_id, self.evening.shift_id)
+
+    def test_abort_and_dry_run_write_nothing(self):
+        Schedule.objects.create(staff_id='S0', schedule_date=self.monday, shift=self.evening)
+        rules = [{'staff_ids': ['S0', 'S1'], 'shift_id': self.morning.shift_id}]
+
+        report = build_roster(self.week(rules), dry_run=True)
+        self.assertEqual((report['created'], report['to_create'], len(report['conflicts'])), (0, 13, 1))
+
+        admin = Staff.objects.create(staff_id='ADMIN', staff_name='Admin', role=self.admin_role,
+                                     created_at=self.monday, staff_email='a@example.com', staff_mobile='1')
+        request = APIRequestFactory().post('/', self.week(rules, on_conflict='abort'), format='json')
+        force_authenticate(request, user=admin)
+        response = RosterView.as_view()(request)
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(response.data['aborted'])
+        self.assertEqual(Schedule.objects.count(), 1)
+
+    def test_schedule_inserted_concurrently_is_rechecked(self):
+        Schedule.objects.create(staff_id='S0', schedule_date=self.monday, shift=self.evening)
+        rules = [{'staff_ids': ['S0', 'S1'], 'shift_id': self.morning.shift_id, 'weekdays': ['mon']}]
+        # The first read misses a schedule another request inserted, so the insert hits the constraint
+        stale, current = {}, {('S0', self.monday): self.evening.shift_id}
+        with mock.patch('hospital.roster._existing_schedules', side_effect=[stale, current]) as read:
+            report = build_roster(self.week(rules))
+        self.assertEqual(read.call_count, 2)
+        self.assertEqual(report['created'], 1)
+        self.assertEqual(report['conflicts'][0]['reason'], 'already_scheduled')
+        self.assertTrue(Schedule.objects.filter(staff_id='S1', schedule_date=self.monday).exists())
+
+        with mock.patch('hospital.roster._existing_schedules', return_value={}):
+            with self.assertRaises(RosterError):
+                build_roster(self.week(rules))
+
+    def test_unique_schedule_per_staff_and_date(self):
+        Schedule.objects.create(staff_id='S0', schedule_date=self.monday, shift=self.morning)
+        with self.assertRaises(IntegrityError):
+            Schedule.objects.create(staff_id='S0', schedule_date=self.monday, shift=self.evening)
+
+    def test_three_month_roster_for_a_hundred_staff(self):
+        staff_ids = [f'S{number}' for number in range(100)]
+        data = {
+            'start_date': '2026-01-01', 'end_date': '2026-03-31',
+            'rules': [{'staff_ids': staff_ids, 'shift_id': self.morning.shift_id, 'weekdays': ['mon', 'wed', 'fri']},
+                      {'staff_ids': staff_ids, 'shift_id': self.evening.shift_id, 'weekdays': ['tue', 'thu']}],
+        }
+        started = clock.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            report = build_roster(data)
+        elapsed = clock.perf_counter() - started
+        # Staff, shifts, leave and existing schedules read once each, inside a savepoint;
+        # the rest are batched inserts
+        reads = [query['sql'] for query in queries.captured_queries if not query['sql'].startswith('INSERT')]
+        self.assertEqual(len(reads), 6)
+        self.assertEqual(report['created'], 100 * 64)
+        self.assertEqual(Schedule.objects.count(), 100 * 64)
+        self.assertLess(elapsed, 1.0)
+
+
+class SlotTemplateTests(TestCase):
+    """
+    Editing a shift's slots diffs the requested set against the stored rows
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.localdate()
+        role = Role.objects.create(role_name='doctor', role_permissions={'is_doctor': True})
+        cls.doctor = Staff.objects.create(
+            staff_id='DOC1', staff_name='Doctor', role=role, created_at=today,
+            staff_email='doc@example.com', staff_mobile='1'
+        )
+        cls.patient = Patient.objects.create(patient_name='Patient', patient_email='p@example.com', patient_mobile='1')
+        cls.shift = Shift.objects.create(shift_name='Morning', start_time=time(9), end_time=time(13))
+        cls.nine, cls.half_nine, cls.ten = (
+            Slot.objects.create(slot_start_time=start, slot_duration=30, shift=cls.shift)
+            for start in (time(9), time(9, 30), time(10))
+        )
+        cls.tomorrow = today + timedelta(days=1)
+
+    def book(self, slot, **fields):
+        return Appointment.objects.create(
+            patient=self.patient, staff=self.doctor, slot=slot, appointment_date=self.tomorrow, **fields
+        )
+
+    def test_unchanged_slots_keep_their_ids(self):
+        report = apply_slot_template(self.shift, [(time(9), 30, ''), (time(9, 30), 30, ''), (time(10, 30), 30, '')])
+        self.assertEqual(report['unchanged'], 2)
+        self.assertEqual(report['deactivated'], [self.ten.slot_id])
+        self.assertEqual(len(report['created']), 1)
+        active = Slot.objects.filter(shift=self.shift, is_active=True).values_list('slot_id', flat=True)
+        self.assertEqual(set(active), {self.nine.slot_id, self.half_nine.slot_id, report['created'][0]})
+
+    def test_deactivated_slot_is_reactivated(self):
+        apply_slot_template(self.shift, [(time(9), 30, '')])
+        report = apply_slot_template(self.shift, [(time(9), 30, ''), (time(10), 30, '')])
+        self.assertEqual(report['reactivated'], [self.ten.slot_id])
+        self.assertEqual(report['created'], [])
+        self.assertEqual(report['deactivated'], [])
+        self.assertEqual(Slot.objects.filter(shift=self.shift).count(), 3)
+        self.assertTrue(Slot.objects.get(slot_id=self.ten.slot_id).is_active)
+
+    def test_dropping_a_booked_slot_is_blocked(self):
+        appointment = self.book(self.ten)
+        self.book(self.half_nine, status='completed')  # past bookings don't hold a slot
+        report = apply_slot_template(self.shift, [(time(9), 30, '')])
+        self.assertEqual(report['blocked'], [{
+            'appointment_id': appointment.appointment_id, 'slot_id': self.ten.slot_id, 'staff_id': 'DOC1',
+            'appointment_date': self.tomorrow.isoformat(), 'start_time': '10:00:00', 'reason': 'booked',
+        }])
+        self.assertEqual(Slot.objects.filter(shift=self.shift, is_active=True).count(), 3)
+
+    def test_booked_slot_is_migrated_to_the_slot_covering_it(self):
+        appointment = self.book(self.ten)
+        requested = [(time(9), 30, ''), (time(9, 30), 60, '')]
+
+        report = apply_slot_template(self.shift, [(time(9), 30, '')], migrate_bookings=True)
+        self.assertEqual(report['blocked'][0]['reason'], 'no_matching_slot')
+
+        report = apply_slot_template(self.shift, requested, migrate_bookings=True)
+        self.assertEqual(report['blocked'], [])
+        target = Slot.objects.get(shift=self.shift, slot_start_time=time(9, 30), slot_duration=60)
+        self.assertEqual(report['migrated'], [{
+            'appointment_id': appointment.appointment_id, 'from_slot_id': self.ten.slot_id, 'to_slot_id': target.slot_id,
+        }])
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.slot_id, target.slot_id)
+        self.assertFalse(Slot.objects.get(slot_id=self.ten.slot_id).is_active)
+
+    def test_two_bookings_migrating_onto_one_slot_are_blocked(self):
+        self.book(self.half_nine)
+        second = self.book(self.ten)
+        # 9:30 keeps its start and 10:00 falls inside the new 9:30 hour, for the same doctor and day
+        report = apply_slot_template(self.shift, [(time(9), 30, ''), (time(9, 30), 60, '')], migrate_bookings=True)
+        self.assertEqual([(row['appointment_id'], row['reason']) for row in report['blocked']],
+                         [(second.appointment_id, 'target_slot_booked')])
+        self.assertFalse(Slot.objects.filter(slot_duration=60).exists())
+
+
+class TemplateShiftTests(TestCase):
+    """
+    A template shift's slots are computed and listed under virtual ids
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = timezone.localdate()
+        role = Role.objects.create(role_name='doctor', role_permissions={'is_doctor': True})
+        cls.doctor = Staff.objects.create(
+            staff_id='DOC1', staff_name='Doctor', role=role, created_at=cls.today,
+            staff_email='doc@example.com', staff_mobile='1'
+        )
+        cls.patient = Patient.objects.create(patient_name='Patient', patient_email='p@example.com', patient_mobile='1')
+        cls.shift = Shift.objects.create(shift_name='Morning', start_time=time(9), end_time=time(13))
+        Schedule.objects.create(staff=cls.doctor, shift=cls.shift, schedule_date=cls.today)
+
+    def convert(self, migrate_bookings=False):
+        duration, breaks = parse_shift_template(self.shift, {'duration': 30, 'breaks': [['11:00', '11:30']]})
+        return apply_shift_template(self.shift, duration, breaks, migrate_bookings=migrate_bookings)
+
+    def get(self, view, **params):
+        request = APIRequestFactory().get('/', params)
+        force_authenticate(request, user=self.doctor)
+        return view.as_view()(request, staff_id=self.doctor.staff_id)
+
+    def test_virtual_ids_round_trip_around_a_break(self):
+        self.convert()
+        slots = template_slots(self.shift)
+        self.assertEqual([start for _, start, _, _ in slots],
+                         [time(9), time(9, 30), time(10), time(10, 30), time(11, 30), time(12), time(12, 30)])
+        base = VIRTUAL_SLOT_BASE + self.shift.shift_id * MAX_TEMPLATE_SLOTS
+        self.assertEqual([slot_id for slot_id, _, _, _ in slots], list(range(base, base + 7)))
+
+        for slot_id, start, duration, _ in slots:
+            slot = resolve_slot(slot_id)
+            self.assertEqual((slot.slot_start_time, slot.slot_duration), (start, duration))
+            self.assertEqual(listed_slot_id(Slot.objects.select_related('shift').get(slot_id=slot.slot_id)), slot_id)
+        # Resolving again finds the row made the first time
+        self.assertEqual(resolve_slot(base + 4).slot_id, resolve_slot(base + 4).slot_id)
+        self.assertEqual(Slot.objects.filter(shift=self.shift).count(), 7)
+        with self.assertRaises(Slot.DoesNotExist):
+            resolve_slot(base + 7)
+
+    def test_conversion_keeps_rows_at_template_positions(self):
+        nine = Slot.objects.create(slot_start_time=time(9), slot_duration=30, shift=self.shift)
+        lunch = Slot.objects.create(slot_start_time=time(11), slot_duration=30, shift=self.shift)
+        report = self.convert()
+        self.assertEqual((report['unchanged'], report['deactivated']), (1, [lunch.slot_id]))
+        base = VIRTUAL_SLOT_BASE + self.shift.shift_id * MAX_TEMPLATE_SLOTS
+        self.assertEqual(resolve_slot(base).slot_id, nine.slot_id)
+
+    def test_booked_off_template_row_blocks_or_migrates(self):
+        quarter = Slot.objects.create(slot_start_time=time(9, 15), slot_duration=30, shift=self.shift)
+        appointment = Appointment.objects.create(
+            patient=self.patient, staff=self.doctor, slot=quarter, appointment_date=self.today
+        )
+        self.assertEqual(self.convert()['blocked'][0]['reason'], 'booked')
+        self.shift.refresh_from_db()
+        self.assertIsNone(self.shift.slot_duration)
+
+        report = self.convert(migrate_bookings=True)
+        appointment.refresh_from_db()
+        # 9:15 falls inside the 9:00 position, which gets its row for the move
+        self.assertEqual(appointment.slot.slot_start_time, time(9))
+        self.assertEqual(report['created'], [appointment.slot_id])
+        self.assertEqual(listed_slot_id(appointment.slot), VIRTUAL_SLOT_BASE + self.shift.shift_id * MAX_TEMPLATE_SLOTS)
+
+    def test_booked_off_template_row_is_listed_in_the_schedule(self):
+        quarter = Slot.objects.create(slot_start_time=time(9, 15), slot_duration=30, shift=self.shift)
+        Appointment.objects.create(
+            patient=self.patient, staff=self.doctor, slot=quarter, appointment_date=self.today, status='completed'
+        )
+        self.assertEqual(self.convert()['deactivated'], [quarter.slot_id])
+
+        listed = listed_slots(Shift.objects.get(shift_id=self.shift.shift_id))
+        self.assertEqual(len(listed), 8)
+        self.assertEqual(listed[-1], (quarter.slot_id, time(9, 15), 30, False))
+
+        schedule = self.get(DoctorScheduleView, start_date=self.today.isoformat(), end_date=self.today.isoformat())
+        slots = {slot['slot_id']: slot for slot in schedule.data[0]['slots']}
+        self.assertEqual(len(slots), 8)
+        self.assertTrue(slots[quarter.slot_id]['is_booked'])
+        # Availability lists only the template
+        available = self.get(DoctorSlotsView, date=self.today.isoformat())
+        self.assertEqual(len(available.data), 7)
+        self.assertNotIn(quarter.slot_id, {slot['slot_id'] for slot in available.data})
+
+
+class ResolveSlotConcurrencyTests(TransactionTestCase):
+    """
+    Two first bookings of the same template position share one Slot row
+    """
+
+    def test_concurrent_first_bookings_create_one_row(self):
+        shift = Shift.objects.create(shift_name='Morning', start_time=time(9), end_time=time(13))
+        duration, breaks = parse_shift_template(shift, {'duration': 30})
+        apply_shift_template(shift, duration, breaks)
+        slot_id = template_slots(shift)[2][0]
+
+        # Both requests miss the row before either takes the lock
+        barrier = threading.Barrier(2, timeout=10)
+
+        def locked_after_both_checked():
+            barrier.wait()
+            return write_transaction()
+
+        def book(_):
+            try:
+                return resolve_slot(slot_id).slot_id
+            finally:
+                connection.close()
+
+        with mock.patch('hospital.slots.write_transaction', side_effect=locked_after_both_checked):
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                results = list(pool.map(book, range(2)))
+
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(Slot.objects.filter(shift=shift).count(), 1)
+        self.assertEqual(Slot.objects.get().slot_start_time, time(10))
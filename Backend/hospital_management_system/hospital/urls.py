@@ -127,6 +127,9 @@ urlpatterns = [
     
     # In your urls.py
     path('general/patients/<int:patient_id>/latest-vitals/', functional_views.GetLatestPatientVitalsView.as_view(), name='latest-patient-vitals'),
+    path('general/patients/<int:patient_id>/vitals/series/', functional_views.PatientVitalsSeriesView.as_view(), name='patient-vitals-series'),
+    path('general/vitals/ingest/', functional_views.VitalsIngestView.as_view(), name='vitals-ingest'),
+    path('general/vitals/early-warning/', functional_views.VitalsEarlyWarningView.as_view(), name='vitals-early-warning'),
     path('general/shifts/', functional_views.ShiftListView.as_view(), name='shift-list'),
     
     path('general/medicines/', functional_views.MedicineListView.as_view(), name='medicine-list'),
@@ -138,11 +141,13 @@ urlpatterns = [
     path('general/doctors/<str:staff_id>/schedule/', functional_views.DoctorScheduleView.as_view(), name='doctor-schedule'),
     path('general/doctors/schedules/', functional_views.AllDoctorSchedulesView.as_view(), name='all-doctor-schedules'),
     path('general/staff/set-schedule/', functional_views.SetStaffScheduleView.as_view(), name='set-staff-schedule'),
+    path('general/admin/roster/', functional_views.RosterView.as_view(), name='roster'),
     path('general/admin/set-slots/', functional_views.SetStaffSlotsView.as_view(), name='set-staff-slots'),
     
     # Lab Tests
     path('general/appointments/<int:appointment_id>/recommend-lab-tests/', functional_views.RecommendLabTestsView.as_view(), name='recommend-lab-tests'),
     path('general/lab-tests/<int:lab_test_id>/pay/', functional_views.PayForLabTestsView.as_view(), name='pay-for-lab-test'),
+    path('general/lab-tests/pay/', functional_views.PayForLabTestsCartView.as_view(), name='pay-for-lab-tests-cart'),
     path('general/lab-tests/<int:lab_test_id>/results/', functional_views.AddLabTestResultsView.as_view(), name='add-lab-test-results'),
     path('general/lab-tests/<int:lab_test_id>/status/', functional_views.UpdateLabTestStatusView.as_view(), name='update-lab-test-status'),
 
@@ -178,11 +183,15 @@ urlpatterns = [
     
     # OCR Patient Document Processing APIs
     path('ocr/documents/upload/', ocr_views.DocumentUploadView.as_view(), name='document-upload'),
+    path('ocr/uploads/', ocr_views.ChunkedUploadInitView.as_view(), name='chunked-upload-init'),
+    path('ocr/uploads/<uuid:upload_id>/', ocr_views.ChunkedUploadView.as_view(), name='chunked-upload'),
+    path('ocr/uploads/<uuid:upload_id>/complete/', ocr_views.ChunkedUploadCompleteView.as_view(), name='chunked-upload-complete'),
     path('ocr/patients/<int:patient_id>/process/', ocr_views.ProcessDocumentsView.as_view(), name='process-documents'),
     path('ocr/patients/<int:patient_id>/history/', ocr_views.PatientHistoryView.as_view(), name='patient-history'),
     path('ocr/patients/<int:patient_id>/status/', ocr_views.DocumentStatusView.as_view(), name='document-status'),
     path('ocr/patients/<int:patient_id>/documents/', ocr_views.PatientDocumentsListView.as_view(), name='patient-documents'),
     path('ocr/histories/', ocr_views.PatientHistoryListView.as_view(), name='patient-histories-list'),
+    path('ocr/search/', ocr_views.ClinicalTextSearchView.as_view(), name='clinical-text-search'),
     path('ocr/document-types/', ocr_views.DocumentTypesView.as_view(), name='document-types'),
     path('ocr/supported-formats/', ocr_views.SupportedFormatsView.as_view(), name='supported-formats'),
 ]
\ No newline at end of file
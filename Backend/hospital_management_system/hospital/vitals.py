@@ -0,0 +1,376 @@
+"""
+Patient vitals storage helpers
+
+Every insert moves the patient's PatientLatestVitals pointer forward in the
+same transaction, so the latest reading is a primary-key lookup. Chart data is
+read as columnar arrays straight from values_list and can be downsampled on
+the server (LTTB, or min/max per bucket) for long monitoring histories.
+
+Bedside devices push batches of readings through ingest_readings(), which
+validates a whole batch with array operations and writes it with bulk_create
+in chunked transactions. On SQLite those transactions begin IMMEDIATE, taking
+the write lock up front, so a concurrent writer makes them wait out the busy
+timeout instead of failing with "database is locked" halfway through.
+"""
+import json
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.utils import timezone
+from hospital_management_system.db import write_transaction
+from .models import Appointment, Patient, PatientLatestVitals, PatientVitals
+
+# API name -> PatientVitals field, in response order
+SERIES_FIELDS = {
+    'height': 'patient_height',
+    'weight': 'patient_weight',
+    'heartrate': 'patient_heartrate',
+    'spo2': 'patient_spo2',
+    'temperature': 'patient_temperature',
+}
+
+DOWNSAMPLE_METHODS = ('lttb', 'minmax')
+
+# Plausible ranges for device readings; temperature allows °C and °F
+READING_RANGES = {
+    'height': (20.0, 300.0),
+    'weight': (0.5, 700.0),
+    'heartrate': (10.0, 350.0),
+    'spo2': (40.0, 100.0),
+    'temperature': (25.0, 113.0),
+}
+
+# Device clocks may run slightly ahead of the server
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+MAX_ERRORS_REPORTED = 100
+
+
+def advance_latest_vitals(readings: Iterable[PatientVitals]):
+    """
+    Point each patient's PatientLatestVitals at the newest of ``readings`` unless
+    a newer reading is already recorded; call inside the inserting transaction
+    """
+    newest = {}
+    for reading in readings:
+        current = newest.get(reading.patient_id)
+        if current is None or (reading.created_at, reading.pk) > (current.created_at, current.pk):
+            newest[reading.patient_id] = reading
+
+    for patient_id, reading in newest.items():
+        older = Q(recorded_at__lt=reading.created_at) | Q(recorded_at=reading.created_at, vitals_id__lt=reading.pk)
+        pointer = PatientLatestVitals.objects.filter(older, patient_id=patient_id)
+        if pointer.update(vitals_id=reading.pk, recorded_at=reading.created_at):
+            continue
+        try:
+            with transaction.atomic():
+                PatientLatestVitals.objects.get_or_create(
+                    patient_id=patient_id,
+                    defaults={'vitals_id': reading.pk, 'recorded_at': reading.created_at}
+                )
+        except IntegrityError:
+            pass
+        # A concurrent insert may have created an older pointer in between
+        pointer.update(vitals_id=reading.pk, recorded_at=reading.created_at)
+
+
+def rebuild_latest_vitals(patient_ids: Iterable[int]):
+    """
+    Recompute the pointers of the given patients from their readings
+    """
+    patient_ids = list(set(patient_ids))
+    newest = PatientVitals.objects.filter(patient_id=OuterRef('patient_id')).order_by('-created_at', '-id')
+    latest = PatientVitals.objects.filter(patient_id__in=patient_ids, id=Subquery(newest.values('id')[:1]))
+    with write_transaction():
+        PatientLatestVitals.objects.filter(patient_id__in=patient_ids).delete()
+        PatientLatestVitals.objects.bulk_create([
+            PatientLatestVitals(patient_id=patient_id, vitals_id=vitals_id, recorded_at=created_at)
+            for patient_id, vitals_id, created_at in latest.values_list('patient_id', 'id', 'created_at')
+        ])
+
+
+def record_vitals(**fields) -> PatientVitals:
+    """
+    Create a PatientVitals row and move the latest pointer in one transaction
+    """
+    with write_transaction():
+        vitals = PatientVitals.objects.create(**fields)
+        advance_latest_vitals([vitals])
+    return vitals
+
+
+def latest_vitals(patient_id: int) -> Optional[PatientVitals]:
+    pointer = PatientLatestVitals.objects.select_related('vitals').filter(patient_id=patient_id).first()
+    if pointer is not None:
+        return pointer.vitals
+    # Not backfilled yet, or the pointed-to reading was deleted
+    vitals = PatientVitals.objects.filter(patient_id=patient_id).order_by('-created_at', '-id').first()
+    if vitals is not None:
+        advance_latest_vitals([vitals])
+    return vitals
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: ``threshold`` point indices that keep the shape of y(x)
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = [0]
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_start, next_end = end, edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+        previous = selected[-1]
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        selected.append(start + int(np.argmax(areas)))
+    selected.append(n - 1)
+    return np.array(selected)
+
+
+def minmax_indices(y: np.ndarray, buckets: int) -> np.ndarray:
+    """
+    Indices of the minimum and maximum of y in each of ``buckets`` equal-count buckets
+    """
+    n = len(y)
+    if buckets * 2 >= n or buckets < 1:
+        return np.arange(n)
+    edges = np.linspace(0, n, buckets + 1).astype(int)
+    selected = set()
+    for start, end in zip(edges[:-1], edges[1:]):
+        window = y[start:end]
+        selected.add(start + int(np.argmin(window)))
+        selected.add(start + int(np.argmax(window)))
+    return np.array(sorted(selected))
+
+
+def vitals_series(patient_id: int, start=None, end=None, fields: Optional[List[str]] = None,
+                  max_points: Optional[int] = None, method: str = 'lttb', downsample_by: str = 'heartrate') -> Dict:
+    """
+    Columnar vitals for a patient in [start, end)
+
+    Returns:
+        Dict with 'timestamps' (epoch milliseconds), one list per field,
+        'total_points' and 'returned_points'. With ``max_points`` the rows are
+        thinned by ``method`` applied to the ``downsample_by`` series; every
+        column keeps the same selected rows.
+    """
+    fields = fields or list(SERIES_FIELDS)
+    fetched = fields if downsample_by in fields or not max_points else [*fields, downsample_by]
+    readings = PatientVitals.objects.filter(patient_id=patient_id)
+    if start is not None:
+        readings = readings.filter(created_at__gte=start)
+    if end is not None:
+        readings = readings.filter(created_at__lt=end)
+    rows = list(
+        readings.order_by('created_at', 'id')
+        .values_list('created_at', *(SERIES_FIELDS[name] for name in fetched))
+    )
+
+    timestamps = np.array([int(row[0].timestamp() * 1000) for row in rows], dtype=np.int64)
+    columns = {
+        name: np.array([np.nan if row[position] is None else row[position] for row in rows], dtype=float)
+        for position, name in enumerate(fetched, start=1)
+    }
+
+    selected = np.arange(len(rows))
+    if max_points and len(rows) > max_points:
+        key = columns[downsample_by]
+        # Gaps in the key series must not win the area/extreme comparisons
+        key = np.where(np.isnan(key), np.nanmean(key) if np.isfinite(key).any() else 0.0, key)
+        if method == 'minmax':
+            selected = minmax_indices(key, max(max_points // 2, 1))
+        else:
+            selected = lttb_indices(timestamps.astype(float), key, max_points)
+
+    def as_list(values):
+        return [None if np.isnan(value) else round(float(value), 2) for value in values]
+
+    return {
+        'timestamps': timestamps[selected].tolist(),
+        **{name: as_list(columns[name][selected]) for name in fields},
+        'total_points': len(rows),
+        'returned_points': len(selected),
+    }
+
+
+def parse_ndjson(body: bytes) -> List[Dict]:
+    """
+    One JSON reading per line; blank lines are skipped
+
+    Raises:
+        ValueError: On a line that is not a JSON object
+    """
+    readings = []
+    for line_number, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            reading = json.loads(line)
+        except ValueError:
+            raise ValueError(f"Line {line_number} is not valid JSON")
+        if not isinstance(reading, dict):
+            raise ValueError(f"Line {line_number} is not a JSON object")
+        readings.append(reading)
+    return readings
+
+
+def _numeric_column(readings: List[Dict], key: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (values with NaN for missing, mask of values that were present but not numbers)
+    """
+    raw = [reading.get(key) for reading in readings]
+    values = np.full(len(raw), np.nan)
+    malformed = np.zeros(len(raw), dtype=bool)
+    for position, value in enumerate(raw):
+        if value is None or value == '':
+            continue
+        if isinstance(value, bool):
+            malformed[position] = True
+            continue
+        try:
+            values[position] = float(value)
+        except (TypeError, ValueError):
+            malformed[position] = True
+    malformed |= np.isinf(values)
+    return values, malformed
+
+
+def _timestamps(readings: List[Dict], now) -> Tuple[List, np.ndarray]:
+    stamps = []
+    bad = np.zeros(len(readings), dtype=bool)
+    for position, reading in enumerate(readings):
+        value = reading.get('recorded_at')
+        if not value:
+            stamps.append(now)
+            continue
+        try:
+            stamp = datetime.fromisoformat(str(value))
+        except ValueError:
+            stamps.append(None)
+            bad[position] = True
+            continue
+        if timezone.is_naive(stamp):
+            stamp = timezone.make_aware(stamp)
+        bad[position] = stamp > now + MAX_CLOCK_SKEW
+        stamps.append(stamp)
+    return stamps, bad
+
+
+def validate_readings(readings: List[Dict], now=None) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Check a batch of device readings
+
+    Each reading has patient_id, optional recorded_at (ISO 8601, default now),
+    device_id, appointment_id and at least one of height, weight, heartrate,
+    spo2, temperature. Checks run column-wise over the whole batch; patients
+    and appointments are looked up with one query each.
+
+    Returns:
+        (model field dicts for the valid readings, [{'index', 'errors'}] for the rest)
+    """
+    now = now or timezone.now()
+    n = len(readings)
+    problems = [[] for _ in range(n)]
+
+    def flag(mask, message):
+        for position in np.flatnonzero(mask):
+            problems[position].append(message)
+
+    if n and not all(isinstance(reading, dict) for reading in readings):
+        for position, reading in enumerate(readings):
+            if not isinstance(reading, dict):
+                problems[position].append('Reading must be an object')
+        readings = [reading if isinstance(reading, dict) else {} for reading in readings]
+
+    patient_ids, bad_patient = _numeric_column(readings, 'patient_id')
+    missing_patient = np.isnan(patient_ids)
+    with np.errstate(invalid='ignore'):
+        fractional = ~missing_patient & (np.mod(patient_ids, 1) != 0)
+    flag(bad_patient | missing_patient | fractional, 'patient_id is required and must be an integer')
+
+    known_patients = set(Patient.objects.filter(
+        patient_id__in={int(value) for value in patient_ids[~np.isnan(patient_ids)]}
+    ).values_list('patient_id', flat=True))
+    flag(~np.isnan(patient_ids) & ~np.isin(patient_ids, list(known_patients)), 'Unknown patient_id')
+
+    appointment_ids, bad_appointment = _numeric_column(readings, 'appointment_id')
+    flag(bad_appointment, 'appointment_id must be an integer')
+    has_appointment = ~np.isnan(appointment_ids)
+    if has_appointment.any():
+        owners = dict(Appointment.objects.filter(
+            appointment_id__in={int(value) for value in appointment_ids[has_appointment]}
+        ).values_list('appointment_id', 'patient_id'))
+        owner = np.array([owners.get(int(value), -1) if present else -1
+                          for value, present in zip(appointment_ids, has_appointment)], dtype=float)
+        flag(has_appointment & (owner != patient_ids), 'appointment_id does not belong to this patient')
+
+    columns = {}
+    any_vital = np.zeros(n, dtype=bool)
+    for name, (low, high) in READING_RANGES.items():
+        values, malformed = _numeric_column(readings, name)
+        flag(malformed, f'{name} must be a number')
+        flag(~np.isnan(values) & ((values < low) | (values > high)), f'{name} must be between {low:g} and {high:g}')
+        any_vital |= ~np.isnan(values)
+        columns[name] = values
+    flag(~any_vital, 'At least one of height, weight, heartrate, spo2, temperature is required')
+
+    stamps, bad_stamp = _timestamps(readings, now)
+    flag(bad_stamp, 'recorded_at must be an ISO 8601 timestamp not in the future')
+
+    device_ids = [reading.get('device_id') for reading in readings]
+    flag(np.array([value is not None and (not isinstance(value, str) or len(value) > 100) for value in device_ids], dtype=bool),
+         'device_id must be a string of at most 100 characters')
+
+    valid, errors = [], []
+    for position in range(n):
+        if problems[position]:
+            errors.append({'index': position, 'errors': problems[position]})
+            continue
+        row = {
+            'patient_id': int(patient_ids[position]),
+            'appointment_id_id': int(appointment_ids[position]) if has_appointment[position] else None,
+            'device_id': device_ids[position],
+            'created_at': stamps[position],
+        }
+        for name, field in SERIES_FIELDS.items():
+            value = columns[name][position]
+            row[field] = None if np.isnan(value) else (round(value) if name == 'heartrate' else float(value))
+        valid.append(row)
+    return valid, errors
+
+
+def ingest_readings(readings: List[Dict], chunk_size: Optional[int] = None) -> Dict:
+    """
+    Validate and store a batch of device readings; invalid readings are skipped
+
+    Valid readings are written with bulk_create, ``chunk_size`` per transaction,
+    and the latest-vitals pointers move forward in each chunk's transaction.
+
+    Returns:
+        Dict with accepted, rejected and (up to MAX_ERRORS_REPORTED) errors
+    """
+    chunk_size = chunk_size or getattr(settings, 'VITALS_INGEST_CHUNK_SIZE', 1000)
+    valid, errors = validate_readings(readings)
+    for start in range(0, len(valid), chunk_size):
+        chunk = [PatientVitals(**row) for row in valid[start:start + chunk_size]]
+        with write_transaction():
+            created = PatientVitals.objects.bulk_create(chunk)
+            if all(reading.pk is not None for reading in created):
+                advance_latest_vitals(created)
+            else:
+                # Backends that can't return ids from a bulk insert
+                rebuild_latest_vitals(reading.patient_id for reading in created)
+    return {
+        'accepted': len(valid),
+        'rejected': len(errors),
+        'errors': errors[:MAX_ERRORS_REPORTED],
+    }
@@ -0,0 +1,31 @@
+"""
+Database helpers shared by the apps
+"""
+from contextlib import contextmanager
+from django.db import connection, transaction
+
+
+@contextmanager
+def write_transaction():
+    """
+    atomic(), begun with BEGIN IMMEDIATE when it is SQLite's outermost block
+
+    A deferred SQLite transaction that reads before it writes fails with
+    "database is locked" when another connection holds the write lock, without
+    waiting out the busy timeout. Blocks that read and then write under
+    concurrency take the lock up front instead; other databases get a plain
+    atomic().
+    """
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        with transaction.atomic():
+            yield
+        return
+    connection.ensure_connection()
+    mode = connection.transaction_mode
+    connection.transaction_mode = 'IMMEDIATE'
+    try:
+        with transaction.atomic():
+            connection.transaction_mode = mode
+            yield
+    finally:
+        connection.transaction_mode = mode
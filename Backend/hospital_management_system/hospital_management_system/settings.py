@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -44,6 +45,7 @@ INSTALLED_APPS = [
     'hospital',
     'accounts',
     'transactions',
+    'machine_learning',
     'storages',
 ]
 
@@ -84,6 +86,16 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # WAL lets readers run alongside the (frequent, small) vitals writes
+        'OPTIONS': {
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            'timeout': 20,
+        },
+        # The concurrency tests write from several threads; an in-memory test
+        # database is shared-cache, where parallel writers fail instead of waiting
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -103,6 +115,7 @@ DATABASES = {
 # AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 # AWS_STORAGE_BUCKET_NAME = 'hms-infosys-bucket'
 # AWS_S3_REGION_NAME = 'ap-south-1'  # e.g., 'us-west-2'
+# AWS_S3_ENDPOINT_URL = os.getenv('AWS_S3_ENDPOINT_URL')  # S3-compatible stand-in (e.g. MinIO) for local testing
 
 # DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
 
@@ -113,6 +126,62 @@ DATABASES = {
 
 # DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
 
+# Caches. The analytics dashboards get their own alias so the backend can be
+# swapped without touching anything else. Writes invalidate cached dashboards by
+# bumping a version key in this cache, so every process that serves or writes
+# (gunicorn workers, management commands) must share it:
+#   django.core.cache.backends.filebased.FileBasedCache  (default; LOCATION is a directory,
+#       shared by the processes on one host)
+#   django.core.cache.backends.redis.RedisCache  (LOCATION redis://host:6379, needs the redis
+#       package; use this when the app runs on more than one host)
+#   django.core.cache.backends.locmem.LocMemCache  (single process only, e.g. runserver: other
+#       processes' bumps never reach it, so it serves stale data for up to the TTL)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'analytics': {
+        'BACKEND': os.getenv('ANALYTICS_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv(
+            'ANALYTICS_CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'hms_analytics_cache')
+        ),
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+}
+
+# Seconds an analytics response stays fresh; data changes invalidate it sooner
+ANALYTICS_CACHE_TTL = 60
+
+# No-show risk model written by `manage.py train_no_show_model`
+NO_SHOW_MODEL_PATH = os.environ.get('NO_SHOW_MODEL_PATH', os.path.join(BASE_DIR, 'ml_models', 'no_show_model.npz'))
+
+# Booking reason -> specialization router written by `manage.py train_specialization_router`
+SPECIALIZATION_ROUTER_MODEL_PATH = os.environ.get(
+    'SPECIALIZATION_ROUTER_MODEL_PATH', os.path.join(BASE_DIR, 'ml_models', 'specialization_router.npz')
+)
+
+# Bedside device vitals ingestion (general/vitals/ingest/)
+VITALS_INGEST_MAX_READINGS = 10000
+VITALS_INGEST_CHUNK_SIZE = 1000
+
+# Invoice numbers reserved per round trip (transactions/numbering.py). 1 keeps
+# numbers gapless; larger blocks cut contention but may leave gaps on restart.
+INVOICE_NUMBER_BLOCK_SIZE = int(os.environ.get('INVOICE_NUMBER_BLOCK_SIZE', 1))
+
+# Cached invoice PDFs (transactions/invoice_pdf.py). Bump the version whenever
+# invoice_template.html changes so stored PDFs are re-rendered. Set the header to
+# 'X-Sendfile' or 'X-Accel-Redirect' to let the web server send the files.
+INVOICE_PDF_TEMPLATE_VERSION = 1
+INVOICE_PDF_SENDFILE_HEADER = os.environ.get('INVOICE_PDF_SENDFILE_HEADER') or None
+INVOICE_PDF_ACCEL_REDIRECT_PREFIX = os.environ.get('INVOICE_PDF_ACCEL_REDIRECT_PREFIX', '/protected/')
+
+# Idempotency keys on payment endpoints (transactions/idempotency.py): how long a
+# response is replayed, and after how long an unfinished claim may be taken over
+IDEMPOTENCY_KEY_TTL_HOURS = 24
+IDEMPOTENCY_LOCK_TIMEOUT_SECONDS = 60
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -183,6 +252,19 @@ EMAIL_USE_TLS = True
 # Gemini OCR API settings
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
+# Resumable chunked document uploads (staging must be on local disk)
+DOCUMENT_UPLOAD_STAGING_DIR = os.getenv('DOCUMENT_UPLOAD_STAGING_DIR', os.path.join(BASE_DIR, 'upload_staging'))
+DOCUMENT_UPLOAD_MAX_SIZE = 1024 * 1024 * 1024
+DOCUMENT_UPLOAD_MAX_CHUNK_SIZE = 16 * 1024 * 1024
+DOCUMENT_UPLOAD_SESSION_TTL_HOURS = 48
+
+# Local copies of remote (e.g. S3) documents for OCR, evicted LRU past the size limit
+DOCUMENT_SPILL_CACHE_DIR = os.getenv('DOCUMENT_SPILL_CACHE_DIR', os.path.join(BASE_DIR, 'document_cache'))
+DOCUMENT_SPILL_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# Threads for in-process background work (OCR after upload, ...)
+BACKGROUND_TASK_WORKERS = 2
+
 # For local development, uncomment the following to use local media storage
 # MEDIA_URL = '/media/'
 # MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
@@ -0,0 +1,175 @@
+"""
+Time-bucketed aggregation helpers for the admin analytics views
+
+Each series is one GROUP BY over TruncDay/TruncWeek/TruncMonth; buckets with no
+rows are zero-filled in Python so the query count does not grow with the range.
+"""
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+from django.db.models import DateField, QuerySet
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
+
+GRANULARITIES = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+PERIODS = ('week', 'month', 'year')
+
+
+def _parse_date(value: str, name: str) -> date:
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a date in YYYY-MM-DD format")
+
+
+def _first_of_month(day: date, months_back: int = 0) -> date:
+    month_index = day.year * 12 + day.month - 1 - months_back
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def optional_date_range(query_params) -> Tuple[Optional[date], Optional[date]]:
+    """
+    Parse optional ``start_date``/``end_date`` params; either bound may be open
+
+    Raises:
+        ValueError: On a malformed date or start_date after end_date
+    """
+    start_param = query_params.get('start_date')
+    end_param = query_params.get('end_date')
+    start_date = _parse_date(start_param, 'start_date') if start_param else None
+    end_date = _parse_date(end_param, 'end_date') if end_param else None
+    if start_date and end_date and start_date > end_date:
+        raise ValueError("start_date must not be after end_date")
+    return start_date, end_date
+
+
+def resolve_date_range(query_params, today: Optional[date] = None) -> Dict:
+    """
+    Work out the reporting window from ``period`` or ``start_date``/``end_date``
+
+    Presets: week = last 7 days by day, month = last 30 days by week,
+    year = last 12 calendar months by month. A custom range picks a
+    granularity from its length unless ``granularity`` is given.
+
+    Returns:
+        Dict with period, start_date, end_date and granularity
+
+    Raises:
+        ValueError: On an unknown period/granularity or a malformed range
+    """
+    today = today or timezone.localdate()
+    start_param = query_params.get('start_date')
+    end_param = query_params.get('end_date')
+    granularity = query_params.get('granularity')
+
+    if start_param or end_param:
+        if not (start_param and end_param):
+            raise ValueError("start_date and end_date must be given together")
+        start_date = _parse_date(start_param, 'start_date')
+        end_date = _parse_date(end_param, 'end_date')
+        if start_date > end_date:
+            raise ValueError("start_date must not be after end_date")
+        period = 'custom'
+        if not granularity:
+            span = (end_date - start_date).days
+            granularity = 'day' if span <= 31 else 'week' if span <= 183 else 'month'
+    else:
+        period = query_params.get('period', 'month')
+        end_date = today
+        if period == 'week':
+            start_date, default_granularity = today - timedelta(days=6), 'day'
+        elif period == 'month':
+            start_date, default_granularity = today - timedelta(days=29), 'week'
+        elif period == 'year':
+            start_date, default_granularity = _first_of_month(today, 11), 'month'
+        else:
+            raise ValueError("Invalid period")
+        granularity = granularity or default_granularity
+
+    if granularity not in GRANULARITIES:
+        raise ValueError("granularity must be one of day, week, month")
+
+    return {
+        'period': period,
+        'start_date': start_date,
+        'end_date': end_date,
+        'granularity': granularity,
+    }
+
+
+def bucket_starts(start_date: date, end_date: date, granularity: str) -> List[date]:
+    """
+    Every bucket start between start_date and end_date, in the same
+    alignment the database Trunc functions use (weeks start on Monday)
+    """
+    if granularity == 'day':
+        current, step = start_date, None
+    elif granularity == 'week':
+        current, step = start_date - timedelta(days=start_date.weekday()), None
+    else:
+        current, step = start_date.replace(day=1), 'month'
+
+    starts = []
+    while current <= end_date:
+        starts.append(current)
+        if step == 'month':
+            current = _first_of_month(current, -1)
+        else:
+            current += timedelta(days=7 if granularity == 'week' else 1)
+    return starts
+
+
+def bucket_label(bucket_start: date, granularity: str, start_date: date, end_date: date) -> Dict:
+    """
+    Label fields for one bucket, matching the keys the analytics API has always used
+    """
+    if granularity == 'day':
+        return {'date': bucket_start.isoformat()}
+    if granularity == 'week':
+        # Clip partial weeks at either end of the range
+        first = max(bucket_start, start_date)
+        last = min(bucket_start + timedelta(days=6), end_date)
+        return {'period': f"{first.isoformat()} to {last.isoformat()}"}
+    return {'month': bucket_start.strftime('%B %Y')}
+
+
+def bucketed_rows(queryset: QuerySet, date_field: str, granularity: str,
+                  aggregates: Dict, group_by: Tuple[str, ...] = ()) -> List[Dict]:
+    """
+    Run one GROUP BY (bucket, *group_by) query
+
+    Returns:
+        List of dicts with 'bucket' (a date), the group_by fields and the aggregates
+    """
+    trunc = GRANULARITIES[granularity]
+    return list(
+        queryset.annotate(bucket=trunc(date_field, output_field=DateField()))
+        .values('bucket', *group_by)
+        .annotate(**aggregates)
+        .order_by('bucket', *group_by)
+    )
+
+
+def zero_filled_series(rows: List[Dict], window: Dict, values: Dict) -> List[Dict]:
+    """
+    Turn bucketed rows into one entry per bucket in the window, oldest first
+
+    Args:
+        rows: Output of bucketed_rows (one row per bucket, no group_by)
+        window: Output of resolve_date_range
+        values: Output key -> (row key, default) for the value fields
+    """
+    by_bucket = {row['bucket']: row for row in rows}
+    series = []
+    for start in bucket_starts(window['start_date'], window['end_date'], window['granularity']):
+        row = by_bucket.get(start, {})
+        entry = bucket_label(start, window['granularity'], window['start_date'], window['end_date'])
+        for output_key, (row_key, default) in values.items():
+            value = row.get(row_key)
+            entry[output_key] = default if value is None else value
+        series.append(entry)
+    return series
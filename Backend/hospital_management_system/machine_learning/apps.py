@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class MachineLearningConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'machine_learning'
+
+    def ready(self):
+        # Keeps the analytics rollup tables in sync
+        from . import signals  # noqa: F401
@@ -0,0 +1,125 @@
+"""
+Response cache for the admin analytics endpoints
+
+Entries live in the ``analytics`` cache alias (file-based by default, or Redis;
+see CACHES in settings) and are keyed by endpoint, query params, today's date
+and a data version that signals bump whenever the underlying rows change, so a
+write makes every cached dashboard miss instead of waiting out the TTL. That
+holds only for processes sharing the cache: with LocMemCache a bump reaches the
+process that made it and no other.
+
+Expired entries are recomputed by a single request: the first one to take the
+per-key lock recomputes while the others serve the previous value (or wait
+briefly when there is none).
+"""
+import time
+import hashlib
+import logging
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+CACHE_ALIAS = 'analytics'
+VERSION_KEY = 'analytics:data-version'
+LOCK_TIMEOUT = 30
+LOCK_WAIT = 5
+LOCK_POLL_INTERVAL = 0.05
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def data_version() -> int:
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # A fresh start (or an evicted counter) must not reuse an old version
+        version = time.time_ns()
+        if not cache.add(VERSION_KEY, version, timeout=None):
+            version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def bump_data_version():
+    """
+    Invalidate every cached analytics response
+    """
+    cache = get_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def _base_key(endpoint: str, query_params) -> str:
+    params = '&'.join(
+        f"{name}={','.join(sorted(query_params.getlist(name)))}"
+        for name in sorted(query_params)
+    )
+    digest = hashlib.sha256(f"{timezone.localdate().isoformat()}?{params}".encode('utf-8')).hexdigest()
+    return f"analytics:{endpoint}:{digest}"
+
+
+def _compute_and_store(cache, compute, key, latest_key, ttl):
+    response = compute()
+    if response.status_code == 200:
+        # "latest" outlives the TTL so it can be served while a recompute runs
+        cache.set(key, response.data, timeout=ttl)
+        cache.set(latest_key, response.data, timeout=ttl * 10)
+    return response
+
+
+def cached_analytics_response(endpoint: str, ttl: int = None):
+    """
+    Cache a view method's 200 responses under the data version
+
+    Args:
+        endpoint: Name used in the cache key
+        ttl: Seconds an entry stays fresh (default settings.ANALYTICS_CACHE_TTL)
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(view, request, *args, **kwargs):
+            cache = get_cache()
+            timeout = ttl or getattr(settings, 'ANALYTICS_CACHE_TTL', 60)
+            base_key = _base_key(endpoint, request.query_params)
+            key = f"{base_key}:v{data_version()}"
+            latest_key = f"{base_key}:latest"
+            lock_key = f"{key}:lock"
+            compute = lambda: view_method(view, request, *args, **kwargs)
+
+            data = cache.get(key)
+            if data is not None:
+                return Response(data, status=200, headers={'X-Analytics-Cache': 'hit'})
+
+            if cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+                try:
+                    response = _compute_and_store(cache, compute, key, latest_key, timeout)
+                finally:
+                    cache.delete(lock_key)
+                response['X-Analytics-Cache'] = 'miss'
+                return response
+
+            # Someone else is recomputing: serve the previous value if we have one
+            stale = cache.get(latest_key)
+            if stale is not None:
+                return Response(stale, status=200, headers={'X-Analytics-Cache': 'stale'})
+
+            deadline = time.monotonic() + LOCK_WAIT
+            while time.monotonic() < deadline:
+                time.sleep(LOCK_POLL_INTERVAL)
+                data = cache.get(key)
+                if data is not None:
+                    return Response(data, status=200, headers={'X-Analytics-Cache': 'hit'})
+
+            logger.warning(f"Timed out waiting for {endpoint} analytics recompute")
+            response = compute()
+            response['X-Analytics-Cache'] = 'miss'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,224 @@
+"""
+Early-warning scores and personal-baseline anomaly flags for patient vitals
+
+Heart rate, SpO2 and temperature are scored on the NEWS2 bands; a reading
+scoring 3 on any one sign or 5+ overall needs urgent review. Each reading is
+also compared with the patient's own earlier readings and signs more than
+Z_THRESHOLD standard deviations away are flagged.
+
+Everything runs on NumPy arrays: a day's readings for the ward dashboard are
+scored in one pass, and a single new reading goes through the same code.
+"""
+from datetime import datetime, time, timedelta
+from typing import Dict, List
+import numpy as np
+from django.db.models import Avg, Case, Count, F, FloatField, Q, When
+from django.utils import timezone
+from hospital.models import PatientVitals
+
+# Reading field -> short name used in the API
+VITAL_SIGNS = {
+    'patient_heartrate': 'heartrate',
+    'patient_spo2': 'spo2',
+    'patient_temperature': 'temperature',
+}
+
+# NEWS2 bands as (upper bin edges, score per bin); values on an edge fall in the higher bin
+NEWS_BANDS = {
+    # <=40, 41-50, 51-90, 91-110, 111-130, >=131
+    'heartrate': (np.array([40.5, 50.5, 90.5, 110.5, 130.5]), np.array([3, 1, 0, 1, 2, 3])),
+    # <=91, 92-93, 94-95, >=96 (scale 1)
+    'spo2': (np.array([91.5, 93.5, 95.5]), np.array([3, 2, 1, 0])),
+    # <=35.0, 35.1-36.0, 36.1-38.0, 38.1-39.0, >=39.1
+    'temperature': (np.array([35.05, 36.05, 38.05, 39.05]), np.array([3, 1, 0, 1, 2])),
+}
+
+Z_THRESHOLD = 3.0
+MIN_BASELINE_READINGS = 5
+# Floors on the personal standard deviation so a very stable history doesn't flag noise
+MIN_BASELINE_STD = {'heartrate': 3.0, 'spo2': 1.0, 'temperature': 0.2}
+
+
+def celsius(temperature: np.ndarray) -> np.ndarray:
+    """
+    Readings above 50 are taken to be Fahrenheit (the app's vitals form uses °F)
+    """
+    return np.where(temperature > 50, (temperature - 32) * 5 / 9, temperature)
+
+
+def news_scores(values: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    Component and total NEWS scores (temperature in °C); missing (NaN) signs score 0
+    """
+    scores = {}
+    for sign, (edges, band_scores) in NEWS_BANDS.items():
+        readings = values[sign]
+        component = band_scores[np.digitize(np.nan_to_num(readings, nan=np.inf), edges)]
+        scores[sign] = np.where(np.isnan(readings), 0, component)
+    scores['total'] = sum(scores[sign] for sign in NEWS_BANDS)
+    scores['max_component'] = np.max([scores[sign] for sign in NEWS_BANDS], axis=0)
+    return scores
+
+
+def risk_levels(total: np.ndarray, max_component: np.ndarray) -> np.ndarray:
+    return np.select(
+        [total >= 7, total >= 5, max_component >= 3],
+        ['high', 'medium', 'low-medium'],
+        default='low'
+    )
+
+
+def _column(rows: List[Dict], field: str) -> np.ndarray:
+    return np.array([np.nan if row[field] is None else row[field] for row in rows], dtype=float)
+
+
+def _baseline_totals(patient_ids, before_filter: Q) -> Dict[int, Dict[str, tuple]]:
+    """
+    Per patient and sign: (count, mean, mean of squares) over the matching readings
+    """
+    aggregates = {}
+    for field, sign in VITAL_SIGNS.items():
+        value = F(field)
+        if sign == 'temperature':
+            value = Case(When(**{f'{field}__gt': 50}, then=(F(field) - 32) * 5 / 9), default=F(field),
+                         output_field=FloatField())
+        aggregates[f'{sign}_n'] = Count(field)
+        aggregates[f'{sign}_mean'] = Avg(value, output_field=FloatField())
+        aggregates[f'{sign}_sq'] = Avg(value * value, output_field=FloatField())
+    rows = (
+        PatientVitals.objects.filter(before_filter, patient_id__in=patient_ids)
+        .values('patient_id')
+        .annotate(**aggregates)
+    )
+    return {
+        row['patient_id']: {
+            sign: (row[f'{sign}_n'], row[f'{sign}_mean'] or 0.0, row[f'{sign}_sq'] or 0.0)
+            for sign in VITAL_SIGNS.values()
+        }
+        for row in rows
+    }
+
+
+def score_readings(rows: List[Dict], baselines: Dict[int, Dict[str, tuple]]) -> List[Dict]:
+    """
+    Score readings ordered by (patient, created_at)
+
+    Args:
+        rows: Dicts with id, patient_id, created_at and the vital fields
+        baselines: Output of _baseline_totals for readings before the first row
+            of each patient; earlier rows in ``rows`` are added to it, so every
+            reading is compared with everything its patient had before it
+    """
+    if not rows:
+        return []
+    values = {sign: _column(rows, field) for field, sign in VITAL_SIGNS.items()}
+    values['temperature'] = celsius(values['temperature'])
+    scores = news_scores(values)
+    levels = risk_levels(scores['total'], scores['max_component'])
+
+    patients = np.array([row['patient_id'] for row in rows])
+    new_patient = np.r_[True, patients[1:] != patients[:-1]]
+    index = np.arange(len(rows))
+    group_start = np.maximum.accumulate(np.where(new_patient, index, 0))
+
+    def before_in_batch(series):
+        # Running total over the patient's earlier rows in this batch
+        running = np.cumsum(series) - series
+        return running - running[group_start]
+
+    z_scores = {}
+    for sign, readings in values.items():
+        present = ~np.isnan(readings)
+        filled = np.where(present, readings, 0.0)
+        n_batch = before_in_batch(present.astype(float))
+        sum_batch = before_in_batch(filled)
+        sq_batch = before_in_batch(filled * filled)
+
+        stored = np.array([baselines.get(p, {}).get(sign, (0, 0.0, 0.0)) for p in patients], dtype=float)
+        n_stored = stored[:, 0]
+        n = n_stored + n_batch
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = (n_stored * stored[:, 1] + sum_batch) / n
+            mean_sq = (n_stored * stored[:, 2] + sq_batch) / n
+            std = np.maximum(np.sqrt(np.clip(mean_sq - mean * mean, 0, None)), MIN_BASELINE_STD[sign])
+            z = (readings - mean) / std
+        z_scores[sign] = np.where(present & (n >= MIN_BASELINE_READINGS), z, np.nan)
+
+    results = []
+    for position, row in enumerate(rows):
+        deviations = {
+            sign: round(float(z_scores[sign][position]), 2)
+            for sign in VITAL_SIGNS.values()
+            if not np.isnan(z_scores[sign][position])
+        }
+        results.append({
+            'vitals_id': row['id'],
+            'patient_id': row['patient_id'],
+            'created_at': row['created_at'],
+            'heartrate': row['patient_heartrate'],
+            'spo2': row['patient_spo2'],
+            'temperature': row['patient_temperature'],
+            'news_score': int(scores['total'][position]),
+            'components': {sign: int(scores[sign][position]) for sign in NEWS_BANDS},
+            'risk': str(levels[position]),
+            'z_scores': deviations,
+            'anomalies': sorted(sign for sign, z in deviations.items() if abs(z) >= Z_THRESHOLD),
+        })
+    return results
+
+
+READING_FIELDS = ('id', 'patient_id', 'created_at', *VITAL_SIGNS)
+
+
+def assess_day(day, min_score: int = 0) -> List[Dict]:
+    """
+    Ward dashboard: every patient with vitals recorded on ``day``, worst first
+
+    Two queries: the day's readings, and one aggregate of each patient's earlier history.
+    """
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    end = start + timedelta(days=1)
+    rows = list(
+        PatientVitals.objects.filter(created_at__gte=start, created_at__lt=end)
+        .order_by('patient_id', 'created_at', 'id')
+        .values(*READING_FIELDS, 'patient__patient_name')
+    )
+    if not rows:
+        return []
+    names = {row['patient_id']: row['patient__patient_name'] for row in rows}
+    baselines = _baseline_totals({row['patient_id'] for row in rows}, Q(created_at__lt=start))
+
+    patients = {}
+    for result in score_readings(rows, baselines):
+        summary = patients.setdefault(result['patient_id'], {
+            'patient_id': result['patient_id'],
+            'patient_name': names[result['patient_id']],
+            'readings_today': 0,
+            'max_news_score': 0,
+            'anomalies_today': set(),
+        })
+        summary['readings_today'] += 1
+        summary['max_news_score'] = max(summary['max_news_score'], result['news_score'])
+        summary['anomalies_today'].update(result['anomalies'])
+        summary['latest'] = result  # rows are in time order per patient
+
+    dashboard = []
+    for summary in patients.values():
+        if summary['max_news_score'] < min_score:
+            continue
+        summary['anomalies_today'] = sorted(summary['anomalies_today'])
+        dashboard.append(summary)
+    dashboard.sort(key=lambda item: (-item['latest']['news_score'], -item['max_news_score']))
+    return dashboard
+
+
+def assess_reading(vitals: PatientVitals) -> Dict:
+    """
+    Score one just-saved reading against everything the patient had before it
+    """
+    row = {field: getattr(vitals, field) for field in READING_FIELDS}
+    baselines = _baseline_totals(
+        [vitals.patient_id],
+        Q(created_at__lt=vitals.created_at) | Q(created_at=vitals.created_at, id__lt=vitals.id)
+    )
+    return score_readings([row], baselines)[0]
@@ -0,0 +1,197 @@
+"""
+Appointment demand forecasting and shift capacity recommendations
+
+Daily booked appointments per specialization (from the appointment rollups)
+are fitted with a linear trend plus weekday effects by least squares; the
+forecast's upper quantile is turned into the number of shifts, and so doctors,
+needed each day. Reports are built by the build_capacity_forecast command and
+stored in CapacityForecastReport; requests only read the latest one.
+"""
+import math
+from datetime import date, timedelta
+from statistics import NormalDist
+from typing import Dict, List, Optional
+import numpy as np
+from django.db.models import Count, Sum
+from django.utils import timezone
+from hospital.models import DoctorDetails, Schedule
+from hospital.slots import active_slot_counts
+from .models import CapacityForecastReport, DailyAppointmentRollup
+
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+# Below this many days of history the trend is unreliable; use weekday means only
+MIN_TREND_DAYS = 28
+
+
+def design_matrix(offsets: np.ndarray, weekdays: np.ndarray, with_trend: bool) -> np.ndarray:
+    """
+    Columns: intercept, trend (per week), then weekday dummies for Tuesday..Sunday
+    """
+    columns = [np.ones(len(offsets))]
+    if with_trend:
+        columns.append(offsets / 7.0)
+    for weekday in range(1, 7):
+        columns.append((weekdays == weekday).astype(float))
+    return np.column_stack(columns)
+
+
+def fit_demand(days: List[date], counts: np.ndarray) -> Dict:
+    """
+    Least-squares fit of daily counts on trend + weekday effects
+
+    Returns:
+        Dict with origin, coefficients, with_trend and residual_std
+    """
+    origin = days[0]
+    offsets = np.array([(day - origin).days for day in days], dtype=float)
+    weekdays = np.array([day.weekday() for day in days])
+    with_trend = len(days) >= MIN_TREND_DAYS
+    x = design_matrix(offsets, weekdays, with_trend)
+    coefficients, *_ = np.linalg.lstsq(x, counts, rcond=None)
+    residuals = counts - x @ coefficients
+    dof = max(len(days) - x.shape[1], 1)
+    return {
+        'origin': origin,
+        'coefficients': coefficients,
+        'with_trend': with_trend,
+        'residual_std': float(np.sqrt(residuals @ residuals / dof)),
+    }
+
+
+def predict_demand(fit: Dict, days: List[date]) -> np.ndarray:
+    offsets = np.array([(day - fit['origin']).days for day in days], dtype=float)
+    weekdays = np.array([day.weekday() for day in days])
+    x = design_matrix(offsets, weekdays, fit['with_trend'])
+    return np.clip(x @ fit['coefficients'], 0, None)
+
+
+def _model_summary(fit: Dict, history_days: int) -> Dict:
+    coefficients = fit['coefficients']
+    intercept = float(coefficients[0])
+    weekday_offsets = coefficients[2:] if fit['with_trend'] else coefficients[1:]
+    return {
+        'history_days': history_days,
+        'trend_per_week': round(float(coefficients[1]), 3) if fit['with_trend'] else None,
+        'weekday_effects': {
+            name: round(float(effect), 3)
+            for name, effect in zip(WEEKDAYS, [0.0, *weekday_offsets])
+        },
+        'intercept': round(intercept, 3),
+        'residual_std': round(fit['residual_std'], 3),
+    }
+
+
+def _daily_history(start: date, end: date) -> Dict[str, Dict[date, int]]:
+    rows = (
+        DailyAppointmentRollup.objects.filter(
+            day__gte=start, day__lte=end, staff__doctor_details__isnull=False
+        )
+        .values('day', 'staff__doctor_details__doctor_specialization')
+        .annotate(appointments=Sum('appointment_count'))
+    )
+    history = {}
+    for row in rows:
+        specialization = row['staff__doctor_details__doctor_specialization']
+        history.setdefault(specialization, {})[row['day']] = row['appointments']
+    return history
+
+
+def _slots_per_shift() -> float:
+    counts = [count for count in active_slot_counts().values() if count]
+    return sum(counts) / len(counts) if counts else 0.0
+
+
+def build_capacity_report(weeks: int = 4, history_days: int = 365, service_level: float = 0.9,
+                          today: Optional[date] = None) -> Dict:
+    """
+    Forecast daily demand per specialization for the next ``weeks`` weeks
+
+    Capacity is sized for the ``service_level`` quantile of demand (normal
+    residuals), assuming one shift per doctor per day.
+
+    Raises:
+        ValueError: If no shift has slots to size capacity with
+    """
+    today = today or timezone.localdate()
+    history_start = today - timedelta(days=history_days)
+    history_end = today - timedelta(days=1)  # today's bookings are still coming in
+    horizon = [today + timedelta(days=offset) for offset in range(1, weeks * 7 + 1)]
+
+    slots_per_shift = _slots_per_shift()
+    if not slots_per_shift:
+        raise ValueError('No shifts with slots are defined; cannot size capacity')
+    z = NormalDist().inv_cdf(service_level)
+
+    history = _daily_history(history_start, history_end)
+    doctors_available = dict(
+        DoctorDetails.objects.values('doctor_specialization')
+        .annotate(doctors=Count('staff'))
+        .values_list('doctor_specialization', 'doctors')
+    )
+    scheduled = {}
+    for row in (
+        Schedule.objects.filter(schedule_date__in=horizon, staff__doctor_details__isnull=False)
+        .values('schedule_date', 'staff__doctor_details__doctor_specialization')
+        .annotate(shifts=Count('schedule_id'))
+    ):
+        scheduled[(row['staff__doctor_details__doctor_specialization'], row['schedule_date'])] = row['shifts']
+
+    specializations = []
+    for specialization in sorted(set(doctors_available) | set(history)):
+        by_day = history.get(specialization, {})
+        available = doctors_available.get(specialization, 0)
+        entry = {'specialization': specialization, 'doctors_available': available, 'model': None, 'days': []}
+        if by_day:
+            first_day = min(by_day)
+            days = [first_day + timedelta(days=offset) for offset in range((history_end - first_day).days + 1)]
+            counts = np.array([by_day.get(day, 0) for day in days], dtype=float)
+            fit = fit_demand(days, counts)
+            expected = predict_demand(fit, horizon)
+            upper = expected + z * fit['residual_std']
+            entry['model'] = _model_summary(fit, len(days))
+        else:
+            expected = upper = np.zeros(len(horizon))
+
+        for day, mean, high in zip(horizon, expected, upper):
+            shifts_needed = math.ceil(round(float(high), 6) / slots_per_shift)
+            already = scheduled.get((specialization, day), 0)
+            entry['days'].append({
+                'date': day.isoformat(),
+                'weekday': WEEKDAYS[day.weekday()],
+                'expected_appointments': round(float(mean), 1),
+                'upper_appointments': round(float(high), 1),
+                'shifts_needed': shifts_needed,
+                'doctors_needed': shifts_needed,
+                'scheduled_shifts': already,
+                'additional_shifts': max(shifts_needed - already, 0),
+                'doctor_shortfall': max(shifts_needed - available, 0),
+            })
+        entry['total_expected_appointments'] = round(float(expected.sum()), 1)
+        entry['peak_doctors_needed'] = max((day['doctors_needed'] for day in entry['days']), default=0)
+        specializations.append(entry)
+
+    return {
+        'history_start': history_start.isoformat(),
+        'history_end': history_end.isoformat(),
+        'horizon_start': horizon[0].isoformat() if horizon else None,
+        'horizon_end': horizon[-1].isoformat() if horizon else None,
+        'service_level': service_level,
+        'slots_per_shift': round(slots_per_shift, 2),
+        'specializations': specializations,
+    }
+
+
+def save_capacity_report(report: Dict, weeks: int, keep: int = 10) -> CapacityForecastReport:
+    """
+    Store a report and prune all but the ``keep`` most recent
+    """
+    saved = CapacityForecastReport.objects.create(
+        horizon_weeks=weeks,
+        horizon_start=date.fromisoformat(report['horizon_start']),
+        horizon_end=date.fromisoformat(report['horizon_end']),
+        report=report,
+    )
+    stale = CapacityForecastReport.objects.order_by('-generated_at', '-report_id').values_list('report_id', flat=True)[keep:]
+    CapacityForecastReport.objects.filter(report_id__in=list(stale)).delete()
+    return saved
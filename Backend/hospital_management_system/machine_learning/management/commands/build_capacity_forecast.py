@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from machine_learning.forecasting import build_capacity_report, save_capacity_report
+
+
+class Command(BaseCommand):
+    help = 'Forecast appointment demand per specialization and store a shift capacity report (run nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--weeks', type=int, default=4, help='Weeks to forecast (default 4)')
+        parser.add_argument('--history-days', type=int, default=365, help='Days of history to fit on (default 365)')
+        parser.add_argument(
+            '--service-level', type=float, default=0.9,
+            help='Demand quantile to staff for, between 0 and 1 (default 0.9)'
+        )
+        parser.add_argument('--keep', type=int, default=10, help='Stored reports to keep (default 10)')
+
+    def handle(self, *args, **options):
+        if options['weeks'] < 1 or options['history_days'] < 7:
+            raise CommandError('--weeks must be at least 1 and --history-days at least 7')
+        if not 0 < options['service_level'] < 1:
+            raise CommandError('--service-level must be between 0 and 1')
+
+        try:
+            report = build_capacity_report(
+                weeks=options['weeks'],
+                history_days=options['history_days'],
+                service_level=options['service_level'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        saved = save_capacity_report(report, options['weeks'], keep=max(options['keep'], 1))
+
+        for entry in report['specializations']:
+            self.stdout.write(
+                f"{entry['specialization']}: {entry['total_expected_appointments']} expected appointments, "
+                f"peak {entry['peak_doctors_needed']} doctors/day ({entry['doctors_available']} available)"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Saved capacity forecast {saved.report_id} for {report['horizon_start']} to {report['horizon_end']}"
+        ))
@@ -0,0 +1,37 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from machine_learning.rollups import ROLLUPS, refresh_rollup
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily analytics rollups from the raw tables (run nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=7,
+            help='Refresh this many trailing days, including today (default 7)'
+        )
+        parser.add_argument(
+            '--ahead', type=int, default=30,
+            help='Also refresh this many upcoming days, for booked appointments (default 30)'
+        )
+        parser.add_argument('--all', action='store_true', help='Rebuild the entire history')
+        parser.add_argument('--rollup', choices=sorted(ROLLUPS), help='Only refresh this rollup')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            days = None
+            scope = 'full history'
+        else:
+            today = timezone.localdate()
+            days = [
+                today + timedelta(days=offset)
+                for offset in range(1 - options['days'], options['ahead'] + 1)
+            ]
+            scope = f"last {options['days']} days, next {options['ahead']} days"
+
+        names = [options['rollup']] if options.get('rollup') else sorted(ROLLUPS)
+        for name in names:
+            rows = refresh_rollup(name, days)
+            self.stdout.write(self.style.SUCCESS(f"Refreshed {name} rollup ({scope}): {rows} rows"))
@@ -0,0 +1,36 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from machine_learning.no_show import FEATURE_NAMES, model_path, train
+
+
+class Command(BaseCommand):
+    help = 'Train the appointment no-show risk model on resolved appointments (run nightly or weekly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--l2', type=float, default=1.0, help='L2 regularisation strength (default 1.0)')
+        parser.add_argument(
+            '--holdout', type=float, default=0.2,
+            help='Fraction of the most recent appointments held out for evaluation (default 0.2)'
+        )
+        parser.add_argument('--output', help='Where to write the model (default settings.NO_SHOW_MODEL_PATH)')
+
+    def handle(self, *args, **options):
+        try:
+            model = train(l2=options['l2'], holdout_fraction=options['holdout'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        path = options.get('output') or model_path()
+        model.save(path)
+
+        metrics = model.metrics
+        self.stdout.write(
+            f"Trained on {int(metrics['samples'])} appointments, miss rate {metrics['base_rate']:.3f}"
+        )
+        if 'holdout_auc' in metrics:
+            self.stdout.write(
+                f"Holdout AUC {metrics['holdout_auc']:.3f}, log loss {metrics['holdout_log_loss']:.4f}"
+            )
+        for name, weight in sorted(zip(FEATURE_NAMES, model.weights), key=lambda item: -abs(item[1])):
+            self.stdout.write(f"  {name:<24} {weight:+.3f}")
+        self.stdout.write(self.style.SUCCESS(f"Saved no-show model to {path} ({os.path.getsize(path)} bytes)"))
@@ -0,0 +1,42 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from machine_learning.specialization_router import model_path, train
+
+
+class Command(BaseCommand):
+    help = 'Train the booking reason -> specialization router on past appointments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-df', type=int, default=2, help='Minimum reasons a term must appear in (default 2)')
+        parser.add_argument('--max-features', type=int, default=5000, help='Vocabulary size cap (default 5000)')
+        parser.add_argument('--epochs', type=int, default=30, help='Passes over the training data (default 30)')
+        parser.add_argument('--learning-rate', type=float, default=2.0, help='Gradient step size (default 2.0)')
+        parser.add_argument('--l2', type=float, default=1e-4, help='L2 regularisation strength (default 1e-4)')
+        parser.add_argument('--output', help='Where to write the model (default settings.SPECIALIZATION_ROUTER_MODEL_PATH)')
+
+    def handle(self, *args, **options):
+        try:
+            router = train(
+                min_df=options['min_df'],
+                max_features=options['max_features'],
+                epochs=options['epochs'],
+                learning_rate=options['learning_rate'],
+                l2=options['l2'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        path = options.get('output') or model_path()
+        router.save(path)
+
+        metrics = router.metrics
+        self.stdout.write(
+            f"Trained on {int(metrics['samples'])} reasons, {len(router.classes)} specializations, "
+            f"{len(router.vocabulary)} terms"
+        )
+        if 'holdout_top1_accuracy' in metrics:
+            self.stdout.write(
+                f"Holdout accuracy: top-1 {metrics['holdout_top1_accuracy']:.3f}, "
+                f"top-3 {metrics['holdout_top3_accuracy']:.3f}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Saved specialization router to {path} ({os.path.getsize(path)} bytes)"))
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('hospital', '0018_documentuploadsession'),
+        ('transactions', '0003_alter_transaction_patient_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyAppointmentRollup',
+            fields=[
+                ('rollup_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('day', models.DateField(help_text='Appointment date')),
+                ('status', models.CharField(max_length=20)),
+                ('appointment_count', models.IntegerField()),
+                ('staff', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='appointment_rollups', to='hospital.staff')),
+            ],
+            options={
+                'unique_together': {('day', 'staff', 'status')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyRatingRollup',
+            fields=[
+                ('rollup_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('day', models.DateField(help_text='Date the rated appointment was booked')),
+                ('rating_sum', models.IntegerField()),
+                ('rating_count', models.IntegerField()),
+                ('stars_1', models.IntegerField(default=0)),
+                ('stars_2', models.IntegerField(default=0)),
+                ('stars_3', models.IntegerField(default=0)),
+                ('stars_4', models.IntegerField(default=0)),
+                ('stars_5', models.IntegerField(default=0)),
+                ('staff', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rating_rollups', to='hospital.staff')),
+            ],
+            options={
+                'unique_together': {('day', 'staff')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyRevenueRollup',
+            fields=[
+                ('rollup_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('day', models.DateField()),
+                ('revenue', models.DecimalField(decimal_places=2, help_text='Sum of completed transaction amounts', max_digits=14)),
+                ('transaction_count', models.IntegerField()),
+                ('payment_method', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revenue_rollups', to='transactions.paymentmethod')),
+                ('transaction_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revenue_rollups', to='transactions.transactiontype')),
+                ('unit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revenue_rollups', to='transactions.unit')),
+            ],
+            options={
+                'unique_together': {('day', 'unit', 'payment_method', 'transaction_type')},
+            },
+        ),
+    ]
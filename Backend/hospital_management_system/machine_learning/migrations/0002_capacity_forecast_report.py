@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('machine_learning', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CapacityForecastReport',
+            fields=[
+                ('report_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('generated_at', models.DateTimeField(auto_now_add=True)),
+                ('horizon_weeks', models.IntegerField()),
+                ('horizon_start', models.DateField()),
+                ('horizon_end', models.DateField()),
+                ('report', models.JSONField()),
+            ],
+            options={
+                'ordering': ['-generated_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+"""
+Lazy loading of trained model files
+
+Models are loaded on first use and kept per process; a retrain replaces the
+file, and the new mtime makes the next call reload it without a restart.
+"""
+import os
+import logging
+import threading
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_loaded = {}
+
+
+def load_model_file(path: str, loader: Callable[[str], object], name: str = 'model') -> Optional[object]:
+    """
+    The object loader(path) returned, reloaded whenever the file changes
+
+    Returns:
+        None if the file does not exist or cannot be loaded
+    """
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _lock:
+        cached = _loaded.get(path)
+        if cached is None or cached[0] != mtime:
+            try:
+                cached = (mtime, loader(path))
+            except Exception as e:
+                logger.error(f"Could not load {name} from {path}: {str(e)}")
+                cached = (mtime, None)
+            _loaded[path] = cached
+        return cached[1]
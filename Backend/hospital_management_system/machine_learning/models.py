@@ -1,3 +1,71 @@
 from django.db import models
 
-# Create your models here.
+# Daily rollups behind the admin analytics dashboards. They are rebuilt one day
+# at a time from the raw tables (see rollups.py), kept current by signals and
+# reconciled nightly by the reconcile_analytics_rollups command.
+
+class DailyRevenueRollup(models.Model):
+    rollup_id = models.BigAutoField(primary_key=True)
+    day = models.DateField()
+    unit = models.ForeignKey('transactions.Unit', on_delete=models.CASCADE, related_name='revenue_rollups')
+    payment_method = models.ForeignKey('transactions.PaymentMethod', on_delete=models.CASCADE, related_name='revenue_rollups')
+    transaction_type = models.ForeignKey('transactions.TransactionType', on_delete=models.CASCADE, related_name='revenue_rollups')
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, help_text="Sum of completed transaction amounts")
+    transaction_count = models.IntegerField()
+
+    def __str__(self):
+        return f"Revenue {self.day}: {self.revenue} ({self.transaction_count} transactions)"
+
+    class Meta:
+        unique_together = ('day', 'unit', 'payment_method', 'transaction_type')
+
+
+class DailyAppointmentRollup(models.Model):
+    rollup_id = models.BigAutoField(primary_key=True)
+    day = models.DateField(help_text="Appointment date")
+    staff = models.ForeignKey('hospital.Staff', on_delete=models.CASCADE, related_name='appointment_rollups')
+    status = models.CharField(max_length=20)
+    appointment_count = models.IntegerField()
+
+    def __str__(self):
+        return f"Appointments {self.day} {self.staff_id} {self.status}: {self.appointment_count}"
+
+    class Meta:
+        unique_together = ('day', 'staff', 'status')
+
+
+class DailyRatingRollup(models.Model):
+    rollup_id = models.BigAutoField(primary_key=True)
+    day = models.DateField(help_text="Date the rated appointment was booked")
+    staff = models.ForeignKey('hospital.Staff', on_delete=models.CASCADE, related_name='rating_rollups')
+    rating_sum = models.IntegerField()
+    rating_count = models.IntegerField()
+    stars_1 = models.IntegerField(default=0)
+    stars_2 = models.IntegerField(default=0)
+    stars_3 = models.IntegerField(default=0)
+    stars_4 = models.IntegerField(default=0)
+    stars_5 = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Ratings {self.day} {self.staff_id}: {self.rating_count}"
+
+    class Meta:
+        unique_together = ('day', 'staff')
+
+
+class CapacityForecastReport(models.Model):
+    """
+    Demand forecast and shift recommendations written by build_capacity_forecast
+    """
+    report_id = models.BigAutoField(primary_key=True)
+    generated_at = models.DateTimeField(auto_now_add=True)
+    horizon_weeks = models.IntegerField()
+    horizon_start = models.DateField()
+    horizon_end = models.DateField()
+    report = models.JSONField()
+
+    def __str__(self):
+        return f"Capacity forecast {self.horizon_start} to {self.horizon_end} ({self.generated_at:%Y-%m-%d %H:%M})"
+
+    class Meta:
+        ordering = ['-generated_at']
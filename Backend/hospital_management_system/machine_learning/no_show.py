@@ -0,0 +1,312 @@
+"""
+No-show (missed appointment) risk model
+
+Logistic regression over a handful of per-appointment features, trained with
+NumPy by the train_no_show_model command and stored as a small .npz file. The
+scorer is vectorized so a whole day of appointments is scored in one pass with
+two database queries.
+"""
+import os
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+from hospital.models import Appointment
+from .model_files import load_model_file
+
+FEATURE_NAMES = [
+    'prior_appointments_log',
+    'prior_miss_rate',
+    'prior_misses_log',
+    'lead_time_days_log',
+    'slot_hour',
+    'doctor_miss_rate',
+    'weekday_mon', 'weekday_tue', 'weekday_wed', 'weekday_thu',
+    'weekday_fri', 'weekday_sat', 'weekday_sun',
+]
+
+RESOLVED_STATUSES = ('completed', 'missed')
+
+# Pseudo-counts that pull sparse patients/doctors toward the overall miss rate
+PATIENT_PRIOR_WEIGHT = 2.0
+DOCTOR_PRIOR_WEIGHT = 10.0
+
+
+def model_path() -> str:
+    return getattr(
+        settings, 'NO_SHOW_MODEL_PATH',
+        os.path.join(settings.BASE_DIR, 'ml_models', 'no_show_model.npz')
+    )
+
+
+def _appointment_day(row: Dict) -> date:
+    return row['appointment_date'] or timezone.localdate(row['created_at'])
+
+
+def feature_matrix(rows: List[Dict], prior_counts: np.ndarray, prior_misses: np.ndarray,
+                   doctor_rates: Dict[str, float], global_rate: float) -> np.ndarray:
+    """
+    Build the (n, len(FEATURE_NAMES)) feature matrix
+
+    Args:
+        rows: Appointment dicts with appointment_date, created_at, slot_start_time, staff_id
+        prior_counts: Resolved appointments each patient had before this one
+        prior_misses: Missed appointments among those
+        doctor_rates: Smoothed miss rate per staff_id
+        global_rate: Overall miss rate, used for unknown doctors
+    """
+    n = len(rows)
+    days = [_appointment_day(row) for row in rows]
+    booked = [timezone.localdate(row['created_at']) if row['created_at'] else day
+              for row, day in zip(rows, days)]
+    lead_days = np.array([(day - booked_on).days for day, booked_on in zip(days, booked)], dtype=float)
+    slot_hours = np.array([
+        row['slot_start_time'].hour + row['slot_start_time'].minute / 60.0 if row['slot_start_time'] else 12.0
+        for row in rows
+    ])
+    weekdays = np.array([day.weekday() for day in days], dtype=int)
+    doctor_rate = np.array([doctor_rates.get(row['staff_id'], global_rate) for row in rows])
+
+    features = np.zeros((n, len(FEATURE_NAMES)))
+    features[:, 0] = np.log1p(prior_counts)
+    features[:, 1] = (prior_misses + PATIENT_PRIOR_WEIGHT * global_rate) / (prior_counts + PATIENT_PRIOR_WEIGHT)
+    features[:, 2] = np.log1p(prior_misses)
+    features[:, 3] = np.log1p(np.clip(lead_days, 0, None))
+    features[:, 4] = slot_hours
+    features[:, 5] = doctor_rate
+    features[np.arange(n), 6 + weekdays] = 1.0
+    return features
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -35, 35)))
+
+
+class NoShowModel:
+    """
+    Fitted weights plus the statistics needed to build features at scoring time
+    """
+
+    def __init__(self, weights, bias, mean, std, doctor_ids, doctor_rates, global_rate, metrics=None, trained_at=None):
+        self.weights = np.asarray(weights, dtype=float)
+        self.bias = float(bias)
+        self.mean = np.asarray(mean, dtype=float)
+        self.std = np.asarray(std, dtype=float)
+        self.doctor_rates = dict(zip([str(d) for d in doctor_ids], [float(r) for r in doctor_rates]))
+        self.global_rate = float(global_rate)
+        self.metrics = metrics or {}
+        self.trained_at = trained_at
+
+    def predict_proba(self, features: np.ndarray) -> np.ndarray:
+        return _sigmoid(((features - self.mean) / self.std) @ self.weights + self.bias)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        metric_names = sorted(self.metrics)
+        np.savez_compressed(
+            path,
+            feature_names=np.array(FEATURE_NAMES),
+            weights=self.weights, bias=np.array(self.bias),
+            mean=self.mean, std=self.std,
+            doctor_ids=np.array(list(self.doctor_rates.keys()), dtype=str),
+            doctor_rates=np.array(list(self.doctor_rates.values())),
+            global_rate=np.array(self.global_rate),
+            metric_names=np.array(metric_names, dtype=str),
+            metric_values=np.array([self.metrics[name] for name in metric_names], dtype=float),
+            trained_at=np.array(self.trained_at or timezone.now().isoformat()),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> 'NoShowModel':
+        with np.load(path) as data:
+            if list(data['feature_names']) != FEATURE_NAMES:
+                raise ValueError('No-show model was trained with a different feature set; retrain it')
+            return cls(
+                weights=data['weights'], bias=data['bias'],
+                mean=data['mean'], std=data['std'],
+                doctor_ids=data['doctor_ids'], doctor_rates=data['doctor_rates'],
+                global_rate=data['global_rate'],
+                metrics=dict(zip(data['metric_names'].tolist(), data['metric_values'].tolist())),
+                trained_at=str(data['trained_at']),
+            )
+
+
+def fit_logistic_regression(features: np.ndarray, labels: np.ndarray, l2: float = 1.0,
+                            max_iter: int = 50, tol: float = 1e-6):
+    """
+    L2-regularised logistic regression by Newton's method (IRLS)
+
+    Returns:
+        (weights, bias, mean, std); features are standardised with mean/std
+    """
+    mean = features.mean(axis=0)
+    std = features.std(axis=0)
+    std[std == 0] = 1.0
+    x = np.hstack([(features - mean) / std, np.ones((len(features), 1))])
+
+    penalty = np.full(x.shape[1], l2)
+    penalty[-1] = 0.0  # don't shrink the intercept
+    w = np.zeros(x.shape[1])
+    for _ in range(max_iter):
+        p = _sigmoid(x @ w)
+        gradient = x.T @ (labels - p) - penalty * w
+        hessian = (x * (p * (1 - p))[:, None]).T @ x + np.diag(penalty) + 1e-9 * np.eye(x.shape[1])
+        step = np.linalg.solve(hessian, gradient)
+        w += step
+        if np.max(np.abs(step)) < tol:
+            break
+    return w[:-1], w[-1], mean, std
+
+
+def roc_auc(labels: np.ndarray, scores: np.ndarray) -> float:
+    positives = labels.sum()
+    negatives = len(labels) - positives
+    if positives == 0 or negatives == 0:
+        return float('nan')
+    order = np.argsort(scores, kind='mergesort')
+    ranks = np.empty(len(scores))
+    ranks[order] = np.arange(1, len(scores) + 1)
+    # Average ranks of tied scores
+    _, inverse, counts = np.unique(scores, return_inverse=True, return_counts=True)
+    rank_sums = np.bincount(inverse, weights=ranks)
+    ranks = (rank_sums / counts)[inverse]
+    return float((ranks[labels == 1].sum() - positives * (positives + 1) / 2) / (positives * negatives))
+
+
+def training_rows() -> List[Dict]:
+    return list(
+        Appointment.objects.filter(status__in=RESOLVED_STATUSES)
+        .values('appointment_id', 'patient_id', 'staff_id', 'appointment_date',
+                'created_at', 'slot__slot_start_time', 'status')
+        .order_by('appointment_date', 'appointment_id')
+    )
+
+
+def _prior_history(rows: List[Dict], labels: np.ndarray):
+    """
+    Resolved and missed appointments each patient had before each row (rows in date order)
+    """
+    n = len(rows)
+    patients = np.array([row['patient_id'] for row in rows])
+    order = np.argsort(patients, kind='stable')  # stable keeps date order within a patient
+    sorted_patients = patients[order]
+    sorted_labels = labels[order]
+
+    index = np.arange(n)
+    group_start = np.r_[True, sorted_patients[1:] != sorted_patients[:-1]]
+    start_index = np.maximum.accumulate(np.where(group_start, index, 0))
+    misses_before = np.cumsum(sorted_labels) - sorted_labels
+
+    prior_counts = np.empty(n)
+    prior_misses = np.empty(n)
+    prior_counts[order] = index - start_index
+    prior_misses[order] = misses_before - misses_before[start_index]
+    return prior_counts, prior_misses
+
+
+def _doctor_rates(rows: List[Dict], labels: np.ndarray, global_rate: float) -> Dict[str, float]:
+    staff = np.array([row['staff_id'] for row in rows])
+    doctor_ids, inverse = np.unique(staff, return_inverse=True)
+    totals = np.bincount(inverse)
+    misses = np.bincount(inverse, weights=labels)
+    rates = (misses + DOCTOR_PRIOR_WEIGHT * global_rate) / (totals + DOCTOR_PRIOR_WEIGHT)
+    return dict(zip(doctor_ids.tolist(), rates.tolist()))
+
+
+def train(l2: float = 1.0, holdout_fraction: float = 0.2) -> NoShowModel:
+    """
+    Fit the model on every resolved appointment
+
+    The most recent ``holdout_fraction`` of appointments is scored by a model
+    fitted on the older ones to report out-of-time metrics; the saved model is
+    then refitted on everything.
+
+    Raises:
+        ValueError: If there are too few resolved appointments or only one class
+    """
+    rows = training_rows()
+    for row in rows:
+        row['slot_start_time'] = row.pop('slot__slot_start_time')
+    labels = np.array([row['status'] == 'missed' for row in rows], dtype=float)
+    if len(rows) < 50 or labels.min() == labels.max():
+        raise ValueError('Need at least 50 resolved appointments including both completed and missed ones')
+
+    global_rate = float(labels.mean())
+    prior_counts, prior_misses = _prior_history(rows, labels)
+
+    metrics = {'samples': float(len(rows)), 'base_rate': global_rate}
+    split = int(len(rows) * (1 - holdout_fraction))
+    if 0 < split < len(rows):
+        train_rates = _doctor_rates(rows[:split], labels[:split], global_rate)
+        features = feature_matrix(rows, prior_counts, prior_misses, train_rates, global_rate)
+        w, b, mean, std = fit_logistic_regression(features[:split], labels[:split], l2=l2)
+        holdout = NoShowModel(w, b, mean, std, [], [], global_rate).predict_proba(features[split:])
+        holdout_labels = labels[split:]
+        eps = 1e-12
+        metrics['holdout_auc'] = roc_auc(holdout_labels, holdout)
+        metrics['holdout_log_loss'] = float(-np.mean(
+            holdout_labels * np.log(holdout + eps) + (1 - holdout_labels) * np.log(1 - holdout + eps)
+        ))
+
+    doctor_rates = _doctor_rates(rows, labels, global_rate)
+    features = feature_matrix(rows, prior_counts, prior_misses, doctor_rates, global_rate)
+    w, b, mean, std = fit_logistic_regression(features, labels, l2=l2)
+    return NoShowModel(
+        w, b, mean, std, list(doctor_rates.keys()), list(doctor_rates.values()), global_rate,
+        metrics=metrics, trained_at=timezone.now().isoformat()
+    )
+
+
+def get_model() -> Optional[NoShowModel]:
+    """
+    The trained model, loaded lazily and reloaded when the file changes; None if untrained
+    """
+    return load_model_file(model_path(), NoShowModel.load, 'no-show model')
+
+
+def score_rows(rows: List[Dict]) -> Dict[int, float]:
+    """
+    Miss probability for upcoming appointments given as dicts with appointment_id,
+    patient_id, staff_id, appointment_date, created_at and slot_start_time
+
+    Returns:
+        appointment_id -> probability; empty if no model has been trained
+    """
+    model = get_model()
+    if model is None or not rows:
+        return {}
+
+    patient_ids = {row['patient_id'] for row in rows}
+    history = {
+        item['patient_id']: item
+        for item in Appointment.objects.filter(patient_id__in=patient_ids, status__in=RESOLVED_STATUSES)
+        .values('patient_id')
+        .annotate(total=Count('appointment_id'), missed=Count('appointment_id', filter=Q(status='missed')))
+    }
+    prior_counts = np.array([history.get(row['patient_id'], {}).get('total', 0) for row in rows], dtype=float)
+    prior_misses = np.array([history.get(row['patient_id'], {}).get('missed', 0) for row in rows], dtype=float)
+
+    features = feature_matrix(rows, prior_counts, prior_misses, model.doctor_rates, model.global_rate)
+    probabilities = model.predict_proba(features)
+    return {row['appointment_id']: round(float(p), 4) for row, p in zip(rows, probabilities)}
+
+
+def score_appointments(appointments: Iterable[Appointment]) -> Dict[int, float]:
+    """
+    score_rows for Appointment instances (select_related('slot') avoids a query per row)
+    """
+    rows = [
+        {
+            'appointment_id': appointment.appointment_id,
+            'patient_id': appointment.patient_id,
+            'staff_id': appointment.staff_id,
+            'appointment_date': appointment.appointment_date,
+            'created_at': appointment.created_at,
+            'slot_start_time': appointment.slot.slot_start_time,
+        }
+        for appointment in appointments
+        if appointment.status == 'upcoming'
+    ]
+    return score_rows(rows)
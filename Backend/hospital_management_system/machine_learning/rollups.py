@@ -0,0 +1,178 @@
+"""
+Maintenance of the daily analytics rollup tables
+
+A refresh recomputes whole day partitions from the raw tables (one GROUP BY per
+rollup) and swaps them in, so it is idempotent and safe to repeat: signals
+refresh the days a write touched, and the nightly reconciliation refreshes a
+trailing window or everything.
+"""
+import logging
+import threading
+from collections import defaultdict
+from datetime import date
+from typing import Iterable, Optional
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from hospital.models import Appointment, AppointmentRating
+from transactions.models import Transaction
+from .cache import bump_data_version
+from .models import DailyAppointmentRollup, DailyRatingRollup, DailyRevenueRollup
+
+logger = logging.getLogger(__name__)
+
+# Rollup days and cache invalidation queued by this thread's current transaction
+_pending = threading.local()
+
+
+def _revenue_rows(days):
+    transactions = Transaction.objects.filter(transaction_status='completed')
+    if days is not None:
+        transactions = transactions.filter(transaction_datetime__date__in=days)
+    rows = (
+        transactions.annotate(day=TruncDate('transaction_datetime'))
+        .values('day', 'transaction_unit_id', 'payment_method_id', 'transaction_type_id')
+        .annotate(revenue=Sum('transaction_amount'), transaction_count=Count('transaction_id'))
+    )
+    return [
+        DailyRevenueRollup(
+            day=row['day'],
+            unit_id=row['transaction_unit_id'],
+            payment_method_id=row['payment_method_id'],
+            transaction_type_id=row['transaction_type_id'],
+            revenue=row['revenue'],
+            transaction_count=row['transaction_count'],
+        )
+        for row in rows
+    ]
+
+
+def _appointment_rows(days):
+    appointments = Appointment.objects.filter(appointment_date__isnull=False)
+    if days is not None:
+        appointments = appointments.filter(appointment_date__in=days)
+    rows = (
+        appointments.values('appointment_date', 'staff_id', 'status')
+        .annotate(appointment_count=Count('appointment_id'))
+    )
+    return [
+        DailyAppointmentRollup(
+            day=row['appointment_date'],
+            staff_id=row['staff_id'],
+            status=row['status'],
+            appointment_count=row['appointment_count'],
+        )
+        for row in rows
+    ]
+
+
+def _rating_rows(days):
+    ratings = AppointmentRating.objects.all()
+    if days is not None:
+        ratings = ratings.filter(appointment__created_at__date__in=days)
+    star_counts = {
+        f'stars_{value}': Count('rating_id', filter=Q(rating=value))
+        for value in range(1, 6)
+    }
+    rows = (
+        ratings.annotate(day=TruncDate('appointment__created_at'))
+        .values('day', 'appointment__staff_id')
+        .annotate(rating_sum=Sum('rating'), rating_count=Count('rating_id'), **star_counts)
+    )
+    return [
+        DailyRatingRollup(
+            day=row['day'],
+            staff_id=row['appointment__staff_id'],
+            rating_sum=row['rating_sum'],
+            rating_count=row['rating_count'],
+            **{name: row[name] for name in star_counts},
+        )
+        for row in rows
+    ]
+
+
+ROLLUPS = {
+    'revenue': (DailyRevenueRollup, _revenue_rows),
+    'appointments': (DailyAppointmentRollup, _appointment_rows),
+    'ratings': (DailyRatingRollup, _rating_rows),
+}
+
+
+def refresh_rollup(name: str, days: Optional[Iterable[date]] = None) -> int:
+    """
+    Recompute one rollup for the given days (None = the whole history)
+
+    Returns:
+        Number of rollup rows written
+    """
+    model, build_rows = ROLLUPS[name]
+    if days is not None:
+        days = sorted({day for day in days if day is not None})
+        if not days:
+            return 0
+
+    # Two refreshes of the same day can race between delete and insert; the
+    # loser retries once against the winner's rows
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                existing = model.objects.all()
+                if days is not None:
+                    existing = existing.filter(day__in=days)
+                existing.delete()
+                rows = build_rows(days)
+                model.objects.bulk_create(rows, batch_size=1000)
+            return len(rows)
+        except IntegrityError:
+            if attempt:
+                raise
+            logger.warning(f"Concurrent refresh of {name} rollup, retrying")
+
+
+def refresh_on_commit(name: str, days: Iterable[date]):
+    """
+    Refresh the given days, and invalidate the response cache, once the current transaction commits
+    """
+    _pending_changes().days[name].update(day for day in days if day is not None)
+    invalidate_on_commit()
+
+
+def invalidate_on_commit():
+    """
+    Bump the analytics data version once the current transaction commits
+
+    Changes from every write in a transaction are collected and the first
+    on-commit hook to run refreshes each rollup once, over the union of the
+    days, then bumps the version once; the later hooks find nothing pending.
+    Days left behind by a rolled-back transaction are refreshed with the next
+    commit, which is harmless since a refresh only recomputes from the raw rows.
+    """
+    _pending_changes().bump = True
+    transaction.on_commit(_apply_pending_changes)
+
+
+def _pending_changes():
+    if not hasattr(_pending, 'days'):
+        _pending.days = defaultdict(set)
+        _pending.bump = False
+    return _pending
+
+
+def _apply_pending_changes():
+    pending = _pending_changes()
+    days, pending.days = pending.days, defaultdict(set)
+    bump, pending.bump = pending.bump, False
+    for name, rollup_days in days.items():
+        _refresh_quietly(name, rollup_days)
+    # After the refresh, so a request in between can't cache the old rollups under the new version
+    if bump:
+        bump_data_version()
+
+
+def _refresh_quietly(name, days):
+    # A failed refresh must not break the request that triggered it; the
+    # nightly reconciliation repairs the partition
+    try:
+        refresh_rollup(name, days)
+    except Exception as e:
+        logger.error(f"Could not refresh {name} rollup for {sorted(days)}: {str(e)}")
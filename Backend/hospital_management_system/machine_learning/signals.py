@@ -0,0 +1,70 @@
+"""
+Keep the analytics rollups and response cache current as the raw rows change
+
+Only the day partitions a write touched are refreshed, after commit, and the
+cache data version is bumped after that refresh; a transaction with several
+writes refreshes each rollup and bumps the version once. Bulk operations (bulk_create,
+QuerySet.update/delete) bypass these signals and are picked up by the nightly
+reconcile_analytics_rollups run.
+"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+from hospital.models import Appointment, AppointmentRating, DoctorDetails, Patient, Schedule, Slot, Staff
+from transactions.models import Transaction
+from .rollups import invalidate_on_commit, refresh_on_commit
+
+
+def _local_day(value):
+    return timezone.localdate(value) if value else None
+
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+def transaction_changed(sender, instance, **kwargs):
+    refresh_on_commit('revenue', [_local_day(instance.transaction_datetime)])
+
+
+@receiver(pre_save, sender=Appointment)
+def remember_appointment_date(sender, instance, **kwargs):
+    # A reschedule moves the appointment out of its old day as well. Loaded
+    # instances carry that day from Appointment.from_db; only one built with a
+    # pk by hand (or loaded without the date) has to look it up
+    if instance.pk is None or hasattr(instance, '_loaded_appointment_date'):
+        return
+    instance._loaded_appointment_date = (
+        Appointment.objects.filter(pk=instance.pk).values_list('appointment_date', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def appointment_changed(sender, instance, **kwargs):
+    days = [instance.appointment_date, getattr(instance, '_loaded_appointment_date', None)]
+    refresh_on_commit('appointments', days)
+    instance._loaded_appointment_date = instance.appointment_date
+
+
+@receiver(post_save, sender=AppointmentRating)
+@receiver(post_delete, sender=AppointmentRating)
+def rating_changed(sender, instance, **kwargs):
+    appointment = Appointment.objects.filter(pk=instance.appointment_id).only('created_at').first()
+    if appointment is not None:
+        refresh_on_commit('ratings', [_local_day(appointment.created_at)])
+    else:
+        invalidate_on_commit()
+
+
+# Rows the dashboards read directly (names, counts, schedules) only invalidate the cache
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+@receiver(post_save, sender=Staff)
+@receiver(post_delete, sender=Staff)
+@receiver(post_save, sender=DoctorDetails)
+@receiver(post_delete, sender=DoctorDetails)
+@receiver(post_save, sender=Schedule)
+@receiver(post_delete, sender=Schedule)
+@receiver(post_save, sender=Slot)
+@receiver(post_delete, sender=Slot)
+def dashboard_source_changed(sender, instance, **kwargs):
+    invalidate_on_commit()
@@ -0,0 +1,273 @@
+"""
+Booking reason -> doctor specialization classifier
+
+TF-IDF over word unigrams and bigrams feeding a softmax (multinomial logistic
+regression) layer, trained offline by the train_specialization_router command
+on past appointment reasons and the specialization of the doctor seen. A
+reason has only a handful of terms, so inference sums that many weight rows
+instead of building a dense vector.
+"""
+import os
+import re
+import math
+from collections import Counter
+from datetime import timedelta
+from typing import Dict, List, Tuple
+import numpy as np
+from django.conf import settings
+from django.db.models import Prefetch
+from django.utils import timezone
+from hospital.models import Appointment, Schedule, Slot
+from hospital.slots import listed_slot_id, listed_slots
+from .model_files import load_model_file
+
+TOKEN_PATTERN = re.compile(r"[a-z]+")
+
+STOP_WORDS = frozenset({
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'been', 'but', 'by', 'for', 'from', 'had', 'has', 'have',
+    'i', 'im', 'in', 'is', 'it', 'its', 'me', 'my', 'of', 'on', 'or', 'since', 'so', 'that', 'the',
+    'this', 'to', 'very', 'was', 'with', 'am', 'some', 'get', 'got', 'feel', 'feeling', 'need', 'want',
+    'appointment', 'doctor', 'checkup', 'please', 'days', 'weeks', 'day', 'week',
+})
+
+
+def model_path() -> str:
+    return getattr(
+        settings, 'SPECIALIZATION_ROUTER_MODEL_PATH',
+        os.path.join(settings.BASE_DIR, 'ml_models', 'specialization_router.npz')
+    )
+
+
+def terms(text: str) -> List[str]:
+    """
+    Unigrams and bigrams of the lower-cased words, stop words removed
+    """
+    words = [word for word in TOKEN_PATTERN.findall((text or '').lower()) if word not in STOP_WORDS]
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+class SpecializationRouter:
+    def __init__(self, vocabulary, idf, weights, bias, classes, metrics=None, trained_at=None):
+        self.vocabulary = list(vocabulary)
+        self.index = {term: position for position, term in enumerate(self.vocabulary)}
+        self.idf = np.asarray(idf, dtype=np.float32)
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.classes = list(classes)
+        self.metrics = metrics or {}
+        self.trained_at = trained_at
+
+    def vectorize(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Sparse L2-normalised TF-IDF vector as (term indices, values)
+        """
+        counts = Counter(self.index[term] for term in terms(text) if term in self.index)
+        if not counts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        values = (1.0 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))) * self.idf[indices]
+        return indices, values / np.linalg.norm(values)
+
+    def predict(self, text: str, top: int = 3) -> List[Dict]:
+        """
+        The ``top`` most likely specializations with probabilities; empty if no term is known
+        """
+        indices, values = self.vectorize(text)
+        if not len(indices):
+            return []
+        logits = self.bias + values @ self.weights[indices]
+        probabilities = np.exp(logits - logits.max())
+        probabilities /= probabilities.sum()
+        best = np.argsort(-probabilities)[:top]
+        return [
+            {'specialization': self.classes[position], 'probability': round(float(probabilities[position]), 4)}
+            for position in best
+        ]
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        metric_names = sorted(self.metrics)
+        np.savez_compressed(
+            path,
+            vocabulary=np.array(self.vocabulary, dtype=str),
+            idf=self.idf,
+            weights=self.weights.astype(np.float16),
+            bias=self.bias,
+            classes=np.array(self.classes, dtype=str),
+            metric_names=np.array(metric_names, dtype=str),
+            metric_values=np.array([self.metrics[name] for name in metric_names], dtype=float),
+            trained_at=np.array(self.trained_at or timezone.now().isoformat()),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> 'SpecializationRouter':
+        with np.load(path) as data:
+            return cls(
+                vocabulary=data['vocabulary'].tolist(),
+                idf=data['idf'],
+                weights=data['weights'],
+                bias=data['bias'],
+                classes=data['classes'].tolist(),
+                metrics=dict(zip(data['metric_names'].tolist(), data['metric_values'].tolist())),
+                trained_at=str(data['trained_at']),
+            )
+
+
+def training_pairs() -> List[Tuple[str, str]]:
+    """
+    (reason, specialization) for every appointment with a reason and a doctor
+    """
+    return [
+        (reason, specialization)
+        for reason, specialization in Appointment.objects.filter(
+            staff__doctor_details__isnull=False
+        ).exclude(reason__isnull=True).exclude(reason='').values_list(
+            'reason', 'staff__doctor_details__doctor_specialization'
+        ).iterator()
+    ]
+
+
+def _tfidf_rows(documents: List[List[str]], index: Dict[str, int], idf: np.ndarray):
+    rows = []
+    for document in documents:
+        counts = Counter(index[term] for term in document if term in index)
+        indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        values = (1.0 + np.log(np.fromiter(counts.values(), dtype=float, count=len(counts)))) * idf[indices]
+        norm = np.linalg.norm(values)
+        rows.append((indices, values / norm if norm else values))
+    return rows
+
+
+def _dense_batch(rows, size: int) -> np.ndarray:
+    batch = np.zeros((len(rows), size))
+    for position, (indices, values) in enumerate(rows):
+        batch[position, indices] = values
+    return batch
+
+
+def _fit_softmax(rows, labels: np.ndarray, vocabulary_size: int, class_count: int,
+                 epochs: int, learning_rate: float, l2: float, batch_size: int = 256, seed: int = 0):
+    """
+    Mini-batch gradient descent on the cross-entropy; batches are densified one at a time
+    """
+    rng = np.random.default_rng(seed)
+    weights = np.zeros((vocabulary_size, class_count))
+    bias = np.zeros(class_count)
+    targets = np.eye(class_count)[labels]
+    for _ in range(epochs):
+        order = rng.permutation(len(rows))
+        for start in range(0, len(rows), batch_size):
+            batch_index = order[start:start + batch_size]
+            x = _dense_batch([rows[i] for i in batch_index], vocabulary_size)
+            logits = x @ weights + bias
+            logits -= logits.max(axis=1, keepdims=True)
+            probabilities = np.exp(logits)
+            probabilities /= probabilities.sum(axis=1, keepdims=True)
+            error = (probabilities - targets[batch_index]) / len(batch_index)
+            weights -= learning_rate * (x.T @ error + l2 * weights)
+            bias -= learning_rate * error.sum(axis=0)
+    return weights, bias
+
+
+def train(min_df: int = 2, max_features: int = 5000, epochs: int = 30, learning_rate: float = 2.0,
+          l2: float = 1e-4, holdout_fraction: float = 0.2, seed: int = 0) -> SpecializationRouter:
+    """
+    Fit the router on historical reasons; accuracy is measured on a random
+    holdout before refitting on every pair
+
+    Raises:
+        ValueError: If there is too little labelled data
+    """
+    pairs = training_pairs()
+    classes = sorted({specialization for _, specialization in pairs})
+    if len(pairs) < 20 or len(classes) < 2:
+        raise ValueError('Need at least 20 appointments with a reason across two or more specializations')
+
+    documents = [terms(reason) for reason, _ in pairs]
+    class_index = {name: position for position, name in enumerate(classes)}
+    labels = np.array([class_index[specialization] for _, specialization in pairs])
+
+    def fit(document_ids):
+        document_frequency = Counter(term for i in document_ids for term in set(documents[i]))
+        kept = [term for term, count in document_frequency.most_common() if count >= min_df][:max_features]
+        if not kept:
+            raise ValueError('No term occurs in enough reasons; lower --min-df')
+        kept.sort()
+        index = {term: position for position, term in enumerate(kept)}
+        n = len(document_ids)
+        idf = np.array([math.log((1 + n) / (1 + document_frequency[term])) + 1 for term in kept])
+        rows = _tfidf_rows([documents[i] for i in document_ids], index, idf)
+        weights, bias = _fit_softmax(rows, labels[document_ids], len(kept), len(classes),
+                                     epochs, learning_rate, l2, seed=seed)
+        return SpecializationRouter(kept, idf, weights, bias, classes)
+
+    metrics = {'samples': float(len(pairs)), 'classes': float(len(classes))}
+    order = np.random.default_rng(seed).permutation(len(pairs))
+    split = int(len(pairs) * (1 - holdout_fraction))
+    if 0 < split < len(pairs):
+        router = fit(order[:split])
+        top1 = top3 = 0
+        for i in order[split:]:
+            predicted = [item['specialization'] for item in router.predict(pairs[i][0], top=3)]
+            top1 += bool(predicted) and predicted[0] == pairs[i][1]
+            top3 += pairs[i][1] in predicted
+        holdout = len(pairs) - split
+        metrics['holdout_top1_accuracy'] = top1 / holdout
+        metrics['holdout_top3_accuracy'] = top3 / holdout
+
+    router = fit(np.arange(len(pairs)))
+    router.metrics = metrics
+    router.trained_at = timezone.now().isoformat()
+    return router
+
+
+def get_router() -> SpecializationRouter:
+    """
+    The trained router, loaded lazily; None if untrained
+    """
+    return load_model_file(model_path(), SpecializationRouter.load, 'specialization router')
+
+
+def soonest_free_slots(specializations: List[str], days: int = 14, limit: int = 5) -> Dict[str, List[Dict]]:
+    """
+    Earliest unbooked scheduled slots per specialization, from now up to ``days`` ahead
+    """
+    now = timezone.localtime()
+    today = now.date()
+    last_day = today + timedelta(days=days)
+    schedules = (
+        Schedule.objects.filter(
+            schedule_date__gte=today, schedule_date__lte=last_day,
+            staff__doctor_details__doctor_specialization__in=specializations
+        )
+        .select_related('staff__doctor_details', 'shift')
+        .prefetch_related(Prefetch('shift__slots', queryset=Slot.objects.filter(is_active=True)))
+        .order_by('schedule_date')
+    )
+    booked = {
+        (appointment.staff_id, listed_slot_id(appointment.slot), appointment.appointment_date)
+        for appointment in Appointment.objects.filter(
+            appointment_date__gte=today, appointment_date__lte=last_day,
+            staff__doctor_details__doctor_specialization__in=specializations
+        ).select_related('slot__shift')
+    }
+
+    free = {specialization: [] for specialization in specializations}
+    for schedule in schedules:
+        for slot_id, start_time, duration, _ in listed_slots(schedule.shift):
+            if (schedule.staff_id, slot_id, schedule.schedule_date) in booked:
+                continue
+            if schedule.schedule_date == today and start_time <= now.time():
+                continue
+            free[schedule.staff.doctor_details.doctor_specialization].append({
+                'date': schedule.schedule_date.isoformat(),
+                'start_time': start_time.strftime('%H:%M:%S'),
+                'duration': duration,
+                'slot_id': slot_id,
+                'staff_id': schedule.staff_id,
+                'staff_name': schedule.staff.staff_name,
+            })
+    return {
+        specialization: sorted(slots, key=lambda item: (item['date'], item['start_time']))[:limit]
+        for specialization, slots in free.items()
+    }
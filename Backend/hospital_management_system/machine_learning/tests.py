@@ -1,3 +1,500 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from unittest import mock
+import numpy as np
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from hospital.models import (Appointment, AppointmentRating, DoctorDetails, DoctorType, Patient, Role, Schedule, Shift,
+                             Slot, Staff)
+from transactions.models import PaymentMethod, Transaction, TransactionType, Unit
+from .cache import data_version, get_cache
+from .early_warning import MIN_BASELINE_READINGS, MIN_BASELINE_STD, celsius, news_scores, score_readings
+from .forecasting import MIN_TREND_DAYS, _model_summary, fit_demand, predict_demand
+from .models import DailyAppointmentRollup
+from .no_show import _prior_history, roc_auc
+from .specialization_router import SpecializationRouter, terms
+from .rollups import ROLLUPS, refresh_rollup
+from .views import (AppointmentAnalyticsView, DoctorSpecializationAnalyticsView, RatingAnalyticsView,
+                    RevenueAnalyticsView)
 
-# Create your tests here.
+
+class AnalyticsQueryCountTests(TestCase):
+    """
+    The rollup-backed dashboards answer any range with a fixed number of queries
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.localdate()
+        admin_role = Role.objects.create(role_name='admin', role_permissions={'is_admin': True})
+        doctor_role = Role.objects.create(role_name='doctor', role_permissions={'is_doctor': True})
+        cls.admin = Staff.objects.create(
+            staff_id='ADM1', staff_name='Admin', role=admin_role, created_at=today,
+            staff_email='admin@example.com', staff_mobile='1'
+        )
+        doctor_type = DoctorType.objects.create(doctor_type='General')
+        doctors = []
+        for number in range(3):
+            doctor = Staff.objects.create(
+                staff_id=f'DOC{number}', staff_name=f'Doctor {number}', role=doctor_role, created_at=today,
+                staff_email=f'doc{number}@example.com', staff_mobile='1'
+            )
+            DoctorDetails.objects.create(
+                staff=doctor, doctor_specialization='Cardiology', doctor_license='L',
+                doctor_experience_years=5, doctor_type=doctor_type
+            )
+            doctors.append(doctor)
+        shift = Shift.objects.create(shift_name='Morning', start_time=time(9), end_time=time(13))
+        slot = Slot.objects.create(slot_start_time=time(9), slot_duration=30, shift=shift)
+        patient = Patient.objects.create(patient_name='Patient', patient_email='p@example.com', patient_mobile='1')
+
+        # Two appointments a month for the last twelve months, one rated per month
+        cls.expected_ratings = []
+        statuses = ['completed', 'missed']
+        for month in range(12):
+            day = today - timedelta(days=30 * month)
+            for index, status in enumerate(statuses):
+                appointment = Appointment.objects.create(
+                    patient=patient, staff=doctors[(month + index) % 3], slot=slot,
+                    appointment_date=day, status=status, reason='Checkup'
+                )
+                created = timezone.make_aware(datetime.combine(day, time(10)))
+                Appointment.objects.filter(pk=appointment.pk).update(created_at=created)
+                if status == 'completed':
+                    rating = month % 5 + 1
+                    AppointmentRating.objects.create(appointment=appointment, rating=rating)
+                    cls.expected_ratings.append(rating)
+
+        # One completed and one pending payment a month, alternating payment methods
+        payment = TransactionType.objects.create(transaction_type_name='payment')
+        methods = [PaymentMethod.objects.create(payment_method_name=name) for name in ('upi', 'card')]
+        unit = Unit.objects.create(unit_name='INR', unit_symbol='₹')
+        cls.expected_revenue = {'upi': Decimal('0'), 'card': Decimal('0')}
+        for month in range(12):
+            method = methods[month % 2]
+            for status in ('completed', 'pending'):
+                amount = Decimal(100 + month)
+                transaction = Transaction.objects.create(
+                    transaction_type=payment, payment_method=method, transaction_amount=amount,
+                    transaction_unit=unit, transaction_status=status, patient=patient
+                )
+                created = timezone.make_aware(datetime.combine(today - timedelta(days=30 * month), time(10)))
+                Transaction.objects.filter(pk=transaction.pk).update(transaction_datetime=created)
+                if status == 'completed':
+                    cls.expected_revenue[method.payment_method_name] += amount
+        for name in ROLLUPS:
+            refresh_rollup(name, None)
+
+    def setUp(self):
+        get_cache().clear()
+        self.admin = Staff.objects.select_related('role').get(staff_id='ADM1')
+
+    def get(self, view_class, **params):
+        request = APIRequestFactory().get('/', params)
+        force_authenticate(request, user=self.admin)
+        return view_class.as_view()(request)
+
+    def yearly_range(self):
+        today = timezone.localdate()
+        return {'start_date': (today - timedelta(days=364)).isoformat(), 'end_date': today.isoformat()}
+
+    def test_revenue_analytics_yearly_by_month(self):
+        # Revenue per bucket from the daily rollup in one GROUP BY
+        with self.assertNumQueries(1):
+            response = self.get(RevenueAnalyticsView, period='year')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['historical_data']), 12)
+        self.assertEqual(response.data['total_revenue'], sum(self.expected_revenue.values()))
+
+    def test_revenue_analytics_query_count_does_not_grow_with_buckets(self):
+        with self.assertNumQueries(1):
+            response = self.get(RevenueAnalyticsView, granularity='day', **self.yearly_range())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['historical_data']), 365)
+        self.assertEqual(response.data['total_revenue'], sum(self.expected_revenue.values()))
+
+        # A breakdown is one more GROUP BY column, not one more query
+        get_cache().clear()
+        with self.assertNumQueries(1):
+            response = self.get(RevenueAnalyticsView, granularity='day', breakdown='payment_method', **self.yearly_range())
+        self.assertEqual(
+            {entry['payment_method']: entry['revenue'] for entry in response.data['breakdown']}, self.expected_revenue
+        )
+
+    def test_rating_analytics_yearly_by_month(self):
+        # Buckets with totals and distribution, then the top doctors
+        with self.assertNumQueries(2):
+            response = self.get(RatingAnalyticsView, period='year')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['historical_data']), 12)
+        self.assertEqual(response.data['total_ratings'], len(self.expected_ratings))
+        self.assertAlmostEqual(
+            response.data['average_rating'], sum(self.expected_ratings) / len(self.expected_ratings)
+        )
+        self.assertEqual(
+            response.data['rating_distribution'],
+            {str(value): self.expected_ratings.count(value) for value in range(1, 6)}
+        )
+
+    def test_rating_analytics_query_count_does_not_grow_with_buckets(self):
+        with self.assertNumQueries(2):
+            response = self.get(RatingAnalyticsView, granularity='week', **self.yearly_range())
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(len(response.data['historical_data']), 52)
+        self.assertEqual(sum(bucket['count'] for bucket in response.data['historical_data']), 12)
+
+    def test_appointment_analytics_yearly_by_month(self):
+        # Buckets with per-status counts, then the patient count
+        with self.assertNumQueries(2):
+            response = self.get(AppointmentAnalyticsView, period='year')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['historical_data']), 12)
+        self.assertEqual(response.data['total_appointments'], 24)
+        self.assertEqual(response.data['status_distribution']['completed'], 12)
+        self.assertEqual(response.data['status_distribution']['missed'], 12)
+
+    def test_appointment_analytics_query_count_does_not_grow_with_buckets(self):
+        with self.assertNumQueries(2):
+            response = self.get(AppointmentAnalyticsView, granularity='week', **self.yearly_range())
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(len(response.data['historical_data']), 52)
+        self.assertEqual(sum(bucket['count'] for bucket in response.data['historical_data']), 24)
+
+    def test_cached_response_needs_no_queries(self):
+        self.get(AppointmentAnalyticsView, period='year')
+        with self.assertNumQueries(0):
+            response = self.get(AppointmentAnalyticsView, period='year')
+        self.assertEqual(response['X-Analytics-Cache'], 'hit')
+
+    def test_specialization_analytics_is_two_queries(self):
+        today = timezone.localdate()
+        stored = Shift.objects.get(shift_name='Morning')
+        Slot.objects.create(slot_start_time=time(9, 30), slot_duration=30, shift=stored, is_active=False)
+        # 09:00-13:00 in 30 minutes without 11:00-11:30: seven slots, no rows
+        template = Shift.objects.create(
+            shift_name='Template', start_time=time(9), end_time=time(13),
+            slot_duration=30, slot_breaks=[['11:00', '11:30']]
+        )
+        for offset in range(2):
+            Schedule.objects.create(staff_id='DOC0', shift=stored, schedule_date=today - timedelta(days=offset))
+        for offset in range(3):
+            Schedule.objects.create(staff_id='DOC1', shift=template, schedule_date=today - timedelta(days=offset))
+
+        # Doctors and appointments per specialization, then scheduled slots
+        with self.assertNumQueries(2):
+            response = self.get(
+                DoctorSpecializationAnalyticsView,
+                start_date=(today - timedelta(days=10)).isoformat(), end_date=today.isoformat()
+            )
+        self.assertEqual(response.status_code, 200)
+        utilization = response.data['utilization'][0]
+        self.assertEqual(utilization['specialization'], 'Cardiology')
+        self.assertEqual(utilization['scheduled_slots'], 2 * 1 + 3 * 7)
+        self.assertEqual(utilization['booked_slots'], 2)
+
+
+class RollupSignalTests(TestCase):
+    """
+    Writes refresh the rollup days they touch once their transaction commits
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.localdate()
+        role = Role.objects.create(role_name='doctor', role_permissions={'is_doctor': True})
+        cls.doctor = Staff.objects.create(
+            staff_id='DOC1', staff_name='Doctor', role=role, created_at=today,
+            staff_email='doc@example.com', staff_mobile='1'
+        )
+        cls.patient = Patient.objects.create(patient_name='Patient', patient_email='p@example.com', patient_mobile='1')
+        shift = Shift.objects.create(shift_name='Morning', start_time=time(9), end_time=time(13))
+        cls.slot = Slot.objects.create(slot_start_time=time(9), slot_duration=30, shift=shift)
+
+    def book(self, day):
+        return Appointment.objects.create(
+            patient=self.patient, staff=self.doctor, slot=self.slot, appointment_date=day, reason='Checkup'
+        )
+
+    def booked_days(self):
+        return dict(DailyAppointmentRollup.objects.values_list('day', 'appointment_count'))
+
+    def test_reschedule_refreshes_both_days_without_reading_the_old_date(self):
+        today = timezone.localdate()
+        tomorrow = today + timedelta(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book(today)
+        self.assertEqual(self.booked_days(), {today: 1})
+
+        appointment = Appointment.objects.get()
+        appointment.appointment_date = tomorrow
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(1):  # the UPDATE
+                appointment.save()
+        self.assertEqual(self.booked_days(), {tomorrow: 1})
+
+        # The same instance saved again moves from the day it was last saved on
+        appointment.appointment_date = today
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment.save()
+        self.assertEqual(self.booked_days(), {today: 1})
+
+    def test_writes_in_one_transaction_share_one_refresh(self):
+        today = timezone.localdate()
+        version = data_version()
+        with mock.patch('machine_learning.rollups.refresh_rollup') as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    for offset in range(3):
+                        self.book(today + timedelta(days=offset))
+                    Schedule.objects.create(staff=self.doctor, shift=self.slot.shift, schedule_date=today)
+        refresh.assert_called_once_with('appointments', {today + timedelta(days=offset) for offset in range(3)})
+        self.assertEqual(data_version(), version + 1)
+
+
+class NoShowModelTests(SimpleTestCase):
+    """
+    Evaluation and training-feature helpers of the no-show model
+    """
+
+    def pairwise_auc(self, labels, scores):
+        # Probability a random positive outscores a random negative, ties counting half
+        positives, negatives = scores[labels == 1], scores[labels == 0]
+        wins = (positives[:, None] > negatives[None, :]).sum() + 0.5 * (positives[:, None] == negatives[None, :]).sum()
+        return wins / (len(positives) * len(negatives))
+
+    def test_roc_auc_separation(self):
+        labels = np.array([0, 0, 1, 1])
+        self.assertEqual(roc_auc(labels, np.array([0.1, 0.2, 0.8, 0.9])), 1.0)
+        self.assertEqual(roc_auc(labels, np.array([0.9, 0.8, 0.2, 0.1])), 0.0)
+
+    def test_roc_auc_counts_ties_as_half(self):
+        self.assertEqual(roc_auc(np.array([0, 1, 0, 1]), np.array([0.1, 0.5, 0.5, 0.9])), 0.875)
+        self.assertEqual(roc_auc(np.array([0, 1, 0, 1]), np.full(4, 0.3)), 0.5)
+
+        rng = np.random.default_rng(0)
+        labels = rng.integers(0, 2, 500)
+        scores = rng.integers(0, 10, 500) / 10  # many ties
+        self.assertAlmostEqual(roc_auc(labels, scores), self.pairwise_auc(labels, scores))
+
+    def test_roc_auc_needs_both_classes(self):
+        self.assertTrue(np.isnan(roc_auc(np.ones(3), np.array([0.1, 0.2, 0.3]))))
+
+    def test_prior_history_only_counts_earlier_appointments(self):
+        # Rows in date order, patients interleaved
+        patients = [7, 3, 7, 7, 3, 9, 3, 7]
+        labels = np.array([1, 0, 0, 1, 1, 0, 1, 1], dtype=float)
+        rows = [{'patient_id': patient} for patient in patients]
+
+        counts, misses = _prior_history(rows, labels)
+        for position, patient in enumerate(patients):
+            earlier = [i for i in range(position) if patients[i] == patient]
+            self.assertEqual(counts[position], len(earlier))
+            self.assertEqual(misses[position], labels[earlier].sum())
+
+    def test_prior_history_does_not_leak_the_label(self):
+        rows = [{'patient_id': patient} for patient in (1, 1, 2, 1)]
+        labels = np.array([0, 1, 0, 0], dtype=float)
+        _, misses = _prior_history(rows, labels)
+        flipped = labels.copy()
+        flipped[1] = 0
+        _, flipped_misses = _prior_history(rows, flipped)
+        self.assertEqual(misses[1], flipped_misses[1])
+        self.assertEqual(misses[3] - flipped_misses[3], 1)
+
+
+class DemandForecastTests(SimpleTestCase):
+    """
+    Least-squares demand fit with and without a trend
+    """
+    monday = date(2026, 1, 5)
+    weekday_pattern = np.array([5, 3, 3, 3, 3, 8, 1], dtype=float)
+
+    def days(self, count, start=None):
+        start = start or self.monday
+        return [start + timedelta(days=offset) for offset in range(count)]
+
+    def test_short_history_fits_weekday_means_without_a_trend(self):
+        days = self.days(14)
+        self.assertLess(len(days), MIN_TREND_DAYS)
+        fit = fit_demand(days, np.tile(self.weekday_pattern, 2))
+
+        self.assertFalse(fit['with_trend'])
+        self.assertEqual(len(fit['coefficients']), 7)
+        self.assertAlmostEqual(fit['residual_std'], 0.0)
+        future = self.days(7, self.monday + timedelta(days=70))
+        np.testing.assert_allclose(predict_demand(fit, future), self.weekday_pattern, atol=1e-9)
+
+        summary = _model_summary(fit, len(days))
+        self.assertIsNone(summary['trend_per_week'])
+        self.assertEqual(summary['weekday_effects']['monday'], 0.0)
+        self.assertEqual(summary['weekday_effects']['saturday'], 3.0)
+
+    def test_a_few_days_of_history_still_forecasts(self):
+        days = self.days(3)
+        fit = fit_demand(days, np.array([4.0, 6.0, 5.0]))
+        forecast = predict_demand(fit, self.days(14, self.monday + timedelta(days=3)))
+        self.assertEqual(len(forecast), 14)
+        self.assertTrue(np.all(np.isfinite(forecast)))
+        self.assertTrue(np.all(forecast >= 0))
+        np.testing.assert_allclose(predict_demand(fit, days), [4.0, 6.0, 5.0], atol=1e-9)
+
+    def test_long_history_recovers_the_trend(self):
+        days = self.days(8 * 7)
+        counts = 10 + 2 * np.arange(len(days)) / 7 + np.tile(self.weekday_pattern, 8)
+        fit = fit_demand(days, counts)
+        self.assertTrue(fit['with_trend'])
+        self.assertAlmostEqual(_model_summary(fit, len(days))['trend_per_week'], 2.0)
+
+    def test_forecast_is_clipped_at_zero(self):
+        days = self.days(5 * 7)
+        fit = fit_demand(days, 50 - 5 * np.arange(len(days)) / 7)
+        self.assertTrue(np.all(predict_demand(fit, self.days(7, self.monday + timedelta(weeks=30))) == 0))
+
+
+class SpecializationRouterTests(SimpleTestCase):
+    """
+    TF-IDF vectorizing and softmax prediction, before and after a save/load round trip
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        vocabulary = sorted(['chest', 'pain', 'chest pain', 'rash', 'skin', 'skin rash', 'cough', 'fever'])
+        self.router = SpecializationRouter(
+            vocabulary=vocabulary,
+            idf=rng.uniform(1.0, 3.0, len(vocabulary)),
+            weights=rng.normal(0, 2, (len(vocabulary), 3)),
+            bias=rng.normal(0, 0.5, 3),
+            classes=['Cardiology', 'Dermatology', 'General'],
+            metrics={'holdout_accuracy': 0.9},
+        )
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'router.npz')
+
+    def test_terms_drop_stop_words_and_add_bigrams(self):
+        self.assertEqual(terms('I have a Chest pain'), ['chest', 'pain', 'chest pain'])
+        self.assertEqual(terms(None), [])
+
+    def test_vectorize_is_l2_normalised_log_tf_idf(self):
+        indices, values = self.router.vectorize('rash rash on the skin')
+        weights = dict(zip(indices.tolist(), values.tolist()))
+        rash, skin = self.router.index['rash'], self.router.index['skin']
+        self.assertEqual(set(weights), {rash, skin})  # "rash skin" is no known bigram
+        expected = np.array([(1 + np.log(2)) * self.router.idf[rash], self.router.idf[skin]])
+        expected /= np.linalg.norm(expected)
+        self.assertAlmostEqual(weights[rash], expected[0], places=6)
+        self.assertAlmostEqual(weights[skin], expected[1], places=6)
+        self.assertAlmostEqual(float(np.linalg.norm(values)), 1.0, places=6)
+
+    def test_predict_is_a_softmax_over_the_known_terms(self):
+        indices, values = self.router.vectorize('chest pain and fever')
+        logits = self.router.bias + values @ self.router.weights[indices]
+        expected = np.exp(logits) / np.exp(logits).sum()
+
+        predictions = self.router.predict('chest pain and fever', top=3)
+        self.assertEqual([p['specialization'] for p in predictions],
+                         [self.router.classes[i] for i in np.argsort(-expected)])
+        for prediction in predictions:
+            position = self.router.classes.index(prediction['specialization'])
+            self.assertAlmostEqual(prediction['probability'], expected[position], places=4)
+        self.assertEqual(self.router.predict('nothing known here'), [])
+
+    def test_save_and_load_round_trip(self):
+        self.router.save(self.path)
+        loaded = SpecializationRouter.load(self.path)
+
+        self.assertEqual(loaded.vocabulary, self.router.vocabulary)
+        self.assertEqual(loaded.classes, self.router.classes)
+        self.assertEqual(loaded.metrics, {'holdout_accuracy': 0.9})
+        # Weights are stored as float16
+        np.testing.assert_allclose(loaded.weights, self.router.weights, rtol=1e-3, atol=1e-3)
+        for text in ('chest pain', 'skin rash and cough', 'fever fever'):
+            np.testing.assert_allclose(loaded.vectorize(text)[1], self.router.vectorize(text)[1], rtol=1e-6)
+            original, reloaded = self.router.predict(text), loaded.predict(text)
+            self.assertEqual([p['specialization'] for p in reloaded], [p['specialization'] for p in original])
+            for before, after in zip(original, reloaded):
+                self.assertAlmostEqual(after['probability'], before['probability'], delta=5e-3)
+
+
+class EarlyWarningTests(SimpleTestCase):
+    """
+    NEWS2 banding and the personal-baseline z-scores
+    """
+
+    def component(self, sign, readings):
+        values = {name: np.full(len(readings), np.nan) for name in ('heartrate', 'spo2', 'temperature')}
+        values[sign] = np.array(readings, dtype=float)
+        return news_scores(values)[sign].tolist()
+
+    def test_heart_rate_band_edges(self):
+        self.assertEqual(
+            self.component('heartrate', [40, 41, 50, 51, 90, 91, 110, 111, 130, 131]),
+            [3, 1, 1, 0, 0, 1, 1, 2, 2, 3]
+        )
+
+    def test_spo2_band_edges(self):
+        self.assertEqual(self.component('spo2', [91, 92, 93, 94, 95, 96]), [3, 2, 2, 1, 1, 0])
+
+    def test_temperature_band_edges(self):
+        self.assertEqual(
+            self.component('temperature', [35.0, 35.1, 36.0, 36.1, 38.0, 38.1, 39.0, 39.1]),
+            [3, 1, 1, 0, 0, 1, 1, 2]
+        )
+
+    def test_fahrenheit_readings_are_converted(self):
+        temperatures = celsius(np.array([95.0, 95.18, 98.6, 102.2, 37.0]))
+        np.testing.assert_allclose(temperatures, [35.0, 35.1, 37.0, 39.0, 37.0], atol=1e-9)
+        self.assertEqual(self.component('temperature', temperatures), [3, 1, 0, 1, 0])
+
+    def test_missing_signs_score_zero(self):
+        scores = news_scores({
+            'heartrate': np.array([np.nan, 131.0]),
+            'spo2': np.array([np.nan, 91.0]),
+            'temperature': np.array([np.nan, 39.1]),
+        })
+        self.assertEqual(scores['total'].tolist(), [0, 8])
+        self.assertEqual(scores['max_component'].tolist(), [0, 3])
+
+    def reading(self, position, patient_id, heartrate):
+        return {
+            'id': position, 'patient_id': patient_id, 'created_at': None,
+            'patient_heartrate': heartrate, 'patient_spo2': 97.0, 'patient_temperature': 36.8,
+        }
+
+    def test_baseline_accumulates_stored_and_earlier_batch_readings(self):
+        stored = [70.0, 72.0, 68.0]
+        batch = {1: [71.0, None, 69.0, 75.0, 120.0], 2: [80.0, 82.0, 79.0, 81.0, 80.0, 130.0]}
+        rows = [
+            self.reading(len(stored) + index, patient, heartrate)
+            for patient, readings in batch.items() for index, heartrate in enumerate(readings)
+        ]
+        baselines = {1: {
+            'heartrate': (len(stored), np.mean(stored), np.mean(np.square(stored))),
+            'spo2': (0, 0.0, 0.0), 'temperature': (0, 0.0, 0.0),
+        }}
+
+        results = score_readings(rows, baselines)
+        for patient, readings in batch.items():
+            history = list(stored) if patient == 1 else []
+            patient_results = [result for result in results if result['patient_id'] == patient]
+            for heartrate, result in zip(readings, patient_results):
+                if heartrate is None:
+                    self.assertNotIn('heartrate', result['z_scores'])
+                    continue
+                if len(history) < MIN_BASELINE_READINGS:
+                    self.assertNotIn('heartrate', result['z_scores'])
+                else:
+                    std = max(np.std(history), MIN_BASELINE_STD['heartrate'])
+                    expected = (heartrate - np.mean(history)) / std
+                    self.assertAlmostEqual(result['z_scores']['heartrate'], round(expected, 2))
+                history.append(heartrate)
+
+        # Each patient's spike is flagged against their own history only
+        self.assertIn('heartrate', results[len(batch[1]) - 1]['anomalies'])
+        self.assertIn('heartrate', results[-1]['anomalies'])
+        self.assertEqual(results[-1]['components']['heartrate'], 2)
@@ -11,4 +11,7 @@ urlpatterns = [
     path('admin/analytics/ratings/', views.RatingAnalyticsView.as_view(), name='rating-analytics'),
     path('admin/analytics/appointments/', views.AppointmentAnalyticsView.as_view(), name='appointment-analytics'),
     path('admin/analytics/doctor-specializations/', views.DoctorSpecializationAnalyticsView.as_view(), name='doctor-specialization-analytics'),
+    path('admin/analytics/no-show-risk/', views.NoShowRiskView.as_view(), name='no-show-risk'),
+    path('admin/analytics/capacity-forecast/', views.CapacityForecastView.as_view(), name='capacity-forecast'),
+    path('specialization-suggestions/', views.SpecializationSuggestionView.as_view(), name='specialization-suggestions'),
 ]
@@ -2,211 +2,176 @@ from django.shortcuts import render
 from accounts.authentication import JWTAuthentication
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAdminUser
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from django.utils import timezone
-from datetime import timedelta
+from datetime import date, timedelta
 from django.db.models import Sum
 from hospital.permissions import IsAdminStaff
 from transactions.models import Transaction
-from hospital.models import Appointment, AppointmentRating, Staff, Patient
-from django.db.models import Avg, Count
+from hospital.models import Appointment, AppointmentRating, DoctorDetails, Schedule, Slot, Staff, Patient
+from hospital.slots import template_slot_count
+from django.db.models import Avg, Count, F, FloatField, OuterRef, Q, Subquery
+from django.db.models.functions import Cast, Coalesce
+from collections import defaultdict
+from decimal import Decimal
+from .cache import cached_analytics_response
+from .no_show import get_model as get_no_show_model, score_rows
+from .specialization_router import get_router as get_specialization_router, soonest_free_slots
+from .models import CapacityForecastReport, DailyAppointmentRollup, DailyRatingRollup, DailyRevenueRollup
+from .analytics import (
+    bucket_starts, bucketed_rows, optional_date_range, resolve_date_range, zero_filled_series
+)
 # Create your views here.
+APPOINTMENT_STATUSES = ('upcoming', 'completed', 'missed')
+
+REVENUE_BREAKDOWNS = {
+    'payment_method': 'payment_method__payment_method_name',
+    'transaction_type': 'transaction_type__transaction_type_name',
+}
+
 class RevenueAnalyticsView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAdminStaff]
 
+    @cached_analytics_response('revenue')
     def get(self, request):
-        # Get time period from query params (default to last 30 days)
-        period = request.query_params.get('period', 'month')
-        
-        # Calculate date range based on period
-        today = timezone.now().date()
-        if period == 'week':
-            start_date = today - timedelta(days=7)
-        elif period == 'month':
-            start_date = today - timedelta(days=30)
-        elif period == 'year':
-            start_date = today - timedelta(days=365)
-        else:
-            return Response({"error": "Invalid period"}, status=400)
-            
-        # Get all completed transactions in the period
-        transactions = Transaction.objects.filter(
-            transaction_datetime__date__gte=start_date,
-            transaction_datetime__date__lte=today,
-            transaction_status='completed'
+        """
+        Revenue from completed transactions, bucketed over time
+
+        Query params:
+        - period: week, month (default) or year
+        - start_date, end_date: custom range (YYYY-MM-DD) instead of period
+        - granularity: day, week or month (defaults from period/range length)
+        - breakdown: payment_method or transaction_type
+        """
+        try:
+            window = resolve_date_range(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+
+        breakdown = request.query_params.get('breakdown')
+        if breakdown and breakdown not in REVENUE_BREAKDOWNS:
+            return Response({"error": "breakdown must be payment_method or transaction_type"}, status=400)
+
+        # Completed-transaction revenue, pre-aggregated per day
+        rollups = DailyRevenueRollup.objects.filter(
+            day__gte=window['start_date'],
+            day__lte=window['end_date']
         )
-        
-        # Calculate total revenue
-        total_revenue = transactions.aggregate(
-            total=Sum('transaction_amount')
-        )['total'] or 0
-        
-        # Group by date for historical data
-        historical_data = []
-        
-        # Group by day, week, or month depending on period
-        if period == 'week':
-            # Daily data for week view
-            for i in range(7):
-                date = today - timedelta(days=i)
-                daily_revenue = transactions.filter(
-                    transaction_datetime__date=date
-                ).aggregate(total=Sum('transaction_amount'))['total'] or 0
-                
-                historical_data.append({
-                    'date': date.isoformat(),
-                    'revenue': daily_revenue
-                })
-        elif period == 'month':
-            # Weekly data for month view
-            for i in range(4):
-                week_end = today - timedelta(days=i*7)
-                week_start = week_end - timedelta(days=6)
-                weekly_revenue = transactions.filter(
-                    transaction_datetime__date__gte=week_start,
-                    transaction_datetime__date__lte=week_end
-                ).aggregate(total=Sum('transaction_amount'))['total'] or 0
-                
-                historical_data.append({
-                    'period': f"{week_start.isoformat()} to {week_end.isoformat()}",
-                    'revenue': weekly_revenue
-                })
-        else:
-            # Monthly data for year view
-            for i in range(12):
-                month_end = today.replace(day=1) - timedelta(days=1)
-                month_end = month_end.replace(month=month_end.month-i if month_end.month > i else 12-(i-month_end.month))
-                month_start = month_end.replace(day=1)
-                
-                monthly_revenue = transactions.filter(
-                    transaction_datetime__date__gte=month_start,
-                    transaction_datetime__date__lte=month_end
-                ).aggregate(total=Sum('transaction_amount'))['total'] or 0
-                
-                historical_data.append({
-                    'month': month_start.strftime('%B %Y'),
-                    'revenue': monthly_revenue
-                })
-        
-        # Reverse to get chronological order
-        historical_data.reverse()
-        
-        return Response({
-            'total_revenue': total_revenue,
-            'period': period,
+
+        # One query: revenue per bucket (and per breakdown key when requested)
+        group_by = (REVENUE_BREAKDOWNS[breakdown],) if breakdown else ()
+        rows = bucketed_rows(
+            rollups, 'day', window['granularity'],
+            {'revenue': Sum('revenue')}, group_by
+        )
+
+        bucket_totals = defaultdict(lambda: Decimal('0'))
+        bucket_breakdown = defaultdict(dict)
+        breakdown_totals = defaultdict(lambda: Decimal('0'))
+        for row in rows:
+            bucket_totals[row['bucket']] += row['revenue']
+            if breakdown:
+                name = row[group_by[0]]
+                bucket_breakdown[row['bucket']][name] = row['revenue']
+                breakdown_totals[name] += row['revenue']
+
+        historical_data = zero_filled_series(
+            [{'bucket': bucket, 'revenue': total} for bucket, total in bucket_totals.items()],
+            window, {'revenue': ('revenue', 0)}
+        )
+
+        response = {
+            'total_revenue': sum(bucket_totals.values()) or 0,
+            'period': window['period'],
+            'start_date': window['start_date'].isoformat(),
+            'end_date': window['end_date'].isoformat(),
+            'granularity': window['granularity'],
             'historical_data': historical_data
-        }, status=200)
+        }
+
+        if breakdown:
+            starts = bucket_starts(window['start_date'], window['end_date'], window['granularity'])
+            for entry, bucket in zip(historical_data, starts):
+                entry['breakdown'] = bucket_breakdown.get(bucket, {})
+            response['breakdown'] = [
+                {breakdown: name, 'revenue': total}
+                for name, total in sorted(breakdown_totals.items(), key=lambda item: item[1], reverse=True)
+            ]
+
+        return Response(response, status=200)
+
+RATING_VALUES = (5, 4, 3, 2, 1)
 
 class RatingAnalyticsView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAdminStaff]
 
+    @cached_analytics_response('ratings')
     def get(self, request):
-        # Get time period from query params
-        period = request.query_params.get('period', 'month')
-        
-        # Calculate date range
-        today = timezone.now().date()
-        if period == 'week':
-            start_date = today - timedelta(days=7)
-        elif period == 'month':
-            start_date = today - timedelta(days=30)
-        elif period == 'year':
-            start_date = today - timedelta(days=365)
-        else:
-            return Response({"error": "Invalid period"}, status=400)
+        """
+        Rating averages, distribution and history
+
+        Query params: period, start_date, end_date, granularity (see RevenueAnalyticsView)
+        """
+        try:
+            window = resolve_date_range(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
             
-        # Get all ratings in the period
-        ratings = AppointmentRating.objects.filter(
-            appointment__created_at__date__gte=start_date,
-            appointment__created_at__date__lte=today
+        # Ratings in the period, pre-aggregated per day and doctor
+        rollups = DailyRatingRollup.objects.filter(
+            day__gte=window['start_date'],
+            day__lte=window['end_date']
+        )
+        
+        # One query: sum, count and per-star counts for every bucket; the
+        # overall average and distribution are totals of the same rows
+        star_counts = {
+            f'stars_{value}': Sum(f'stars_{value}')
+            for value in RATING_VALUES
+        }
+        rows = bucketed_rows(
+            rollups, 'day', window['granularity'],
+            {'rating_sum': Sum('rating_sum'), 'count': Sum('rating_count'), **star_counts}
         )
         
-        # Calculate average rating
-        avg_rating = ratings.aggregate(avg=Avg('rating'))['avg'] or 0
+        total_ratings = sum(row['count'] for row in rows)
+        rating_sum = sum(row['rating_sum'] for row in rows)
+        avg_rating = rating_sum / total_ratings if total_ratings else 0
         
         # Rating distribution
         rating_distribution = {
-            '5': ratings.filter(rating=5).count(),
-            '4': ratings.filter(rating=4).count(),
-            '3': ratings.filter(rating=3).count(),
-            '2': ratings.filter(rating=2).count(),
-            '1': ratings.filter(rating=1).count()
+            str(value): sum(row[f'stars_{value}'] for row in rows)
+            for value in RATING_VALUES
         }
         
-        # Top rated doctors
-        top_doctors = Staff.objects.filter(
-            appointments__ratings__isnull=False
+        # Top rated doctors (all time)
+        top_doctors = DailyRatingRollup.objects.values(
+            'staff_id', 'staff__staff_name'
         ).annotate(
-            avg_rating=Avg('appointments__ratings__rating'),
-            rating_count=Count('appointments__ratings')
+            total_ratings=Sum('rating_count'),
+            avg_rating=Cast(Sum('rating_sum'), FloatField()) / Sum('rating_count')
         ).filter(
-            rating_count__gte=5  # Minimum 5 ratings
+            total_ratings__gte=5  # Minimum 5 ratings
         ).order_by('-avg_rating')[:5]
         
         top_doctors_data = [{
-            'staff_id': doctor.staff_id,
-            'staff_name': doctor.staff_name,
-            'avg_rating': doctor.avg_rating,
-            'rating_count': doctor.rating_count
+            'staff_id': doctor['staff_id'],
+            'staff_name': doctor['staff__staff_name'],
+            'avg_rating': doctor['avg_rating'],
+            'rating_count': doctor['total_ratings']
         } for doctor in top_doctors]
         
-        # Historical rating data
-        historical_data = []
-        
-        # Group by appropriate time period
-        if period == 'week':
-            for i in range(7):
-                date = today - timedelta(days=i)
-                daily_ratings = ratings.filter(
-                    appointment__created_at__date=date
-                )
-                avg = daily_ratings.aggregate(avg=Avg('rating'))['avg'] or 0
-                
-                historical_data.append({
-                    'date': date.isoformat(),
-                    'avg_rating': avg,
-                    'count': daily_ratings.count()
-                })
-        elif period == 'month':
-            for i in range(4):
-                week_end = today - timedelta(days=i*7)
-                week_start = week_end - timedelta(days=6)
-                weekly_ratings = ratings.filter(
-                    appointment__created_at__date__gte=week_start,
-                    appointment__created_at__date__lte=week_end
-                )
-                avg = weekly_ratings.aggregate(avg=Avg('rating'))['avg'] or 0
-                
-                historical_data.append({
-                    'period': f"{week_start.isoformat()} to {week_end.isoformat()}",
-                    'avg_rating': avg,
-                    'count': weekly_ratings.count()
-                })
-        else:
-            for i in range(12):
-                month_end = today.replace(day=1) - timedelta(days=1)
-                month_end = month_end.replace(month=month_end.month-i if month_end.month > i else 12-(i-month_end.month))
-                month_start = month_end.replace(day=1)
-                
-                monthly_ratings = ratings.filter(
-                    appointment__created_at__date__gte=month_start,
-                    appointment__created_at__date__lte=month_end
-                )
-                avg = monthly_ratings.aggregate(avg=Avg('rating'))['avg'] or 0
-                
-                historical_data.append({
-                    'month': month_start.strftime('%B %Y'),
-                    'avg_rating': avg,
-                    'count': monthly_ratings.count()
-                })
-        
-        historical_data.reverse()
+        for row in rows:
+            row['avg_rating'] = row['rating_sum'] / row['count'] if row['count'] else 0
+        historical_data = zero_filled_series(
+            rows, window, {'avg_rating': ('avg_rating', 0), 'count': ('count', 0)}
+        )
         
         return Response({
             'average_rating': avg_rating,
-            'total_ratings': ratings.count(),
+            'total_ratings': total_ratings,
             'rating_distribution': rating_distribution,
             'top_rated_doctors': top_doctors_data,
             'historical_data': historical_data
@@ -216,130 +181,148 @@ class DoctorSpecializationAnalyticsView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAdminStaff]
 
+    @cached_analytics_response('doctor-specializations')
     def get(self, request):
-        # Get all doctors with their specializations
-        doctors = Staff.objects.filter(doctor_details__isnull=False)
-        
-        # Count doctors by specialization
-        specialization_counts = {}
-        for doctor in doctors:
-            specialization = doctor.doctor_details.doctor_specialization
-            if specialization in specialization_counts:
-                specialization_counts[specialization] += 1
-            else:
-                specialization_counts[specialization] = 1
-        
-        # Convert to list for response
-        specialization_data = [
-            {'specialization': spec, 'count': count}
-            for spec, count in specialization_counts.items()
-        ]
-        
-        # Sort by count (descending)
-        specialization_data.sort(key=lambda x: x['count'], reverse=True)
-        
-        # Get appointment distribution by specialization
-        appointment_distribution = []
-        for spec in specialization_counts.keys():
-            spec_doctors = doctors.filter(doctor_details__doctor_specialization=spec)
-            spec_doctor_ids = spec_doctors.values_list('staff_id', flat=True)
-            
-            appointment_count = Appointment.objects.filter(
-                staff__staff_id__in=spec_doctor_ids
-            ).count()
-            
-            appointment_distribution.append({
-                'specialization': spec,
-                'appointment_count': appointment_count
+        """
+        Doctors, appointments and slot utilization per specialization
+
+        Query params:
+        - start_date, end_date: optional appointment/schedule date range (YYYY-MM-DD)
+        - status: optional comma-separated appointment statuses to count
+        """
+        try:
+            start_date, end_date = optional_date_range(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+
+        statuses = [value for value in request.query_params.get('status', '').split(',') if value]
+        if any(value not in APPOINTMENT_STATUSES for value in statuses):
+            return Response({"error": "status must be one of upcoming, completed, missed"}, status=400)
+
+        in_range = Q()
+        schedule_filter = Q()
+        if start_date:
+            in_range &= Q(staff__appointment_rollups__day__gte=start_date)
+            schedule_filter &= Q(schedule_date__gte=start_date)
+        if end_date:
+            in_range &= Q(staff__appointment_rollups__day__lte=end_date)
+            schedule_filter &= Q(schedule_date__lte=end_date)
+        matching = in_range & Q(staff__appointment_rollups__status__in=statuses) if statuses else in_range
+
+        # Query 1: doctors and appointment counts per specialization, from the
+        # daily appointment rollups joined through each doctor
+        specializations = list(
+            DoctorDetails.objects.values('doctor_specialization').annotate(
+                doctor_count=Count('staff', distinct=True),
+                appointment_count=Coalesce(Sum('staff__appointment_rollups__appointment_count', filter=matching), 0),
+                booked_slots=Coalesce(Sum('staff__appointment_rollups__appointment_count', filter=in_range), 0),
+            )
+        )
+
+        # Query 2: schedules per specialization and shift, with each shift's active
+        # slot rows counted alongside; each schedule offers every slot of its
+        # shift, and a template shift's slots are counted from its columns
+        stored_slots = (
+            Slot.objects.filter(shift=OuterRef('shift_id'), is_active=True)
+            .order_by().values('shift').annotate(count=Count('slot_id')).values('count')
+        )
+        scheduled_slots = defaultdict(int)
+        for row in (
+            Schedule.objects.filter(schedule_filter, staff__doctor_details__isnull=False)
+            .values(
+                'staff__doctor_details__doctor_specialization', 'shift_id', 'shift__start_time',
+                'shift__end_time', 'shift__slot_duration', 'shift__slot_breaks'
+            )
+            .annotate(schedules=Count('schedule_id'), stored_slots=Coalesce(Subquery(stored_slots), 0))
+            .order_by()
+        ):
+            slots = row['stored_slots']
+            if row['shift__slot_duration']:
+                slots = template_slot_count(
+                    row['shift__start_time'], row['shift__end_time'],
+                    row['shift__slot_duration'], row['shift__slot_breaks']
+                )
+            scheduled_slots[row['staff__doctor_details__doctor_specialization']] += row['schedules'] * slots
+
+        specialization_data = sorted(
+            ({'specialization': row['doctor_specialization'], 'count': row['doctor_count']}
+             for row in specializations),
+            key=lambda x: x['count'], reverse=True
+        )
+        appointment_distribution = sorted(
+            ({'specialization': row['doctor_specialization'], 'appointment_count': row['appointment_count']}
+             for row in specializations),
+            key=lambda x: x['appointment_count'], reverse=True
+        )
+        utilization = []
+        for row in specializations:
+            scheduled = scheduled_slots.get(row['doctor_specialization'], 0)
+            utilization.append({
+                'specialization': row['doctor_specialization'],
+                'booked_slots': row['booked_slots'],
+                'scheduled_slots': scheduled,
+                'utilization': round(row['booked_slots'] / scheduled, 4) if scheduled else None
             })
-        
-        # Sort by appointment count (descending)
-        appointment_distribution.sort(key=lambda x: x['appointment_count'], reverse=True)
-        
+        utilization.sort(key=lambda x: x['utilization'] or 0, reverse=True)
+
         return Response({
-            'total_doctors': doctors.count(),
+            'total_doctors': sum(row['doctor_count'] for row in specializations),
             'specialization_distribution': specialization_data,
-            'appointment_distribution': appointment_distribution
+            'appointment_distribution': appointment_distribution,
+            'utilization': utilization,
+            'filters': {
+                'start_date': start_date.isoformat() if start_date else None,
+                'end_date': end_date.isoformat() if end_date else None,
+                'status': statuses
+            }
         }, status=200)
 
 class AppointmentAnalyticsView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAdminStaff]
 
+    @cached_analytics_response('appointments')
     def get(self, request):
-        period = request.query_params.get('period', 'month')
-        
-        today = timezone.now().date()
-        if period == 'week':
-            start_date = today - timedelta(days=7)
-        elif period == 'month':
-            start_date = today - timedelta(days=30)
-        elif period == 'year':
-            start_date = today - timedelta(days=365)
-        else:
-            return Response({"error": "Invalid period"}, status=400)
+        """
+        Appointment volume, status distribution and booking history
+
+        Query params: period, start_date, end_date, granularity (see RevenueAnalyticsView)
+        """
+        try:
+            window = resolve_date_range(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
             
-        # Get appointments in the period
-        appointments = Appointment.objects.filter(
-            appointment_date__gte=start_date,
-            appointment_date__lte=today
+        # Appointments in the period, pre-aggregated per day, doctor and status
+        rollups = DailyAppointmentRollup.objects.filter(
+            day__gte=window['start_date'],
+            day__lte=window['end_date']
+        )
+        
+        # One query: total and per-status counts for every bucket
+        status_counts = {
+            status: Coalesce(Sum('appointment_count', filter=Q(status=status)), 0)
+            for status in APPOINTMENT_STATUSES
+        }
+        rows = bucketed_rows(
+            rollups, 'day', window['granularity'],
+            {'count': Sum('appointment_count'), **status_counts}
         )
         
         # Total appointments
-        total_appointments = appointments.count()
+        total_appointments = sum(row['count'] for row in rows)
         
         # Get total number of patients in the database
         total_patients = Patient.objects.count()
 
         # Appointments by status
         status_distribution = {
-            'upcoming': appointments.filter(status='upcoming').count(),
-            'completed': appointments.filter(status='completed').count(),
-            'missed': appointments.filter(status='missed').count()
+            status: sum(row[status] for row in rows)
+            for status in APPOINTMENT_STATUSES
         }
         
         # Historical booking data
-        historical_data = []
-        
-        if period == 'week':
-            for i in range(7):
-                date = today - timedelta(days=i)
-                daily_count = appointments.filter(appointment_date=date).count()
-                
-                historical_data.append({
-                    'date': date.isoformat(),
-                    'count': daily_count
-                })
-        elif period == 'month':
-            for i in range(4):
-                week_end = today - timedelta(days=i*7)
-                week_start = week_end - timedelta(days=6)
-                weekly_count = appointments.filter(
-                    appointment_date__gte=week_start,
-                    appointment_date__lte=week_end
-                ).count()
-                
-                historical_data.append({
-                    'period': f"{week_start.isoformat()} to {week_end.isoformat()}",
-                    'count': weekly_count
-                })
-        else:
-            for i in range(12):
-                month_end = today.replace(day=1) - timedelta(days=1)
-                month_end = month_end.replace(month=month_end.month-i if month_end.month > i else 12-(i-month_end.month))
-                month_start = month_end.replace(day=1)
-                
-                monthly_count = appointments.filter(
-                    appointment_date__gte=month_start,
-                    appointment_date__lte=month_end
-                ).count()
-                
-                historical_data.append({
-                    'month': month_start.strftime('%B %Y'),
-                    'count': monthly_count
-                })
-        
-        historical_data.reverse()
+        historical_data = zero_filled_series(rows, window, {'count': ('count', 0)})
         
         return Response({
             'total_appointments': total_appointments,
@@ -347,3 +330,143 @@ class AppointmentAnalyticsView(APIView):
             'status_distribution': status_distribution,
             'historical_data': historical_data
         }, status=200)
+
+class NoShowRiskView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAdminStaff]
+
+    def get(self, request):
+        """
+        Predicted no-show risk for a day's upcoming appointments
+
+        Query params:
+        - date: YYYY-MM-DD (default tomorrow)
+        - threshold: risk at or above which a slot is suggested for overbooking (default 0.3)
+        """
+        date_param = request.query_params.get('date')
+        try:
+            day = date.fromisoformat(date_param) if date_param else timezone.localdate() + timedelta(days=1)
+            threshold = float(request.query_params.get('threshold', 0.3))
+        except ValueError:
+            return Response({"error": "date must be YYYY-MM-DD and threshold a number"}, status=400)
+
+        model = get_no_show_model()
+        if model is None:
+            return Response({"error": "No-show model has not been trained; run train_no_show_model"}, status=503)
+
+        rows = list(
+            Appointment.objects.filter(status='upcoming')
+            .filter(Q(appointment_date=day) | Q(appointment_date__isnull=True, created_at__date=day))
+            .values('appointment_id', 'patient_id', 'patient__patient_name', 'staff_id', 'staff__staff_name',
+                    'slot_id', 'appointment_date', 'created_at', slot_start_time=F('slot__slot_start_time'))
+        )
+        risks = score_rows(rows)
+
+        appointments = []
+        doctors = {}
+        for row in rows:
+            risk = risks[row['appointment_id']]
+            appointments.append({
+                'appointment_id': row['appointment_id'],
+                'patient_id': row['patient_id'],
+                'patient_name': row['patient__patient_name'],
+                'staff_id': row['staff_id'],
+                'staff_name': row['staff__staff_name'],
+                'slot_id': row['slot_id'],
+                'slot_start_time': row['slot_start_time'].strftime('%H:%M:%S') if row['slot_start_time'] else None,
+                'no_show_risk': risk,
+            })
+            doctor = doctors.setdefault(row['staff_id'], {
+                'staff_id': row['staff_id'],
+                'staff_name': row['staff__staff_name'],
+                'appointments': 0,
+                'expected_no_shows': 0.0,
+                'overbook_slot_ids': [],
+            })
+            doctor['appointments'] += 1
+            doctor['expected_no_shows'] += risk
+            if risk >= threshold:
+                doctor['overbook_slot_ids'].append(row['slot_id'])
+
+        appointments.sort(key=lambda item: -item['no_show_risk'])
+        for doctor in doctors.values():
+            doctor['expected_no_shows'] = round(doctor['expected_no_shows'], 2)
+
+        return Response({
+            'date': day.isoformat(),
+            'threshold': threshold,
+            'model': {
+                'trained_at': model.trained_at,
+                'base_rate': model.global_rate,
+                'holdout_auc': model.metrics.get('holdout_auc'),
+            },
+            'expected_no_shows': round(sum(risks.values()), 2),
+            'doctors': sorted(doctors.values(), key=lambda item: -item['expected_no_shows']),
+            'appointments': appointments
+        }, status=200)
+
+class CapacityForecastView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAdminStaff]
+
+    def get(self, request):
+        """
+        Latest shift capacity forecast (built nightly by build_capacity_forecast)
+
+        Query params:
+        - specialization: optional, only return this specialization
+        """
+        latest = CapacityForecastReport.objects.order_by('-generated_at', '-report_id').first()
+        if latest is None:
+            return Response({"error": "No capacity forecast yet; run build_capacity_forecast"}, status=404)
+
+        report = dict(latest.report)
+        specialization = request.query_params.get('specialization')
+        if specialization:
+            report['specializations'] = [
+                entry for entry in report['specializations'] if entry['specialization'] == specialization
+            ]
+
+        return Response({
+            'report_id': latest.report_id,
+            'generated_at': latest.generated_at,
+            **report
+        }, status=200)
+
+class SpecializationSuggestionView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        Likely specializations for a booking reason, with the soonest free slots for each
+
+        Query params:
+        - reason: free-text booking reason (required)
+        - top: number of specializations (default 3, max 10)
+        - days: how far ahead to look for free slots (default 14, max 60)
+        - slots: free slots per specialization (default 5, max 20)
+        """
+        reason = (request.query_params.get('reason') or '').strip()
+        if not reason:
+            return Response({"error": "reason is required"}, status=400)
+        try:
+            top = min(max(int(request.query_params.get('top', 3)), 1), 10)
+            days = min(max(int(request.query_params.get('days', 14)), 0), 60)
+            slot_limit = min(max(int(request.query_params.get('slots', 5)), 1), 20)
+        except ValueError:
+            return Response({"error": "top, days and slots must be integers"}, status=400)
+
+        router = get_specialization_router()
+        if router is None:
+            return Response({"error": "Specialization router has not been trained; run train_specialization_router"}, status=503)
+
+        suggestions = router.predict(reason, top=top)
+        free_slots = soonest_free_slots([item['specialization'] for item in suggestions], days=days, limit=slot_limit)
+        for item in suggestions:
+            item['free_slots'] = free_slots.get(item['specialization'], [])
+
+        return Response({
+            'reason': reason,
+            'suggestions': suggestions
+        }, status=200)
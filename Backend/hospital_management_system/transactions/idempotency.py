@@ -0,0 +1,141 @@
+"""
+Idempotency keys for payment endpoints
+
+Clients send an ``Idempotency-Key`` header; views can also name a body field to
+fall back on (the payment views use transaction_reference, which retrying
+mobile clients already resend). The first request with a key claims it, runs
+the view in one atomic block (taking SQLite's write lock up front, as the view
+reads before it writes) and stores the response in that same transaction,
+so a retry with the same key and body gets the stored response back without
+the view running again. Only 2xx responses are kept: anything else is rolled
+back and the key released, so a corrected request can use it again.
+"""
+import functools
+import hashlib
+import json
+from datetime import timedelta
+from typing import Optional, Tuple
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.response import Response
+from hospital_management_system.db import write_transaction
+from .models import IdempotencyKey
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+
+
+def request_owner(user) -> str:
+    """
+    Keys are scoped per user so one client can't replay another's response
+    """
+    if hasattr(user, 'patient_id'):
+        return f"patient:{user.patient_id}"
+    if hasattr(user, 'staff_id'):
+        return f"staff:{user.staff_id}"
+    return 'anonymous'
+
+
+def request_fingerprint(request, view_kwargs) -> str:
+    payload = {'kwargs': view_kwargs, 'data': request.data}
+    encoded = json.dumps(payload, sort_keys=True, cls=DjangoJSONEncoder, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def claim_key(owner: str, scope: str, key: str, fingerprint: str) -> Tuple[Optional[IdempotencyKey], Optional[IdempotencyKey]]:
+    """
+    Claim a key for this request
+
+    Returns:
+        (claimed, None) if this request should run, or (None, existing) if the
+        key is held by an earlier request. Expired keys, and in-progress claims
+        older than IDEMPOTENCY_LOCK_TIMEOUT_SECONDS (the worker died), are
+        taken over.
+    """
+    ttl = timedelta(hours=getattr(settings, 'IDEMPOTENCY_KEY_TTL_HOURS', 24))
+    lock_timeout = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT_SECONDS', 60))
+    lookup = {'owner': owner, 'scope': scope, 'key': key}
+    existing = None
+    for _ in range(3):
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    **lookup, request_hash=fingerprint, created_at=now, expires_at=now + ttl
+                ), None
+        except IntegrityError:
+            pass
+        existing = IdempotencyKey.objects.filter(**lookup).first()
+        if existing is None:
+            continue  # released in the meantime
+        stale = existing.expires_at <= now or (
+            existing.status == 'in_progress' and existing.created_at <= now - lock_timeout
+        )
+        if not stale:
+            return None, existing
+        # Only the request that still sees the stale row deletes it
+        IdempotencyKey.objects.filter(key_id=existing.key_id, created_at=existing.created_at).delete()
+    return None, existing
+
+
+def _existing_key_response(existing: IdempotencyKey, fingerprint: str) -> Response:
+    if existing.request_hash != fingerprint:
+        return Response({"error": "Idempotency key was already used with a different request"}, status=422)
+    if existing.status != 'completed':
+        return Response(
+            {"error": "A request with this idempotency key is still being processed"},
+            status=409, headers={'Retry-After': '1'}
+        )
+    return Response(existing.response_body, status=existing.response_status, headers={'Idempotent-Replayed': 'true'})
+
+
+def idempotent(scope: str, fallback_field: Optional[str] = None):
+    """
+    Make an APIView handler idempotent per (user, scope, key)
+
+    Requests without a key run as before, but still inside one atomic block.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            key = request.META.get(HEADER)
+            if not key and fallback_field:
+                key = request.data.get(fallback_field)
+            if not key:
+                with write_transaction():
+                    response = method(view, request, *args, **kwargs)
+                    if response.status_code >= 400:
+                        transaction.set_rollback(True)
+                    return response
+            key = str(key)
+            if len(key) > MAX_KEY_LENGTH:
+                return Response({"error": f"Idempotency key must be at most {MAX_KEY_LENGTH} characters"}, status=400)
+
+            fingerprint = request_fingerprint(request, kwargs)
+            claimed, existing = claim_key(request_owner(request.user), scope, key, fingerprint)
+            if claimed is None:
+                if existing is None:
+                    return Response(
+                        {"error": "A request with this idempotency key is still being processed"},
+                        status=409, headers={'Retry-After': '1'}
+                    )
+                return _existing_key_response(existing, fingerprint)
+
+            try:
+                with write_transaction():
+                    response = method(view, request, *args, **kwargs)
+                    if 200 <= response.status_code < 300:
+                        IdempotencyKey.objects.filter(key_id=claimed.key_id).update(
+                            status='completed', response_status=response.status_code, response_body=response.data
+                        )
+                        return response
+                    transaction.set_rollback(True)
+            except Exception:
+                IdempotencyKey.objects.filter(key_id=claimed.key_id).delete()
+                raise
+            IdempotencyKey.objects.filter(key_id=claimed.key_id).delete()
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,87 @@
+"""
+Invoice line resolution
+
+An invoice stores its items as a list of appointment or lab test ids. The
+detail and PDF views both need each item's doctor/slot or test/lab and, for
+the PDF, its charge; they are fetched here in bulk (one query per table)
+rather than one lookup per item.
+"""
+from typing import Dict, Iterable, List
+from hospital.models import Appointment, LabTest, LabTestCharge
+
+
+def active_lab_test_charges(test_type_ids: Iterable[int]) -> Dict[int, LabTestCharge]:
+    """
+    Active charge per lab test type id, in one query; types without one are absent
+    """
+    charges = {}
+    for charge in LabTestCharge.objects.filter(test_id__in=set(test_type_ids), is_active=True).order_by('created_at'):
+        charges[charge.test_id] = charge  # latest active charge wins
+    return charges
+
+
+def _appointment_lines(item_ids: List[int], include_amounts: bool) -> Dict[int, Dict]:
+    appointments = Appointment.objects.select_related('staff', 'slot', 'charge').in_bulk(item_ids)
+    lines = {}
+    for item_id, appointment in appointments.items():
+        line = {
+            "item_id": item_id,
+            "item_type": "appointment",
+            "doctor_name": appointment.staff.staff_name,
+            "appointment_date": appointment.created_at.strftime('%Y-%m-%d'),
+            "slot_time": appointment.slot.slot_start_time.strftime('%H:%M'),
+        }
+        if include_amounts:
+            line["amount"] = appointment.charge.charge_amount if appointment.charge else None
+        lines[item_id] = line
+    return lines
+
+
+def _lab_test_lines(item_ids: List[int], include_amounts: bool) -> Dict[int, Dict]:
+    lab_tests = LabTest.objects.select_related('test_type', 'lab').in_bulk(item_ids)
+    charges = active_lab_test_charges(test.test_type_id for test in lab_tests.values()) if include_amounts else {}
+    lines = {}
+    for item_id, lab_test in lab_tests.items():
+        line = {
+            "item_id": item_id,
+            "item_type": "lab_test",
+            "test_name": lab_test.test_type.test_name,
+            "lab_name": lab_test.lab.lab_name,
+            "test_date": lab_test.test_datetime.strftime('%Y-%m-%d'),
+        }
+        if include_amounts:
+            charge = charges.get(lab_test.test_type_id)
+            if charge is None:
+                continue  # a test with no active charge can't be billed
+            line["amount"] = charge.charge_amount
+        lines[item_id] = line
+    return lines
+
+
+def resolve_invoice_lines(invoice, include_amounts: bool = False, include_missing: bool = True) -> List[Dict]:
+    """
+    Detailed lines for an invoice's items, in invoice order
+
+    Args:
+        invoice: Invoice with invoice_type loaded (select_related avoids a query)
+        include_amounts: Add each line's charge amount; lab tests without an
+            active charge are then treated as missing
+        include_missing: Keep a {"status": "not found"} line for items that no
+            longer resolve instead of dropping them
+    """
+    item_type = invoice.invoice_type.invoice_type_name
+    item_ids = list(invoice.invoice_items or [])
+    if item_type == 'appointment':
+        lines = _appointment_lines(item_ids, include_amounts)
+    elif item_type == 'lab_test':
+        lines = _lab_test_lines(item_ids, include_amounts)
+    else:
+        return []
+
+    resolved = []
+    for item_id in item_ids:
+        if item_id in lines:
+            resolved.append(lines[item_id])
+        elif include_missing:
+            resolved.append({"item_id": item_id, "item_type": item_type, "status": "not found"})
+    return resolved
@@ -0,0 +1,156 @@
+"""
+Invoice PDF rendering and caching
+
+A PDF is rendered once per distinct invoice content: when an invoice is saved
+as paid, rendering is queued on the background pool, and the result is stored
+in ``default_storage`` under a name derived from a hash of the invoice fields
+and INVOICE_PDF_TEMPLATE_VERSION. Downloads serve the stored file (optionally
+through the web server with X-Sendfile / X-Accel-Redirect) and only render
+inline when no current PDF exists yet, e.g. for pending invoices or before the
+background render has finished.
+"""
+import hashlib
+import json
+import logging
+import threading
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse
+from django.template.loader import render_to_string
+from weasyprint import HTML
+from hospital.document_storage import storage_local_path
+from .invoice_lines import resolve_invoice_lines
+from .models import Invoice, InvoiceDocument
+
+logger = logging.getLogger(__name__)
+
+PDF_DIRECTORY = 'invoice_pdfs'
+
+# Letterhead shared by invoice PDFs and monthly statements
+HOSPITAL_DETAILS = {
+    'hospital_name': 'Your Hospital Name',
+    'hospital_address': 'Your Hospital Address',
+    'hospital_phone': 'Your Hospital Phone',
+    'hospital_email': 'your@hospital.com'
+}
+
+# Invoices with a background render in flight
+_render_lock = threading.Lock()
+_rendering = set()
+
+
+def invoice_content_hash(invoice: Invoice) -> str:
+    """
+    Hash of everything the PDF is rendered from on the invoice itself, plus the template version
+    """
+    content = {
+        'template_version': getattr(settings, 'INVOICE_PDF_TEMPLATE_VERSION', 1),
+        'invoice_number': invoice.invoice_number,
+        'invoice_datetime': invoice.invoice_datetime.isoformat() if invoice.invoice_datetime else None,
+        'invoice_type': invoice.invoice_type_id,
+        'patient': invoice.patient_id,
+        'tran': invoice.tran_id,
+        'invoice_items': invoice.invoice_items,
+        'invoice_subtotal': str(invoice.invoice_subtotal),
+        'invoice_tax': str(invoice.invoice_tax),
+        'invoice_total': str(invoice.invoice_total),
+        'invoice_unit': invoice.invoice_unit_id,
+        'invoice_status': invoice.invoice_status,
+        'invoice_remark': invoice.invoice_remark,
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def pdf_storage_name(content_hash: str) -> str:
+    return f"{PDF_DIRECTORY}/{content_hash[:2]}/{content_hash}.pdf"
+
+
+def render_invoice_pdf(invoice: Invoice) -> bytes:
+    context = {
+        'invoice': invoice,
+        'detailed_items': resolve_invoice_lines(invoice, include_amounts=True, include_missing=False),
+        **HOSPITAL_DETAILS
+    }
+    html_string = render_to_string('invoice_template.html', context)
+    return HTML(string=html_string).write_pdf()
+
+
+def current_invoice_pdf(invoice: Invoice) -> InvoiceDocument:
+    """
+    The invoice's stored PDF, rendering and storing it first if missing or stale
+    """
+    content_hash = invoice_content_hash(invoice)
+    document = InvoiceDocument.objects.filter(invoice=invoice).first()
+    if document and document.content_hash == content_hash and default_storage.exists(document.file_name):
+        return document
+
+    pdf = render_invoice_pdf(invoice)
+    name = pdf_storage_name(content_hash)
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(pdf))
+
+    previous_name = document.file_name if document else None
+    document, _ = InvoiceDocument.objects.update_or_create(
+        invoice=invoice,
+        defaults={'content_hash': content_hash, 'file_name': name, 'file_size': len(pdf)}
+    )
+    if previous_name and previous_name != name:
+        try:
+            default_storage.delete(previous_name)
+        except Exception:
+            logger.warning(f"Could not delete stale invoice PDF {previous_name}", exc_info=True)
+    return document
+
+
+def invoice_pdf_response(invoice: Invoice) -> HttpResponse:
+    """
+    Download response for the invoice's PDF
+
+    With INVOICE_PDF_SENDFILE_HEADER set, the web server sends the file:
+    'X-Sendfile' gets the local path (filesystem storage only), 'X-Accel-Redirect'
+    gets INVOICE_PDF_ACCEL_REDIRECT_PREFIX + the storage name.
+    """
+    document = current_invoice_pdf(invoice)
+    filename = f"invoice_{invoice.invoice_number}.pdf"
+    header = getattr(settings, 'INVOICE_PDF_SENDFILE_HEADER', None)
+
+    target = None
+    if header == 'X-Accel-Redirect':
+        target = getattr(settings, 'INVOICE_PDF_ACCEL_REDIRECT_PREFIX', '/protected/') + document.file_name
+    elif header == 'X-Sendfile':
+        target = storage_local_path(document.file_name)
+    if target:
+        response = HttpResponse(content_type='application/pdf')
+        response[header] = target
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    return FileResponse(
+        default_storage.open(document.file_name, 'rb'),
+        as_attachment=True, filename=filename, content_type='application/pdf'
+    )
+
+
+def enqueue_invoice_pdf(invoice_id: int):
+    """
+    Render a paid invoice's PDF in the background after commit
+    """
+    from hospital.tasks import submit_on_commit
+    submit_on_commit(_render_invoice_pdf, invoice_id)
+
+
+def _render_invoice_pdf(invoice_id: int):
+    with _render_lock:
+        if invoice_id in _rendering:
+            return
+        _rendering.add(invoice_id)
+    try:
+        invoice = Invoice.objects.select_related('invoice_type', 'patient', 'invoice_unit').filter(
+            invoice_id=invoice_id, invoice_status='paid'
+        ).first()
+        if invoice is not None:
+            current_invoice_pdf(invoice)
+    finally:
+        with _render_lock:
+            _rendering.discard(invoice_id)
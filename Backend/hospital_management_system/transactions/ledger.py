@@ -0,0 +1,204 @@
+"""
+Invoice and transaction ledgers
+
+Both ledgers share one description (LEDGERS) of their filters, row fields and
+money columns, so the paginated endpoints and the CSV exports stay in step.
+Totals come from a single GROUP BY unit query that also yields the row count;
+pages use keyset pagination (hospital.pagination) newest first; exports stream
+the whole filtered set oldest first without loading it into memory.
+"""
+import csv
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from typing import Dict, Iterator, List, Optional, Tuple
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+from hospital.pagination import keyset_page
+from .models import Invoice, Transaction
+
+LEDGERS = {
+    'invoices': {
+        'model': Invoice,
+        'datetime_field': 'invoice_datetime',
+        'ordering': ['-invoice_datetime', '-invoice_id'],
+        'export_ordering': ['invoice_datetime', 'invoice_id'],
+        'filters': {
+            'status': 'invoice_status',
+            'type': 'invoice_type__invoice_type_name',
+            'patient_id': 'patient_id',
+            'unit_id': 'invoice_unit_id',
+        },
+        'columns': [
+            ('invoice_id', 'invoice_id'),
+            ('invoice_number', 'invoice_number'),
+            ('invoice_datetime', 'invoice_datetime'),
+            ('invoice_type_name', 'invoice_type__invoice_type_name'),
+            ('patient_id', 'patient_id'),
+            ('patient_name', 'patient__patient_name'),
+            ('tran_id', 'tran_id'),
+            ('invoice_status', 'invoice_status'),
+            ('invoice_subtotal', 'invoice_subtotal'),
+            ('invoice_tax', 'invoice_tax'),
+            ('invoice_total', 'invoice_total'),
+            ('unit_symbol', 'invoice_unit__unit_symbol'),
+        ],
+        'unit_field': 'invoice_unit',
+        'money': {'subtotal': 'invoice_subtotal', 'tax': 'invoice_tax', 'total': 'invoice_total'},
+    },
+    'transactions': {
+        'model': Transaction,
+        'datetime_field': 'transaction_datetime',
+        'ordering': ['-transaction_datetime', '-transaction_id'],
+        'export_ordering': ['transaction_datetime', 'transaction_id'],
+        'filters': {
+            'status': 'transaction_status',
+            'type': 'transaction_type__transaction_type_name',
+            'patient_id': 'patient_id',
+            'payment_method_id': 'payment_method_id',
+            'unit_id': 'transaction_unit_id',
+        },
+        'columns': [
+            ('transaction_id', 'transaction_id'),
+            ('transaction_reference', 'transaction_reference'),
+            ('transaction_datetime', 'transaction_datetime'),
+            ('transaction_type_name', 'transaction_type__transaction_type_name'),
+            ('payment_method_name', 'payment_method__payment_method_name'),
+            ('patient_id', 'patient_id'),
+            ('patient_name', 'patient__patient_name'),
+            ('transaction_status', 'transaction_status'),
+            ('transaction_amount', 'transaction_amount'),
+            ('unit_symbol', 'transaction_unit__unit_symbol'),
+        ],
+        'unit_field': 'transaction_unit',
+        'money': {'amount': 'transaction_amount'},
+    },
+}
+
+INTEGER_FILTERS = ('patient_id', 'payment_method_id', 'unit_id')
+CENTS = Decimal('0.01')
+
+
+def _parse_day(value: str, name: str):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f"{name} must be YYYY-MM-DD")
+
+
+def filtered_ledger(kind: str, params, patient_id: Optional[int] = None):
+    """
+    Ledger queryset filtered by query params: from/to (inclusive dates), status,
+    type and the other LEDGERS filters; ``patient_id`` overrides the param
+
+    Raises:
+        ValueError: On a malformed filter value
+    """
+    ledger = LEDGERS[kind]
+    queryset = ledger['model'].objects.all()
+    datetime_field = ledger['datetime_field']
+
+    if params.get('from'):
+        start = timezone.make_aware(datetime.combine(_parse_day(params['from'], 'from'), time.min))
+        queryset = queryset.filter(**{f'{datetime_field}__gte': start})
+    if params.get('to'):
+        end = timezone.make_aware(datetime.combine(_parse_day(params['to'], 'to') + timedelta(days=1), time.min))
+        queryset = queryset.filter(**{f'{datetime_field}__lt': end})
+
+    for param, field in ledger['filters'].items():
+        value = params.get(param)
+        if param == 'patient_id' and patient_id is not None:
+            value = patient_id
+        if value in (None, ''):
+            continue
+        if param in INTEGER_FILTERS:
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{param} must be an integer")
+        queryset = queryset.filter(**{field: value})
+    return queryset
+
+
+def ledger_totals(kind: str, queryset) -> Tuple[int, List[Dict]]:
+    """
+    (row count, per-unit money totals) in one query
+    """
+    ledger = LEDGERS[kind]
+    unit_field = ledger['unit_field']
+    rows = (
+        queryset.order_by()
+        .values(unit_id=F(f'{unit_field}_id'), unit_symbol=F(f'{unit_field}__unit_symbol'))
+        .annotate(count=Count('pk'), **{name: Sum(field) for name, field in ledger['money'].items()})
+        .order_by('unit_id')
+    )
+    totals = []
+    count = 0
+    for row in rows:
+        count += row['count']
+        totals.append({
+            **row,
+            # SQLite drops the decimal places on SUM
+            **{name: str((row[name] or Decimal('0')).quantize(CENTS)) for name in ledger['money']},
+        })
+    return count, totals
+
+
+def _column_values(ledger: Dict) -> Tuple[List[str], Dict]:
+    """
+    Arguments for .values(): model fields as-is, everything else under its column name
+    """
+    fields = [source for name, source in ledger['columns'] if name == source]
+    renamed = {name: F(source) for name, source in ledger['columns'] if name != source}
+    return fields, renamed
+
+
+def _json_row(row: Dict) -> Dict:
+    return {name: str(value) if isinstance(value, Decimal) else value for name, value in row.items()}
+
+
+def ledger_page(kind: str, queryset, cursor: Optional[str], limit: int) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    ledger = LEDGERS[kind]
+    fields, renamed = _column_values(ledger)
+    rows = queryset.values(*fields, **renamed)
+    page, next_cursor = keyset_page(rows, ledger['ordering'], cursor, limit)
+    return [_json_row(row) for row in page], next_cursor
+
+
+class _Echo:
+    # csv.writer target that hands each formatted line straight back
+    def write(self, value):
+        return value
+
+
+def _csv_cell(value):
+    # Keep spreadsheet apps from evaluating text such as "=HYPERLINK(...)" from patient names
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@'):
+        return "'" + value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def export_rows(kind: str, queryset, rows_per_chunk: int = 500) -> Iterator[str]:
+    """
+    CSV lines for the whole filtered ledger, oldest first, a few hundred rows per chunk
+    """
+    ledger = LEDGERS[kind]
+    columns = [name for name, _ in ledger['columns']]
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    rows = queryset.order_by(*ledger['export_ordering']).values_list(
+        *[source if name == source else F(source) for name, source in ledger['columns']]
+    )
+    chunk = []
+    for row in rows.iterator(chunk_size=2000):
+        chunk.append(writer.writerow([_csv_cell(value) for value in row]))
+        if len(chunk) >= rows_per_chunk:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
@@ -0,0 +1,89 @@
+import csv
+import os
+import resource
+import tempfile
+import uuid
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from hospital.models import Patient
+from transactions.models import PaymentMethod, SettlementRun, Transaction, TransactionType, Unit
+from transactions.settlement import reconcile_settlement_file
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconcile a synthetic settlement file against synthetic transactions and report '
+        'time and peak memory (everything created is deleted afterwards)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Settlement file rows (default 1,000,000)')
+        parser.add_argument(
+            '--transactions', type=int, default=200_000,
+            help='Transactions the file matches; the other rows are unknown references (default 200,000)'
+        )
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows joined per query (default 2000)')
+
+    def handle(self, *args, **options):
+        if options['transactions'] > options['rows']:
+            raise CommandError('--transactions must not exceed --rows')
+        patient = Patient.objects.first()
+        transaction_type = TransactionType.objects.first()
+        payment_method = PaymentMethod.objects.first()
+        unit = Unit.objects.first()
+        if None in (patient, transaction_type, payment_method, unit):
+            raise CommandError('Needs at least one patient, transaction type, payment method and unit')
+
+        prefix = f"BENCH-{uuid.uuid4().hex[:8]}-"
+        amount = Decimal('100.00')
+        Transaction.objects.bulk_create(
+            (
+                Transaction(
+                    transaction_reference=f"{prefix}{i}", transaction_type=transaction_type,
+                    payment_method=payment_method, transaction_amount=amount, transaction_unit=unit,
+                    transaction_status='pending', patient=patient
+                )
+                for i in range(options['transactions'])
+            ),
+            batch_size=5000
+        )
+
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        run = None
+        try:
+            with os.fdopen(fd, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['reference', 'amount', 'currency', 'status'])
+                for i in range(options['rows']):
+                    if i < options['transactions']:
+                        # One in fifty settles for a different amount
+                        settled = amount + 1 if i % 50 == 0 else amount
+                        writer.writerow([f"{prefix}{i}", settled, unit.unit_name, 'captured'])
+                    else:
+                        writer.writerow([f"{prefix}unknown-{i}", amount, unit.unit_name, 'captured'])
+
+            rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            result = reconcile_settlement_file(path, chunk_size=options['chunk_size'])
+            rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            run = result['run']
+
+            expected_mismatches = (options['transactions'] + 49) // 50
+            if run.matched != options['transactions'] - expected_mismatches:
+                raise CommandError(f"Matched {run.matched} transactions, expected {options['transactions'] - expected_mismatches}")
+            if run.discrepancies != options['rows'] - run.matched:
+                raise CommandError(f"Recorded {run.discrepancies} discrepancies, expected {options['rows'] - run.matched}")
+        finally:
+            os.remove(path)
+            SettlementRun.objects.filter(pk=run.pk if run else None).delete()
+            # Raw delete: the per-row rollup signals would dominate the run
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {Transaction._meta.db_table} WHERE transaction_reference LIKE %s", [f"{prefix}%"]
+                )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Reconciled {run.rows:,} rows in {result['elapsed_seconds']}s "
+            f"({result['rows_per_second']:,} rows/s): {run.matched:,} matched, {run.discrepancies:,} discrepancies; "
+            f"peak RSS grew by {(rss_after - rss_before) / 1024:.1f} MB"
+        ))
@@ -0,0 +1,46 @@
+import os
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from transactions.statements import generate_statements
+
+
+class Command(BaseCommand):
+    help = 'Render monthly PDF statements for every patient with invoices or transactions in the month'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='Month as YYYY-MM (default: last month)')
+        parser.add_argument(
+            '--output',
+            help='Directory for the PDFs, or a path ending in .zip for an archive (default: statements/YYYY-MM.zip)'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Rendering processes; 0 renders in this process (default: CPU count)'
+        )
+        parser.add_argument(
+            '--patient', type=int, action='append', dest='patient_ids',
+            help='Only this patient (repeatable)'
+        )
+
+    def handle(self, *args, **options):
+        if options['month']:
+            try:
+                month_start = datetime.strptime(options['month'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError('--month must be YYYY-MM')
+        else:
+            month_start = (timezone.localdate().replace(day=1) - timedelta(days=1)).replace(day=1)
+        if options['workers'] < 0:
+            raise CommandError('--workers must be 0 or more')
+
+        output = options['output'] or os.path.join('statements', f"{month_start:%Y-%m}.zip")
+        result = generate_statements(
+            month_start.year, month_start.month, output,
+            workers=options['workers'], patient_ids=options['patient_ids']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {result['statements']} statements for {month_start:%Y-%m} to {output} "
+            f"({result['bytes'] / 1024 / 1024:.1f} MB) in {result['elapsed_seconds']}s "
+            f"({result['statements_per_minute']:,.0f} statements/min, {options['workers']} workers)"
+        ))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from machine_learning.cache import bump_data_version
+from machine_learning.rollups import refresh_rollup
+from transactions.settlement import DEFAULT_COLUMNS, reconcile_settlement_file
+
+
+class Command(BaseCommand):
+    help = 'Reconcile a payment gateway settlement CSV against the transactions table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Settlement CSV file')
+        for field, default in DEFAULT_COLUMNS.items():
+            parser.add_argument(f'--{field}-column', default=default, help=f'Header of the {field} column (default {default})')
+        parser.add_argument(
+            '--payment-method', type=int, action='append', dest='payment_method_ids',
+            help='Payment method ID the gateway settles (repeatable); its completed transactions '
+                 'missing from the file are flagged'
+        )
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows joined per query (default 2000)')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        columns = {field: options[f'{field}_column'] for field in DEFAULT_COLUMNS}
+        try:
+            result = reconcile_settlement_file(
+                options['path'], columns=columns,
+                payment_method_ids=options['payment_method_ids'], chunk_size=options['chunk_size']
+            )
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        # Status changes were bulk UPDATEs, which the rollup signals don't see
+        if result['changed_days']:
+            refresh_rollup('revenue', result['changed_days'])
+        bump_data_version()
+
+        run = result['run']
+        self.stdout.write(self.style.SUCCESS(
+            f"Run {run.run_id}: {run.rows} rows in {result['elapsed_seconds']}s "
+            f"({result['rows_per_second']:,} rows/s), {run.matched} matched, "
+            f"{run.status_changes} status changes, {run.discrepancies} discrepancies "
+            f"({result['not_in_file']} transactions missing from the file)"
+        ))
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:15
+
+from django.db import migrations, models
+
+
+def seed_sequences(apps, schema_editor):
+    # Continue numbering after the highest existing INV-YYYYMMDD-XXXX of each day
+    Invoice = apps.get_model('transactions', 'Invoice')
+    InvoiceSequence = apps.get_model('transactions', 'InvoiceSequence')
+    highest = {}
+    for number in Invoice.objects.filter(invoice_number__startswith='INV-').values_list('invoice_number', flat=True).iterator():
+        prefix, _, sequence = number.rpartition('-')
+        if sequence.isdigit():
+            highest[prefix] = max(highest.get(prefix, 0), int(sequence))
+    InvoiceSequence.objects.bulk_create(
+        [InvoiceSequence(prefix=prefix, next_value=value + 1) for prefix, value in highest.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0003_alter_transaction_patient_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceSequence',
+            fields=[
+                ('prefix', models.CharField(max_length=40, primary_key=True, serialize=False)),
+                ('next_value', models.BigIntegerField(default=1)),
+            ],
+        ),
+        migrations.RunPython(seed_sequences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0004_invoice_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceDocument',
+            fields=[
+                ('invoice', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='pdf_document', serialize=False, to='transactions.invoice')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('file_name', models.CharField(max_length=255)),
+                ('file_size', models.PositiveIntegerField()),
+                ('rendered_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hospital', '0020_device_vitals_readings'),
+        ('transactions', '0006_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['invoice_datetime', 'invoice_id'], name='invoice_datetime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['transaction_datetime', 'transaction_id'], name='transaction_datetime_idx'),
+        ),
+    ]
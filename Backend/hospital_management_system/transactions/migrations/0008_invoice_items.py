@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_invoice_items(apps, schema_editor):
+    Invoice = apps.get_model('transactions', 'Invoice')
+    InvoiceItem = apps.get_model('transactions', 'InvoiceItem')
+    batch = []
+    invoices = Invoice.objects.values_list('invoice_id', 'invoice_type__invoice_type_name', 'invoice_items')
+    for invoice_id, item_type, item_ids in invoices.iterator(chunk_size=2000):
+        for item_id in item_ids or []:
+            batch.append(InvoiceItem(invoice_id=invoice_id, item_type=item_type, item_id=int(item_id)))
+        if len(batch) >= 2000:
+            InvoiceItem.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    # Items already on two invoices keep the first row
+    InvoiceItem.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0007_ledger_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceItem',
+            fields=[
+                ('invoice_item_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('item_type', models.CharField(max_length=20)),
+                ('item_id', models.IntegerField()),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='transactions.invoice')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('item_type', 'item_id'), name='invoice_item_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_invoice_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:32
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0008_invoice_items'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SettlementRun',
+            fields=[
+                ('run_id', models.AutoField(primary_key=True, serialize=False)),
+                ('file_name', models.CharField(max_length=255)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('rows', models.PositiveIntegerField(default=0)),
+                ('matched', models.PositiveIntegerField(default=0)),
+                ('status_changes', models.PositiveIntegerField(default=0)),
+                ('discrepancies', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='settled_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='settlement_status',
+            field=models.CharField(choices=[('unreconciled', 'Unreconciled'), ('matched', 'Matched'), ('mismatched', 'Mismatched')], default='unreconciled', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='SettlementDiscrepancy',
+            fields=[
+                ('discrepancy_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('missing', 'No transaction for the reference'), ('amount', 'Amount differs'), ('currency', 'Currency differs'), ('status', 'Unknown gateway status'), ('duplicate', 'Reference repeated in the file'), ('invalid', 'Unreadable row'), ('not_in_file', 'Completed transaction missing from the file')], max_length=20)),
+                ('reference', models.CharField(blank=True, max_length=100)),
+                ('line_number', models.PositiveIntegerField(blank=True, null=True)),
+                ('expected_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('settled_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('expected_currency', models.CharField(blank=True, max_length=50)),
+                ('settled_currency', models.CharField(blank=True, max_length=50)),
+                ('gateway_status', models.CharField(blank=True, max_length=50)),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='settlement_discrepancies', to='transactions.transaction')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='discrepancy_rows', to='transactions.settlementrun')),
+            ],
+        ),
+    ]
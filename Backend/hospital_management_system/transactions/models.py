@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 
 class Unit(models.Model):
@@ -46,8 +47,21 @@ class Transaction(models.Model):
     patient = models.ForeignKey("hospital.Patient", on_delete=models.CASCADE, related_name='transactions')
     #patient = models.ForeignKey('hospital.Patient', on_delete=models.CASCADE, null=True, blank=True, related_name='transactions')
     transaction_remark = models.TextField(blank=True, null=True)
+    # Set by reconcile_settlements against the payment gateway's settlement files
+    settlement_status = models.CharField(max_length=20, choices=[
+        ('unreconciled', 'Unreconciled'),
+        ('matched', 'Matched'),
+        ('mismatched', 'Mismatched')
+    ], default='unreconciled')
+    settled_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Ledger pages, exports and monthly statements scan by date
+            models.Index(fields=['transaction_datetime', 'transaction_id'], name='transaction_datetime_idx'),
+        ]
     
     def __str__(self):
         return f"Transaction {self.transaction_reference}: {self.transaction_amount} {self.transaction_unit.unit_symbol}"
@@ -83,6 +97,11 @@ class Invoice(models.Model):
     invoice_remark = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['invoice_datetime', 'invoice_id'], name='invoice_datetime_idx'),
+        ]
     
     def __str__(self):
         return f"Invoice #{self.invoice_number} - {self.invoice_total} {self.invoice_unit.unit_symbol}"
@@ -91,17 +110,153 @@ class Invoice(models.Model):
         # Generate invoice number if not provided
         if not self.invoice_number:
             # Format: INV-YYYYMMDD-XXXX where XXXX is a sequential number
-            today = timezone.now().strftime('%Y%m%d')
-            last_invoice = Invoice.objects.filter(invoice_number__startswith=f'INV-{today}').order_by('invoice_number').last()
-            
-            if last_invoice:
-                # Extract the last sequence number and increment
-                last_seq = int(last_invoice.invoice_number.split('-')[-1])
-                new_seq = last_seq + 1
-            else:
-                new_seq = 1
-                
-            self.invoice_number = f'INV-{today}-{new_seq:04d}'
-            
-        super().save(*args, **kwargs)
+            from .numbering import next_invoice_number
+            self.invoice_number = next_invoice_number()
+
+        adding = self._state.adding
+        update_fields = kwargs.get('update_fields')
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding or update_fields is None or 'invoice_items' in update_fields:
+                self.sync_items(created=adding)
+
+        # Render the PDF in the background so downloads don't wait on WeasyPrint
+        if self.invoice_status == 'paid':
+            from .invoice_pdf import enqueue_invoice_pdf
+            enqueue_invoice_pdf(self.invoice_id)
+
+    def sync_items(self, created: bool = False):
+        """
+        Mirror invoice_items into InvoiceItem rows, the indexed "already invoiced?" lookup
+        """
+        item_type = self.invoice_type.invoice_type_name
+        wanted = {int(item_id) for item_id in self.invoice_items or []}
+        existing = set()
+        if not created:
+            self.items.exclude(item_type=item_type, item_id__in=wanted).delete()
+            existing = set(self.items.values_list('item_id', flat=True))
+        InvoiceItem.objects.bulk_create([
+            InvoiceItem(invoice=self, item_type=item_type, item_id=item_id) for item_id in sorted(wanted - existing)
+        ])
+
+
+class InvoiceItem(models.Model):
+    """
+    One row per item on an invoice, kept in step with Invoice.invoice_items by Invoice.save
+
+    The unique constraint makes "is this appointment / lab test already
+    invoiced?" an index lookup and stops an item being invoiced twice.
+    """
+    invoice_item_id = models.BigAutoField(primary_key=True)
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='items')
+    item_type = models.CharField(max_length=20)  # invoice type name: appointment or lab_test
+    item_id = models.IntegerField()  # appointment_id or lab_test_id
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['item_type', 'item_id'], name='invoice_item_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.item_type} {self.item_id} on invoice {self.invoice_id}"
+
+class InvoiceSequence(models.Model):
+    """
+    Counter behind invoice numbers, one row per prefix (see numbering.py)
+    """
+    prefix = models.CharField(max_length=40, primary_key=True)  # e.g., INV-20250417
+    next_value = models.BigIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.prefix}: next {self.next_value}"
+
+
 
+class InvoiceDocument(models.Model):
+    """
+    Rendered PDF of an invoice (see invoice_pdf.py)
+
+    The file is stored under a name derived from content_hash, which covers the
+    invoice's own fields and the template version, so a stale PDF is detected
+    without rendering anything.
+    """
+    invoice = models.OneToOneField(Invoice, on_delete=models.CASCADE, primary_key=True, related_name='pdf_document')
+    content_hash = models.CharField(max_length=64)
+    file_name = models.CharField(max_length=255)  # storage name
+    file_size = models.PositiveIntegerField()
+    rendered_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"PDF for invoice {self.invoice_id} ({self.content_hash[:12]})"
+
+
+class IdempotencyKey(models.Model):
+    """
+    A client-supplied key and the response it produced (see idempotency.py)
+    """
+    key_id = models.BigAutoField(primary_key=True)
+    owner = models.CharField(max_length=64)  # e.g., patient:12
+    scope = models.CharField(max_length=100)  # endpoint the key was used on
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=[
+        ('in_progress', 'In progress'),
+        ('completed', 'Completed')
+    ], default='in_progress')
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'scope', 'key'], name='idempotency_key_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.key} ({self.status})"
+
+
+class SettlementRun(models.Model):
+    """
+    One reconciliation of a gateway settlement file (see settlement.py)
+    """
+    run_id = models.AutoField(primary_key=True)
+    file_name = models.CharField(max_length=255)
+    started_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    rows = models.PositiveIntegerField(default=0)
+    matched = models.PositiveIntegerField(default=0)
+    status_changes = models.PositiveIntegerField(default=0)  # transactions whose status the file changed
+    discrepancies = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Settlement run {self.run_id} ({self.file_name})"
+
+
+class SettlementDiscrepancy(models.Model):
+    """
+    A settlement file row, or an expected transaction, that didn't reconcile
+    """
+    discrepancy_id = models.BigAutoField(primary_key=True)
+    run = models.ForeignKey(SettlementRun, on_delete=models.CASCADE, related_name='discrepancy_rows')
+    kind = models.CharField(max_length=20, choices=[
+        ('missing', 'No transaction for the reference'),
+        ('amount', 'Amount differs'),
+        ('currency', 'Currency differs'),
+        ('status', 'Unknown gateway status'),
+        ('duplicate', 'Reference repeated in the file'),
+        ('invalid', 'Unreadable row'),
+        ('not_in_file', 'Completed transaction missing from the file')
+    ])
+    transaction = models.ForeignKey(Transaction, on_delete=models.SET_NULL, null=True, blank=True, related_name='settlement_discrepancies')
+    reference = models.CharField(max_length=100, blank=True)
+    line_number = models.PositiveIntegerField(null=True, blank=True)  # in the settlement file
+    expected_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    settled_amount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    expected_currency = models.CharField(max_length=50, blank=True)
+    settled_currency = models.CharField(max_length=50, blank=True)
+    gateway_status = models.CharField(max_length=50, blank=True)
+
+    def __str__(self):
+        return f"{self.kind} {self.reference} (run {self.run_id})"
@@ -0,0 +1,275 @@
+"""
+Payment gateway settlement reconciliation
+
+Payment views record transactions as completed on the client's word; the
+gateway's settlement file is the source of truth. The file is read as a stream
+and handled a chunk of rows at a time: each chunk's references are looked up
+in one query through the unique transaction_reference index and joined to the
+rows in a dict, so memory is bounded by the chunk size however long the file
+is. Matched transactions take the gateway's status in a few bulk UPDATEs per
+chunk; rows that don't reconcile are stored as SettlementDiscrepancy rows.
+
+Duplicates are caught across chunks without remembering the whole file: a
+transaction already matched by this run has settled_at equal to the run's
+start. Re-running a file is safe.
+"""
+import csv
+import os
+import time
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import SettlementDiscrepancy, SettlementRun, Transaction
+
+# Gateway row status -> Transaction.transaction_status
+GATEWAY_STATUSES = {
+    'success': 'completed',
+    'succeeded': 'completed',
+    'captured': 'completed',
+    'settled': 'completed',
+    'completed': 'completed',
+    'failed': 'failed',
+    'declined': 'failed',
+    'refunded': 'refunded',
+}
+
+MAX_AMOUNT = Decimal('1e10')  # SettlementDiscrepancy.settled_amount holds 12 digits, 2 decimal
+
+DEFAULT_COLUMNS = {'reference': 'reference', 'amount': 'amount', 'currency': 'currency', 'status': 'status'}
+
+# (line number, reference, amount, currency, gateway status)
+SettlementRow = Tuple[int, str, Optional[Decimal], str, str]
+
+DISCREPANCY_FIELDS = (
+    'run', 'kind', 'transaction', 'reference', 'line_number', 'expected_amount',
+    'settled_amount', 'expected_currency', 'settled_currency', 'gateway_status',
+)
+
+
+def read_settlement_rows(path: str, columns: Optional[Dict[str, str]] = None) -> Iterator[SettlementRow]:
+    """
+    Stream the rows of a settlement CSV; an unparseable amount comes back as None
+
+    Raises:
+        ValueError: If the header lacks one of the columns
+    """
+    columns = {**DEFAULT_COLUMNS, **(columns or {})}
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = [name.strip().lower() for name in next(reader, [])]
+        try:
+            positions = [header.index(columns[field].lower()) for field in ('reference', 'amount', 'currency', 'status')]
+        except ValueError:
+            raise ValueError(f"Settlement file must have the columns {sorted(columns.values())}")
+        ref_at, amount_at, currency_at, status_at = positions
+        width = max(positions) + 1
+        for line_number, record in enumerate(reader, start=2):
+            if not record:
+                continue
+            if len(record) < width:
+                yield line_number, record[ref_at].strip() if len(record) > ref_at else '', None, '', ''
+                continue
+            try:
+                amount = Decimal(record[amount_at].strip().replace(',', ''))
+            except InvalidOperation:
+                amount = None
+            if amount is not None and (not amount.is_finite() or abs(amount) >= MAX_AMOUNT):
+                amount = None
+            yield (
+                line_number, record[ref_at].strip(), amount,
+                record[currency_at].strip().upper(), record[status_at].strip().lower()
+            )
+
+
+def _chunks(rows: Iterable[SettlementRow], size: int) -> Iterator[List[SettlementRow]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _insert_discrepancies(rows: List[Tuple]):
+    # A bad file can produce a discrepancy per row; building model instances
+    # for bulk_create cost several times the insert itself
+    if not rows:
+        return
+    meta = SettlementDiscrepancy._meta
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(meta.get_field(name).column) for name in DISCREPANCY_FIELDS)
+    placeholders = ', '.join(['%s'] * len(DISCREPANCY_FIELDS))
+    with connection.cursor() as cursor:
+        cursor.executemany(f"INSERT INTO {quote(meta.db_table)} ({columns}) VALUES ({placeholders})", rows)
+
+
+class _Reconciler:
+    def __init__(self, run: SettlementRun):
+        self.run = run
+        self.changed_days: Set[date] = set()  # revenue rollup days whose completed totals moved
+        self.first_matched = None
+        self.last_matched = None
+
+    def _discrepancy(self, kind, row=None, found=None) -> Tuple:
+        """
+        A SettlementDiscrepancy row as a tuple in DISCREPANCY_FIELDS order
+        """
+        line_number = reference = settled_amount = None
+        settled_currency = gateway_status = expected_currency = ''
+        transaction_id = expected_amount = None
+        if row is not None:
+            line_number, reference, settled_amount, settled_currency, gateway_status = row
+        if found is not None:
+            transaction_id = found['transaction_id']
+            reference = found['transaction_reference']
+            expected_amount = found['transaction_amount']
+            expected_currency = found['currency'] or ''
+        return (
+            self.run.run_id, kind, transaction_id, (reference or '')[:100], line_number, expected_amount,
+            settled_amount, expected_currency, settled_currency[:50], gateway_status[:50],
+        )
+
+    def reconcile_chunk(self, rows: List[SettlementRow]):
+        run = self.run
+        references = {row[1] for row in rows if row[1]}
+        transactions = {
+            found['transaction_reference']: found
+            for found in Transaction.objects.filter(transaction_reference__in=references).values(
+                'transaction_id', 'transaction_reference', 'transaction_amount', 'transaction_status',
+                'transaction_datetime', 'settled_at', currency=F('transaction_unit__unit_name'),
+            )
+        } if references else {}
+
+        discrepancies = []
+        matched = defaultdict(list)  # new transaction_status -> transaction ids
+        mismatched = []
+        seen = set()
+        for row in rows:
+            line_number, reference, amount, currency, status = row
+            found = transactions.get(reference)
+            if not reference or amount is None:
+                discrepancies.append(self._discrepancy('invalid', row))
+                continue
+            if found is None:
+                discrepancies.append(self._discrepancy('missing', row))
+                continue
+            if reference in seen or found['settled_at'] == run.started_at:
+                discrepancies.append(self._discrepancy('duplicate', row, found))
+                continue
+            seen.add(reference)
+
+            new_status = GATEWAY_STATUSES.get(status)
+            if new_status is None:
+                kind = 'status'
+            elif amount != found['transaction_amount']:
+                kind = 'amount'
+            elif currency != (found['currency'] or '').upper():
+                kind = 'currency'
+            else:
+                kind = None
+            if kind is not None:
+                discrepancies.append(self._discrepancy(kind, row, found))
+                mismatched.append(found['transaction_id'])
+                continue
+
+            matched[new_status].append(found['transaction_id'])
+            if new_status != found['transaction_status']:
+                run.status_changes += 1
+                if 'completed' in (new_status, found['transaction_status']):
+                    self.changed_days.add(timezone.localdate(found['transaction_datetime']))
+            when = found['transaction_datetime']
+            self.first_matched = when if self.first_matched is None else min(self.first_matched, when)
+            self.last_matched = when if self.last_matched is None else max(self.last_matched, when)
+
+        now = timezone.now()
+        with transaction.atomic():
+            for new_status, ids in matched.items():
+                Transaction.objects.filter(transaction_id__in=ids).update(
+                    transaction_status=new_status, settlement_status='matched',
+                    settled_at=run.started_at, updated_at=now
+                )
+            if mismatched:
+                Transaction.objects.filter(transaction_id__in=mismatched).update(
+                    settlement_status='mismatched', settled_at=run.started_at, updated_at=now
+                )
+            _insert_discrepancies(discrepancies)
+
+        run.rows += len(rows)
+        run.matched += sum(len(ids) for ids in matched.values())
+        run.discrepancies += len(discrepancies)
+
+    def flag_not_in_file(self, payment_method_ids: Iterable[int]) -> int:
+        """
+        Completed transactions of the gateway's payment methods, dated within the
+        file's matched range, that the file never mentioned
+        """
+        if self.first_matched is None:
+            return 0
+        missing = Transaction.objects.filter(
+            payment_method_id__in=payment_method_ids,
+            transaction_status='completed',
+            settlement_status='unreconciled',
+            transaction_datetime__gte=self.first_matched,
+            transaction_datetime__lte=self.last_matched,
+        ).values(
+            'transaction_id', 'transaction_reference', 'transaction_amount', currency=F('transaction_unit__unit_name')
+        )
+        flagged = 0
+        for batch in _chunks(missing.iterator(chunk_size=2000), 2000):
+            _insert_discrepancies([self._discrepancy('not_in_file', found=found) for found in batch])
+            flagged += len(batch)
+        self.run.discrepancies += flagged
+        return flagged
+
+
+def reconcile_settlement_file(
+    path: str,
+    columns: Optional[Dict[str, str]] = None,
+    payment_method_ids: Optional[List[int]] = None,
+    chunk_size: int = 2000,
+) -> Dict:
+    """
+    Reconcile one settlement file against the transactions table
+
+    Args:
+        path: Settlement CSV with reference, amount, currency and status columns
+        columns: Header names for those columns when the gateway uses others
+        payment_method_ids: Payment methods the gateway settles; when given,
+            their completed transactions missing from the file are flagged
+        chunk_size: Rows joined per query
+
+    Returns:
+        Summary with the run, counts and the days whose revenue changed
+
+    Raises:
+        ValueError: If the file lacks a required column
+    """
+    started = time.perf_counter()
+    rows = read_settlement_rows(path, columns)
+    first = next(rows, None)  # surfaces a bad header before a run is recorded
+    run = SettlementRun.objects.create(file_name=os.path.basename(path)[:255])
+    reconciler = _Reconciler(run)
+    if first is not None:
+        def all_rows():
+            yield first
+            yield from rows
+        for chunk in _chunks(all_rows(), chunk_size):
+            reconciler.reconcile_chunk(chunk)
+    not_in_file = reconciler.flag_not_in_file(payment_method_ids) if payment_method_ids else 0
+
+    run.finished_at = timezone.now()
+    run.save()
+    elapsed = time.perf_counter() - started
+    return {
+        'run': run,
+        'not_in_file': not_in_file,
+        'changed_days': sorted(reconciler.changed_days),
+        'elapsed_seconds': round(elapsed, 2),
+        'rows_per_second': round(run.rows / elapsed) if elapsed else 0,
+    }
@@ -0,0 +1,44 @@
+"""
+Statement PDF rendering, run inside the statement worker processes
+
+Kept free of model imports so a freshly spawned worker can import it before
+Django is set up. Each process loads the template, parses the stylesheet and
+builds the font configuration once, then reuses them for every statement.
+"""
+from typing import Dict, Tuple
+from django.template.loader import get_template
+from weasyprint import CSS, HTML
+from weasyprint.text.fonts import FontConfiguration
+
+TEMPLATE_NAME = 'transactions/monthly_statement.html'
+STYLESHEET_NAME = 'transactions/monthly_statement.css'
+
+_template = None
+_stylesheet = None
+_font_config = None
+
+
+def init_renderer():
+    global _template, _stylesheet, _font_config
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()  # spawned workers start without Django configured
+    _template = get_template(TEMPLATE_NAME)
+    _font_config = FontConfiguration()
+    _stylesheet = CSS(filename=get_template(STYLESHEET_NAME).origin.name, font_config=_font_config)
+
+
+def statement_filename(statement: Dict) -> str:
+    return f"statement_{statement['period'][:7]}_patient_{statement['patient_id']}.pdf"
+
+
+def render_statement(statement: Dict) -> Tuple[str, bytes]:
+    """
+    Render one statement (as built by statements.iter_statements) to (file name, PDF bytes)
+    """
+    if _template is None:
+        init_renderer()
+    html = _template.render({'statement': statement, **statement['letterhead']})
+    pdf = HTML(string=html).write_pdf(stylesheets=[_stylesheet], font_config=_font_config)
+    return statement_filename(statement), pdf
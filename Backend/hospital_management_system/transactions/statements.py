@@ -0,0 +1,184 @@
+"""
+Monthly patient statements
+
+A month's invoices and transactions are each read in one query ordered by
+patient and merged into one statement per patient with any activity, so
+memory stays bounded by one patient's rows plus the statements in flight.
+Statements are rendered to PDF on a process pool (see statement_rendering);
+the parent process does all database reads and file writes.
+"""
+import os
+import time
+import zipfile
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import date, datetime, time as day_time
+from decimal import Decimal
+from itertools import groupby
+from typing import Dict, Iterator, List, Optional, Tuple
+from django.utils import timezone
+from .invoice_pdf import HOSPITAL_DETAILS
+from .models import Invoice, Transaction
+from .statement_rendering import init_renderer, render_statement
+
+INVOICE_FIELDS = (
+    'patient_id', 'invoice_number', 'invoice_datetime', 'invoice_type__invoice_type_name', 'invoice_status',
+    'invoice_subtotal', 'invoice_tax', 'invoice_total', 'invoice_unit__unit_symbol',
+)
+TRANSACTION_FIELDS = (
+    'patient_id', 'transaction_reference', 'transaction_datetime', 'transaction_type__transaction_type_name',
+    'payment_method__payment_method_name', 'transaction_status', 'transaction_amount',
+    'transaction_unit__unit_symbol',
+)
+PATIENT_FIELDS = ('patient__patient_name', 'patient__patient_email')
+
+
+def month_bounds(year: int, month: int) -> Tuple[datetime, datetime]:
+    start = timezone.make_aware(datetime.combine(date(year, month, 1), day_time.min))
+    next_month = date(year + month // 12, month % 12 + 1, 1)
+    return start, timezone.make_aware(datetime.combine(next_month, day_time.min))
+
+
+def _rows_by_patient(queryset, datetime_field: str, fields, chunk_size: int) -> Iterator[Tuple[int, List[Dict]]]:
+    rows = queryset.order_by('patient_id', datetime_field, 'pk').values(*fields, *PATIENT_FIELDS)
+    return groupby(rows.iterator(chunk_size=chunk_size), key=lambda row: row['patient_id'])
+
+
+def _statement(patient_id: int, invoices: List[Dict], transactions: List[Dict], period: date) -> Dict:
+    totals = defaultdict(lambda: {'invoiced': Decimal('0.00'), 'paid': Decimal('0.00'), 'refunded': Decimal('0.00')})
+    for invoice in invoices:
+        if invoice['invoice_status'] != 'cancelled':
+            totals[invoice['invoice_unit__unit_symbol']]['invoiced'] += invoice['invoice_total']
+    for transaction in transactions:
+        if transaction['transaction_status'] == 'completed':
+            totals[transaction['transaction_unit__unit_symbol']]['paid'] += transaction['transaction_amount']
+        elif transaction['transaction_status'] == 'refunded':
+            totals[transaction['transaction_unit__unit_symbol']]['refunded'] += transaction['transaction_amount']
+    patient = (invoices or transactions)[0]
+    return {
+        'patient_id': patient_id,
+        'patient_name': patient['patient__patient_name'],
+        'patient_email': patient['patient__patient_email'],
+        'period': period.isoformat(),
+        'period_label': period.strftime('%B %Y'),
+        'invoices': invoices,
+        'transactions': transactions,
+        'totals': [{'unit_symbol': symbol, **amounts} for symbol, amounts in sorted(totals.items())],
+        'letterhead': HOSPITAL_DETAILS,
+    }
+
+
+def iter_statements(year: int, month: int, chunk_size: int = 2000, patient_ids=None) -> Iterator[Dict]:
+    """
+    One statement dict per patient with invoices or transactions in the month, by patient id
+
+    Two queries in total: both streams are ordered by patient and merge-joined.
+    ``patient_ids`` limits both queries to those patients.
+    """
+    start, end = month_bounds(year, month)
+    period = date(year, month, 1)
+    invoices = Invoice.objects.filter(invoice_datetime__gte=start, invoice_datetime__lt=end)
+    transactions = Transaction.objects.filter(transaction_datetime__gte=start, transaction_datetime__lt=end)
+    if patient_ids is not None:
+        patient_ids = list(patient_ids)
+        invoices = invoices.filter(patient_id__in=patient_ids)
+        transactions = transactions.filter(patient_id__in=patient_ids)
+    invoices = _rows_by_patient(invoices, 'invoice_datetime', INVOICE_FIELDS, chunk_size)
+    transactions = _rows_by_patient(transactions, 'transaction_datetime', TRANSACTION_FIELDS, chunk_size)
+
+    def advance(groups):
+        group = next(groups, None)
+        return (group[0], list(group[1])) if group else None
+
+    invoice_group, transaction_group = advance(invoices), advance(transactions)
+    while invoice_group or transaction_group:
+        patient_id = min(group[0] for group in (invoice_group, transaction_group) if group)
+        patient_invoices = patient_transactions = []
+        if invoice_group and invoice_group[0] == patient_id:
+            patient_invoices = invoice_group[1]
+            invoice_group = advance(invoices)
+        if transaction_group and transaction_group[0] == patient_id:
+            patient_transactions = transaction_group[1]
+            transaction_group = advance(transactions)
+        yield _statement(patient_id, patient_invoices, patient_transactions, period)
+
+
+class StatementWriter:
+    """
+    Writes PDFs into a directory, or into a zip archive when the path ends in .zip
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.archive = None
+        if path.lower().endswith('.zip'):
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # PDFs are already compressed
+            self.archive = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED)
+        else:
+            os.makedirs(path, exist_ok=True)
+
+    def write(self, name: str, pdf: bytes):
+        if self.archive is not None:
+            self.archive.writestr(name, pdf)
+        else:
+            with open(os.path.join(self.path, name), 'wb') as handle:
+                handle.write(pdf)
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+
+
+def generate_statements(year: int, month: int, output: str, workers: Optional[int] = None,
+                        patient_ids=None) -> Dict:
+    """
+    Render every statement for the month into ``output`` (directory or .zip)
+
+    Args:
+        workers: Rendering processes; 0 renders in this process
+        patient_ids: Limit to these patients (re-runs for a few statements)
+
+    Returns:
+        Dict with statements, bytes, elapsed_seconds and statements_per_minute
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    statements = iter_statements(year, month, patient_ids=patient_ids)
+
+    writer = StatementWriter(output)
+    written = {'statements': 0, 'bytes': 0}
+
+    def write(name: str, pdf: bytes):
+        writer.write(name, pdf)
+        written['statements'] += 1
+        written['bytes'] += len(pdf)
+
+    started = time.perf_counter()
+    try:
+        if workers == 0:
+            for statement in statements:
+                write(*render_statement(statement))
+        else:
+            # Spawned workers don't inherit this process's database connections
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_renderer) as pool:
+                pending = set()
+                for statement in statements:
+                    pending.add(pool.submit(render_statement, statement))
+                    if len(pending) >= workers * 4:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            write(*future.result())
+                for future in pending:
+                    write(*future.result())
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    return {
+        **written,
+        'elapsed_seconds': round(elapsed, 2),
+        'statements_per_minute': round(written['statements'] / elapsed * 60, 1) if elapsed else 0.0,
+    }
@@ -1,3 +1,234 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from datetime import time, timedelta
+from decimal import Decimal
+from unittest import mock
+from django.db import IntegrityError, connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from hospital.functional_views import BookAppointmentWithPaymentView
+from hospital.models import (Appointment, AppointmentCharge, Lab, LabTest, LabTestCategory, LabTestCharge, LabTestType,
+                             LabType, Patient, Role, Shift, Slot, Staff, TargetOrgan)
+from .invoice_lines import resolve_invoice_lines
+from .models import IdempotencyKey, Invoice, InvoiceType, PaymentMethod, Transaction, TransactionType, Unit
 
-# Create your tests here.
+
+class InvoiceNumberingConcurrencyTests(TransactionTestCase):
+    """
+    Invoices saved from parallel threads draw distinct, gapless numbers
+    """
+    invoices = 1000
+    threads = 16
+
+    def setUp(self):
+        self.patient = Patient.objects.create(patient_name='Patient', patient_email='p@example.com', patient_mobile='1')
+        self.invoice_type = InvoiceType.objects.create(invoice_type_name='appointment')
+        self.unit = Unit.objects.create(unit_name='INR', unit_symbol='₹')
+
+    def create_invoice(self, _):
+        try:
+            invoice = Invoice.objects.create(
+                patient=self.patient, invoice_type=self.invoice_type, invoice_unit=self.unit,
+                invoice_items=[], invoice_subtotal=Decimal('100.00'), invoice_tax=Decimal('0.00'),
+                invoice_total=Decimal('100.00'),
+            )
+            return invoice.invoice_number
+        except IntegrityError as e:
+            return e
+        finally:
+            connection.close()
+
+    def test_parallel_invoices_get_distinct_gapless_numbers(self):
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            results = list(pool.map(self.create_invoice, range(self.invoices)))
+
+        errors = [result for result in results if isinstance(result, IntegrityError)]
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(results)), self.invoices)
+        self.assertEqual(Invoice.objects.count(), self.invoices)
+
+        prefixes = {number.rsplit('-', 1)[0] for number in results}
+        self.assertEqual(len(prefixes), 1)
+        sequence = sorted(int(number.rsplit('-', 1)[1]) for number in results)
+        self.assertEqual(sequence, list(range(1, self.invoices + 1)))
+
+
+@mock.patch('transactions.invoice_pdf.enqueue_invoice_pdf')
+class PaymentRetryStormTests(TransactionTestCase):
+    """
+    Concurrent retries of one booking with payment execute it exactly once
+    """
+    retries = 40
+    threads = 16
+
+    def setUp(self):
+        today = timezone.localdate()
+        role = Role.objects.create(role_name='doctor', role_permissions={'is_doctor': True})
+        self.doctor = Staff.objects.create(
+            staff_id='DOC1', staff_name='Doctor', role=role, created_at=today,
+            staff_email='doc@example.com', staff_mobile='1'
+        )
+        self.patient = Patient.objects.create(patient_name='Patient', patient_email='p@example.com', patient_mobile='1')
+        shift = Shift.objects.create(shift_name='Morning', start_time=time(9), end_time=time(13))
+        self.slot = Slot.objects.create(slot_start_time=time(9), slot_duration=30, shift=shift)
+        unit = Unit.objects.create(unit_name='INR', unit_symbol='₹')
+        AppointmentCharge.objects.create(doctor=self.doctor, charge_amount=Decimal('500.00'), charge_unit=unit)
+        TransactionType.objects.create(transaction_type_name='payment')
+        InvoiceType.objects.create(invoice_type_name='appointment')
+        self.payment_method = PaymentMethod.objects.create(payment_method_name='upi')
+        self.date = (today + timedelta(days=3)).isoformat()
+
+    def body(self, reference, **overrides):
+        return {
+            'date': self.date,
+            'staff_id': self.doctor.staff_id,
+            'slot_id': self.slot.slot_id,
+            'reason': 'Checkup',
+            'payment_method_id': self.payment_method.payment_method_id,
+            'transaction_reference': reference,
+            **overrides,
+        }
+
+    def post(self, body, key):
+        request = APIRequestFactory().post('/', body, format='json', HTTP_IDEMPOTENCY_KEY=key)
+        force_authenticate(request, user=self.patient)
+        response = BookAppointmentWithPaymentView.as_view()(request)
+        response.render()
+        return response
+
+    def storm(self, body, key):
+        def attempt(_):
+            try:
+                return self.post(body, key)
+            finally:
+                connection.close()
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            return list(pool.map(attempt, range(self.retries)))
+
+    def test_concurrent_retries_book_once(self, enqueue_pdf):
+        body = self.body('PAY-STORM-1')
+        first = self.storm(body, 'PAY-STORM-1')
+        second = self.storm(body, 'PAY-STORM-1')  # every retry after completion is a replay
+
+        executed = [r for r in first + second if r.status_code == 201 and r.get('Idempotent-Replayed') != 'true']
+        self.assertEqual(len(executed), 1)
+        original = executed[0].content
+        for response in first:
+            if response is executed[0]:
+                continue
+            if response.get('Idempotent-Replayed') == 'true':
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(response.content, original)
+            else:
+                self.assertEqual(response.status_code, 409)
+        for response in second:
+            self.assertEqual(response.get('Idempotent-Replayed'), 'true')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.content, original)
+
+        self.assertEqual(Transaction.objects.filter(transaction_reference='PAY-STORM-1').count(), 1)
+        self.assertEqual(Appointment.objects.count(), 1)
+        self.assertEqual(Invoice.objects.count(), 1)
+
+    def test_key_reused_with_a_different_body_is_rejected(self, enqueue_pdf):
+        self.assertEqual(self.post(self.body('PAY-422'), 'PAY-422').status_code, 201)
+        response = self.post(self.body('PAY-422', reason='Something else'), 'PAY-422')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_key_is_released_after_a_client_error(self, enqueue_pdf):
+        response = self.post(self.body('PAY-400', payment_method_id=999999), 'PAY-400')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.filter(key='PAY-400').exists())
+        self.assertFalse(Transaction.objects.exists())
+
+        # The corrected request may reuse the key
+        response = self.post(self.body('PAY-400'), 'PAY-400')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotEqual(response.get('Idempotent-Replayed'), 'true')
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_booking_without_an_invoice_type_reports_it(self, enqueue_pdf):
+        InvoiceType.objects.all().delete()
+        response = self.post(self.body('PAY-NO-TYPE'), 'PAY-NO-TYPE')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['error'], "Invoice type 'appointment' is not configured")
+        self.assertFalse(Invoice.objects.exists())
+
+
+class InvoiceLineResolutionTests(TestCase):
+    """
+    Invoice lines are resolved with one query per table, whatever the item count
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.localdate()
+        role = Role.objects.create(role_name='doctor', role_permissions={'is_doctor': True})
+        doctor = Staff.objects.create(
+            staff_id='DOC1', staff_name='Doctor', role=role, created_at=today,
+            staff_email='doc@example.com', staff_mobile='1'
+        )
+        patient = Patient.objects.create(patient_name='Patient', patient_email='p@example.com', patient_mobile='1')
+        shift = Shift.objects.create(shift_name='Morning', start_time=time(9), end_time=time(13))
+        slot = Slot.objects.create(slot_start_time=time(9, 30), slot_duration=30, shift=shift)
+        unit = Unit.objects.create(unit_name='INR', unit_symbol='₹')
+        charge = AppointmentCharge.objects.create(doctor=doctor, charge_amount=Decimal('500.00'), charge_unit=unit)
+        cls.appointments = [
+            Appointment.objects.create(patient=patient, staff=doctor, slot=slot, charge=charge, appointment_date=today),
+            Appointment.objects.create(patient=patient, staff=doctor, slot=slot, appointment_date=today),
+        ]
+
+        lab = Lab.objects.create(lab_name='Central Lab', lab_type=LabType.objects.create(
+            lab_type_name='Pathology', supported_tests=[]))
+        category = LabTestCategory.objects.create(test_category_name='Blood')
+        organ = TargetOrgan.objects.create(target_organ_name='Blood')
+        cls.test_types = [
+            LabTestType.objects.create(test_name=name, test_category=category, test_target_organ=organ)
+            for name in ('CBC', 'Lipid panel', 'HbA1c')
+        ]
+        cbc, lipid, hba1c = cls.test_types
+        LabTestCharge.objects.create(test=cbc, charge_amount=Decimal('100.00'), charge_unit=unit)
+        LabTestCharge.objects.create(test=cbc, charge_amount=Decimal('150.00'), charge_unit=unit)  # latest wins
+        LabTestCharge.objects.create(test=lipid, charge_amount=Decimal('300.00'), charge_unit=unit, is_active=False)
+        LabTestCharge.objects.create(test=hba1c, charge_amount=Decimal('200.00'), charge_unit=unit)
+        cls.lab_tests = [
+            LabTest.objects.create(
+                lab=lab, test_datetime=timezone.now(), test_type=cls.test_types[index % 3],
+                appointment=cls.appointments[0]
+            )
+            for index in range(30)
+        ]
+        cls.lab_invoice_type = InvoiceType.objects.create(invoice_type_name='lab_test')
+        cls.appointment_invoice_type = InvoiceType.objects.create(invoice_type_name='appointment')
+
+    def lab_invoice(self):
+        items = [test.lab_test_id for test in self.lab_tests] + [999999]
+        return Invoice(invoice_type=self.lab_invoice_type, invoice_items=items)
+
+    def test_lab_invoice_lines_in_one_query(self):
+        with self.assertNumQueries(1):
+            lines = resolve_invoice_lines(self.lab_invoice())
+        self.assertEqual([line['item_id'] for line in lines], self.lab_invoice().invoice_items)
+        self.assertEqual(lines[0]['test_name'], 'CBC')
+        self.assertEqual(lines[0]['lab_name'], 'Central Lab')
+        self.assertEqual(lines[-1], {'item_id': 999999, 'item_type': 'lab_test', 'status': 'not found'})
+
+    def test_lab_invoice_amounts_use_the_latest_active_charge(self):
+        with self.assertNumQueries(2):
+            lines = resolve_invoice_lines(self.lab_invoice(), include_amounts=True, include_missing=False)
+        # Lipid panels have no active charge and the unknown item is dropped
+        self.assertEqual(len(lines), 20)
+        amounts = {line['test_name']: line['amount'] for line in lines}
+        self.assertEqual(amounts, {'CBC': Decimal('150.00'), 'HbA1c': Decimal('200.00')})
+
+    def test_appointment_invoice_lines(self):
+        invoice = Invoice(
+            invoice_type=self.appointment_invoice_type,
+            invoice_items=[appointment.appointment_id for appointment in self.appointments]
+        )
+        with self.assertNumQueries(1):
+            lines = resolve_invoice_lines(invoice, include_amounts=True)
+        self.assertEqual([line['doctor_name'] for line in lines], ['Doctor', 'Doctor'])
+        self.assertEqual(lines[0]['slot_time'], '09:30')
+        self.assertEqual([line['amount'] for line in lines], [Decimal('500.00'), None])
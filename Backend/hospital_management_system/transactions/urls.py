@@ -11,4 +11,10 @@ urlpatterns = [
     path('appointments/<int:appointment_id>/generate-invoice/', views.GenerateAppointmentInvoiceView.as_view(), name='generate-appointment-invoice'),
     path('lab-tests/<int:lab_test_id>/generate-invoice/', views.GenerateLabTestInvoiceView.as_view(), name='generate-lab-test-invoice'),
     path('lab-tests/generate-multiple-invoice/', views.GenerateMultipleLabTestsInvoiceView.as_view(), name='generate-multiple-lab-tests-invoice'),
+
+    # Ledgers
+    path('ledger/invoices/', views.InvoiceLedgerView.as_view(), name='invoice-ledger'),
+    path('ledger/invoices/export/', views.InvoiceLedgerExportView.as_view(), name='invoice-ledger-export'),
+    path('ledger/transactions/', views.TransactionLedgerView.as_view(), name='transaction-ledger'),
+    path('ledger/transactions/export/', views.TransactionLedgerExportView.as_view(), name='transaction-ledger-export'),
 ]
@@ -5,9 +5,16 @@ from rest_framework import status
 from accounts.authentication import JWTAuthentication
 from rest_framework.permissions import IsAuthenticated
 from hospital.permissions import IsAdminStaff
-from .models import Invoice, InvoiceType, Transaction, Unit
+from .models import Invoice, InvoiceItem, InvoiceType, Transaction, Unit
 from .serializers import InvoiceSerializer
+from .invoice_lines import active_lab_test_charges, resolve_invoice_lines
+from .invoice_pdf import invoice_pdf_response
+from .ledger import export_rows, filtered_ledger, ledger_page, ledger_totals
+from django.db import IntegrityError
 from django.shortcuts import get_object_or_404
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from hospital.pagination import parse_page_size
 from hospital.models import Appointment, LabTest, Patient
 import decimal
 
@@ -43,7 +50,9 @@ class InvoiceDetailView(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request, invoice_id):
-        invoice = get_object_or_404(Invoice, invoice_id=invoice_id)
+        invoice = get_object_or_404(
+            Invoice.objects.select_related('invoice_type', 'patient', 'invoice_unit'), invoice_id=invoice_id
+        )
         
         # Check permissions
         if hasattr(request.user, 'patient_id'):
@@ -62,32 +71,7 @@ class InvoiceDetailView(APIView):
         serializer = InvoiceSerializer(invoice)
         
         # Get detailed information about invoice items
-        detailed_items = []
-        for item_id in invoice.invoice_items:
-            if invoice.invoice_type.invoice_type_name == 'appointment':
-                try:
-                    appointment = Appointment.objects.get(appointment_id=item_id)
-                    detailed_items.append({
-                        "item_id": item_id,
-                        "item_type": "appointment",
-                        "doctor_name": appointment.staff.staff_name,
-                        "appointment_date": appointment.created_at.strftime('%Y-%m-%d'),
-                        "slot_time": appointment.slot.slot_start_time.strftime('%H:%M')
-                    })
-                except Appointment.DoesNotExist:
-                    detailed_items.append({"item_id": item_id, "item_type": "appointment", "status": "not found"})
-            elif invoice.invoice_type.invoice_type_name == 'lab_test':
-                try:
-                    lab_test = LabTest.objects.get(lab_test_id=item_id)
-                    detailed_items.append({
-                        "item_id": item_id,
-                        "item_type": "lab_test",
-                        "test_name": lab_test.test_type.test_name,
-                        "lab_name": lab_test.lab.lab_name,
-                        "test_date": lab_test.test_datetime.strftime('%Y-%m-%d')
-                    })
-                except LabTest.DoesNotExist:
-                    detailed_items.append({"item_id": item_id, "item_type": "lab_test", "status": "not found"})
+        detailed_items = resolve_invoice_lines(invoice)
         
         # Add detailed items to the response
         response_data = serializer.data
@@ -103,10 +87,7 @@ class GenerateAppointmentInvoiceView(APIView):
         appointment = get_object_or_404(Appointment, appointment_id=appointment_id)
         
         # Check if invoice already exists for this appointment
-        if Invoice.objects.filter(
-            invoice_type__invoice_type_name='appointment',
-            invoice_items__contains=[appointment_id]
-        ).exists():
+        if InvoiceItem.objects.filter(item_type='appointment', item_id=appointment_id).exists():
             return Response({"error": "Invoice already exists for this appointment"}, status=400)
             
         # Check if transaction exists
@@ -129,19 +110,22 @@ class GenerateAppointmentInvoiceView(APIView):
         tax = subtotal * tax_rate
         total = subtotal + tax
         
-        # Create invoice
-        invoice = Invoice.objects.create(
-            tran=appointment.tran,
-            invoice_type=invoice_type,
-            patient=appointment.patient,
-            invoice_items=[appointment.appointment_id],
-            invoice_subtotal=subtotal,
-            invoice_tax=tax,
-            invoice_total=total,
-            invoice_unit=appointment.charge.charge_unit,
-            invoice_status='paid' if appointment.tran.transaction_status == 'completed' else 'pending',
-            invoice_remark=f"Invoice for appointment on {appointment.created_at.strftime('%Y-%m-%d')}"
-        )
+        # Create invoice (the item index rejects a concurrent duplicate)
+        try:
+            invoice = Invoice.objects.create(
+                tran=appointment.tran,
+                invoice_type=invoice_type,
+                patient=appointment.patient,
+                invoice_items=[appointment.appointment_id],
+                invoice_subtotal=subtotal,
+                invoice_tax=tax,
+                invoice_total=total,
+                invoice_unit=appointment.charge.charge_unit,
+                invoice_status='paid' if appointment.tran.transaction_status == 'completed' else 'pending',
+                invoice_remark=f"Invoice for appointment on {appointment.created_at.strftime('%Y-%m-%d')}"
+            )
+        except IntegrityError:
+            return Response({"error": "Invoice already exists for this appointment"}, status=400)
         
         serializer = InvoiceSerializer(invoice)
         return Response(serializer.data, status=201)
@@ -154,10 +138,7 @@ class GenerateLabTestInvoiceView(APIView):
         lab_test = get_object_or_404(LabTest, lab_test_id=lab_test_id)
         
         # Check if invoice already exists for this lab test
-        if Invoice.objects.filter(
-            invoice_type__invoice_type_name='lab_test',
-            invoice_items__contains=[lab_test_id]
-        ).exists():
+        if InvoiceItem.objects.filter(item_type='lab_test', item_id=lab_test_id).exists():
             return Response({"error": "Invoice already exists for this lab test"}, status=400)
             
         # Check if transaction exists
@@ -183,19 +164,22 @@ class GenerateLabTestInvoiceView(APIView):
         tax = subtotal * tax_rate
         total = subtotal + tax
         
-        # Create invoice
-        invoice = Invoice.objects.create(
-            tran=lab_test.tran,
-            invoice_type=invoice_type,
-            patient=lab_test.appointment.patient,
-            invoice_items=[lab_test.lab_test_id],
-            invoice_subtotal=subtotal,
-            invoice_tax=tax,
-            invoice_total=total,
-            invoice_unit=charge.charge_unit,
-            invoice_status='paid' if lab_test.tran.transaction_status == 'completed' else 'pending',
-            invoice_remark=f"Invoice for {lab_test.test_type.test_name} on {lab_test.test_datetime.strftime('%Y-%m-%d')}"
-        )
+        # Create invoice (the item index rejects a concurrent duplicate)
+        try:
+            invoice = Invoice.objects.create(
+                tran=lab_test.tran,
+                invoice_type=invoice_type,
+                patient=lab_test.appointment.patient,
+                invoice_items=[lab_test.lab_test_id],
+                invoice_subtotal=subtotal,
+                invoice_tax=tax,
+                invoice_total=total,
+                invoice_unit=charge.charge_unit,
+                invoice_status='paid' if lab_test.tran.transaction_status == 'completed' else 'pending',
+                invoice_remark=f"Invoice for {lab_test.test_type.test_name} on {lab_test.test_datetime.strftime('%Y-%m-%d')}"
+            )
+        except IntegrityError:
+            return Response({"error": "Invoice already exists for this lab test"}, status=400)
         
         serializer = InvoiceSerializer(invoice)
         return Response(serializer.data, status=201)
@@ -221,66 +205,69 @@ class GenerateMultipleLabTestsInvoiceView(APIView):
             return Response({"error": f"Patient with ID {patient_id} not found"}, status=400)
             
         # Check if all lab tests exist and belong to the patient
+        try:
+            lab_test_ids = list(dict.fromkeys(int(test_id) for test_id in lab_test_ids))
+        except (TypeError, ValueError):
+            return Response({"error": "Lab test IDs must be integers"}, status=400)
+        found = LabTest.objects.select_related('appointment', 'tran').in_bulk(lab_test_ids)
         lab_tests = []
         for test_id in lab_test_ids:
-            try:
-                test = LabTest.objects.get(lab_test_id=test_id)
-                if test.appointment.patient.patient_id != patient.patient_id:
-                    return Response({"error": f"Lab test {test_id} does not belong to this patient"}, status=400)
-                if not test.tran:
-                    return Response({"error": f"Lab test {test_id} has no transaction"}, status=400)
-                lab_tests.append(test)
-            except LabTest.DoesNotExist:
+            test = found.get(test_id)
+            if test is None:
                 return Response({"error": f"Lab test with ID {test_id} not found"}, status=400)
-                
+            if test.appointment.patient_id != patient.patient_id:
+                return Response({"error": f"Lab test {test_id} does not belong to this patient"}, status=400)
+            if not test.tran:
+                return Response({"error": f"Lab test {test_id} has no transaction"}, status=400)
+            lab_tests.append(test)
+
         # Check if any of these tests already have invoices
-        for test in lab_tests:
-            if Invoice.objects.filter(
-                invoice_type__invoice_type_name='lab_test',
-                invoice_items__contains=[test.lab_test_id]
-            ).exists():
-                return Response({"error": f"Invoice already exists for lab test {test.lab_test_id}"}, status=400)
-                
+        invoiced = InvoiceItem.objects.filter(item_type='lab_test', item_id__in=lab_test_ids).values_list('item_id', flat=True).first()
+        if invoiced is not None:
+            return Response({"error": f"Invoice already exists for lab test {invoiced}"}, status=400)
+
         # Get invoice type
         try:
             invoice_type = InvoiceType.objects.get(invoice_type_name='lab_test')
         except InvoiceType.DoesNotExist:
             return Response({"error": "Lab test invoice type not found"}, status=400)
-            
+
         # Calculate totals
-        from hospital.models import LabTestCharge
+        charges = active_lab_test_charges(test.test_type_id for test in lab_tests)
         subtotal = decimal.Decimal('0.00')
         unit = None
-        
+
         for test in lab_tests:
-            try:
-                charge = LabTestCharge.objects.get(test=test.test_type, is_active=True)
-                subtotal += charge.charge_amount
-                if unit is None:
-                    unit = charge.charge_unit
-                elif unit.unit_id != charge.charge_unit.unit_id:
-                    return Response({"error": "Cannot create invoice with different currency units"}, status=400)
-            except LabTestCharge.DoesNotExist:
+            charge = charges.get(test.test_type_id)
+            if charge is None:
                 return Response({"error": f"No charge information found for lab test {test.lab_test_id}"}, status=400)
-                
+            subtotal += charge.charge_amount
+            if unit is None:
+                unit = charge.charge_unit
+            elif unit.unit_id != charge.charge_unit_id:
+                return Response({"error": "Cannot create invoice with different currency units"}, status=400)
+
         # Calculate tax (assuming 5% tax)
         tax_rate = decimal.Decimal('0.05')
         tax = subtotal * tax_rate
         total = subtotal + tax
         
-        # Create invoice
-        invoice = Invoice.objects.create(
-            tran=lab_tests[0].tran,  # Use the first test's transaction
-            invoice_type=invoice_type,
-            patient=patient,
-            invoice_items=[test.lab_test_id for test in lab_tests],
-            invoice_subtotal=subtotal,
-            invoice_tax=tax,
-            invoice_total=total,
-            invoice_unit=unit,
-            invoice_status='paid',
-            invoice_remark=f"Invoice for multiple lab tests on {lab_tests[0].test_datetime.strftime('%Y-%m-%d')}"
-        )
+        # Create invoice (the item index rejects a concurrent duplicate)
+        try:
+            invoice = Invoice.objects.create(
+                tran=lab_tests[0].tran,  # Use the first test's transaction
+                invoice_type=invoice_type,
+                patient=patient,
+                invoice_items=[test.lab_test_id for test in lab_tests],
+                invoice_subtotal=subtotal,
+                invoice_tax=tax,
+                invoice_total=total,
+                invoice_unit=unit,
+                invoice_status='paid',
+                invoice_remark=f"Invoice for multiple lab tests on {lab_tests[0].test_datetime.strftime('%Y-%m-%d')}"
+            )
+        except IntegrityError:
+            return Response({"error": "Invoice already exists for one of these lab tests"}, status=400)
         
         serializer = InvoiceSerializer(invoice)
         return Response(serializer.data, status=201)
@@ -329,17 +316,14 @@ class PatientInvoicesView(APIView):
         serializer = InvoiceSerializer(invoices, many=True)
         return Response(serializer.data, status=200)
 
-from django.http import HttpResponse
-from django.template.loader import render_to_string
-from weasyprint import HTML
-import tempfile
-
 class GenerateInvoicePDFView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     def get(self, request, invoice_id):
-        invoice = get_object_or_404(Invoice, invoice_id=invoice_id)
+        invoice = get_object_or_404(
+            Invoice.objects.select_related('invoice_type', 'patient', 'invoice_unit'), invoice_id=invoice_id
+        )
         
         # Check permissions
         if hasattr(request.user, 'patient_id'):
@@ -355,59 +339,93 @@ class GenerateInvoicePDFView(APIView):
         else:
             return Response({"error": "Invalid user"}, status=403)
             
-        # Get detailed information about invoice items
-        detailed_items = []
-        for item_id in invoice.invoice_items:
-            if invoice.invoice_type.invoice_type_name == 'appointment':
-                try:
-                    appointment = Appointment.objects.get(appointment_id=item_id)
-                    detailed_items.append({
-                        "item_id": item_id,
-                        "item_type": "appointment",
-                        "doctor_name": appointment.staff.staff_name,
-                        "appointment_date": appointment.created_at.strftime('%Y-%m-%d'),
-                        "slot_time": appointment.slot.slot_start_time.strftime('%H:%M'),
-                        "amount": appointment.charge.charge_amount
-                    })
-                except Appointment.DoesNotExist:
-                    pass
-            elif invoice.invoice_type.invoice_type_name == 'lab_test':
-                try:
-                    lab_test = LabTest.objects.get(lab_test_id=item_id)
-                    from hospital.models import LabTestCharge
-                    charge = LabTestCharge.objects.get(test=lab_test.test_type, is_active=True)
-                    detailed_items.append({
-                        "item_id": item_id,
-                        "item_type": "lab_test",
-                        "test_name": lab_test.test_type.test_name,
-                        "lab_name": lab_test.lab.lab_name,
-                        "test_date": lab_test.test_datetime.strftime('%Y-%m-%d'),
-                        "amount": charge.charge_amount
-                    })
-                except (LabTest.DoesNotExist, LabTestCharge.DoesNotExist):
-                    pass
-        
-        # Prepare context for the template
-        context = {
-            'invoice': invoice,
-            'detailed_items': detailed_items,
-            'hospital_name': 'Your Hospital Name',
-            'hospital_address': 'Your Hospital Address',
-            'hospital_phone': 'Your Hospital Phone',
-            'hospital_email': 'your@hospital.com'
-        }
-        
-        # Render HTML
-        html_string = render_to_string('invoice_template.html', context)
-        
-        # Generate PDF
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="invoice_{invoice.invoice_number}.pdf"'
-        
-        with tempfile.NamedTemporaryFile(suffix='.html') as temp:
-            temp.write(html_string.encode('utf-8'))
-            temp.flush()
-            HTML(filename=temp.name).write_pdf(response)
-            
+        return invoice_pdf_response(invoice)
+
+
+def _ledger_patient_scope(request):
+    """
+    (patient_id to restrict to, error response): patients only see their own
+    rows, admins see everything
+    """
+    if hasattr(request.user, 'patient_id'):
+        return request.user.patient_id, None
+    if hasattr(request.user, 'staff_id'):
+        try:
+            if request.user.role.role_permissions.get('is_admin', False):
+                return None, None
+        except Exception:
+            pass
+        return None, Response({"error": "Not authorized to view the ledger"}, status=403)
+    return None, Response({"error": "Invalid user"}, status=403)
+
+
+class LedgerView(APIView):
+    """
+    Keyset-paginated ledger, newest first, with count and per-unit totals for the whole filtered set
+
+    Query params: from, to (YYYY-MM-DD, inclusive), status, type, patient_id,
+    unit_id (transactions also payment_method_id), cursor, limit
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    kind = None
+
+    def get(self, request):
+        patient_id, error = _ledger_patient_scope(request)
+        if error:
+            return error
+        try:
+            limit = parse_page_size(request.query_params.get('limit'))
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=400)
+        try:
+            queryset = filtered_ledger(self.kind, request.query_params, patient_id)
+            results, next_cursor = ledger_page(self.kind, queryset, request.query_params.get('cursor'), limit)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+        count, totals = ledger_totals(self.kind, queryset)
+        return Response({
+            "results": results,
+            "count": count,
+            "totals": totals,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None
+        }, status=200)
+
+
+class LedgerExportView(APIView):
+    """
+    The whole filtered ledger as a streamed CSV download (same filters as LedgerView)
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    kind = None
+
+    def get(self, request):
+        patient_id, error = _ledger_patient_scope(request)
+        if error:
+            return error
+        try:
+            queryset = filtered_ledger(self.kind, request.query_params, patient_id)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+        response = StreamingHttpResponse(export_rows(self.kind, queryset), content_type='text/csv')
+        filename = f"{self.kind}_{timezone.localdate():%Y%m%d}.csv"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
         return response
 
+
+class InvoiceLedgerView(LedgerView):
+    kind = 'invoices'
+
+
+class TransactionLedgerView(LedgerView):
+    kind = 'transactions'
+
+
+class InvoiceLedgerExportView(LedgerExportView):
+    kind = 'invoices'
+
+
+class TransactionLedgerExportView(LedgerExportView):
+    kind = 'transactions'